@@ -1,67 +1,151 @@
 #!/usr/bin/env python3
-import requests
+"""
+Deploy Firestore security rules to one or many projects
+The rules source is hashed and compared with the ruleset currently released
+to cloud.firestore; projects already serving the same source are skipped, so
+re-running a rollout only touches projects that are behind. Projects are
+handled concurrently with one in-process credential instead of shelling out
+to gcloud for a token.
+
+Usage: python deploy-firestore-rules.py --projects testdada-n73m,montest2-rtvn
+       python deploy-firestore-rules.py --deployments validation/deployments.json --dry-run
+"""
+
+import argparse
+import hashlib
 import json
-import subprocess
-import base64
-
-# Get access token
-result = subprocess.run(['gcloud', 'auth', 'print-access-token'], capture_output=True, text=True)
-access_token = result.stdout.strip()
-
-project_id = 'testdada-n73m'
-
-# Read the rules file
-with open('firestore-rules/firestore.rules', 'r') as f:
-    rules_content = f.read()
-
-print("Deploying Firestore rules to project:", project_id)
-print("Rules preview (first 500 chars):")
-print(rules_content[:500])
-print("...")
-
-# Create a ruleset
-url = f'https://firebaserules.googleapis.com/v1/projects/{project_id}/rulesets'
-headers = {
-    'Authorization': f'Bearer {access_token}',
-    'Content-Type': 'application/json'
-}
-
-# Create the ruleset
-ruleset_data = {
-    'source': {
-        'files': [
-            {
-                'name': 'firestore.rules',
-                'content': rules_content
-            }
-        ]
-    }
-}
-
-print("\nCreating ruleset...")
-response = requests.post(url, headers=headers, json=ruleset_data)
-if response.status_code != 200:
-    print(f"Error creating ruleset: {response.status_code}")
-    print(response.text)
-    exit(1)
-
-ruleset_name = response.json()['name']
-print(f"Created ruleset: {ruleset_name}")
-
-# Now release the ruleset to Firestore
-release_url = f'https://firebaserules.googleapis.com/v1/projects/{project_id}/releases'
-release_data = {
-    'name': f'projects/{project_id}/releases/cloud.firestore',
-    'rulesetName': ruleset_name
-}
-
-print("\nReleasing ruleset to Firestore...")
-response = requests.patch(f'{release_url}/cloud.firestore', headers=headers, json=release_data)
-if response.status_code != 200:
-    print(f"Error releasing ruleset: {response.status_code}")
-    print(response.text)
-    exit(1)
-
-print("✅ Firestore rules deployed successfully!")
-print("\n⚠️  IMPORTANT: These rules are temporarily relaxed for testing!")
-print("Remember to revert to secure rules after fixing the authentication flow.")
\ No newline at end of file
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import google.auth
+from google.auth.transport.requests import AuthorizedSession, Request
+
+RULES_API = 'https://firebaserules.googleapis.com/v1'
+SCOPES = ['https://www.googleapis.com/auth/cloud-platform']
+RULES_FILE_NAME = 'firestore.rules'
+
+UNCHANGED = 'unchanged'
+DEPLOYED = 'deployed'
+OUTDATED = 'outdated'
+FAILED = 'failed'
+
+
+def source_hash(content: str) -> str:
+    return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+
+def release_name(project_id: str, database: str) -> str:
+    """cloud.firestore for the default database, cloud.firestore/<id> otherwise"""
+    suffix = 'cloud.firestore' if database == '(default)' else f'cloud.firestore/{database}'
+    return f'projects/{project_id}/releases/{suffix}'
+
+
+def released_hash(session: AuthorizedSession, project_id: str, database: str):
+    """(release exists, hash of the released rules source or None)"""
+    response = session.get(f'{RULES_API}/{release_name(project_id, database)}', timeout=30)
+    if response.status_code == 404:
+        return False, None
+    response.raise_for_status()
+    ruleset = session.get(f"{RULES_API}/{response.json()['rulesetName']}", timeout=30)
+    ruleset.raise_for_status()
+    files = ruleset.json().get('source', {}).get('files', [])
+    return True, source_hash(files[0]['content']) if len(files) == 1 else None
+
+
+def deploy_project(credentials, project_id: str, rules_content: str, database: str = '(default)',
+                   force: bool = False, dry_run: bool = False) -> dict:
+    """Release rules_content to one project unless it is already live; never raises"""
+    started = time.perf_counter()
+    result = {'project_id': project_id, 'database': database}
+    try:
+        with AuthorizedSession(credentials) as session:
+            exists, current = released_hash(session, project_id, database)
+            result['previous_hash'] = current
+            if current == source_hash(rules_content) and not force:
+                result['status'] = UNCHANGED
+            elif dry_run:
+                result['status'] = OUTDATED
+            else:
+                response = session.post(
+                    f'{RULES_API}/projects/{project_id}/rulesets', timeout=30,
+                    json={'source': {'files': [{'name': RULES_FILE_NAME, 'content': rules_content}]}})
+                response.raise_for_status()
+                ruleset_name = response.json()['name']
+
+                release = {'name': release_name(project_id, database), 'rulesetName': ruleset_name}
+                if exists:
+                    response = session.patch(f"{RULES_API}/{release['name']}", timeout=30,
+                                             json={'release': release})
+                else:
+                    response = session.post(f'{RULES_API}/projects/{project_id}/releases', timeout=30,
+                                            json=release)
+                response.raise_for_status()
+                result['status'] = DEPLOYED
+                result['ruleset'] = ruleset_name
+    except Exception as e:
+        result['status'] = FAILED
+        result['error'] = str(e)[:300]
+    result['elapsed_seconds'] = round(time.perf_counter() - started, 3)
+    return result
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description='Deploy Firestore rules where they changed')
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument('--projects', help='comma separated project IDs')
+    target.add_argument('--deployments', help='deployments JSON as used by python -m validation fleet')
+    parser.add_argument('--rules', default='firestore-rules/firestore.rules', help='rules source file')
+    parser.add_argument('--database', default='(default)', help='Firestore database ID')
+    parser.add_argument('--concurrency', type=int, default=16, help='projects deployed at once')
+    parser.add_argument('--force', action='store_true', help='release even if the rules are unchanged')
+    parser.add_argument('--dry-run', action='store_true', help='only report which projects are outdated')
+    parser.add_argument('--report', help='where to write a JSON report')
+    args = parser.parse_args(argv)
+
+    if args.projects:
+        project_ids = [p.strip() for p in args.projects.split(',') if p.strip()]
+    else:
+        from validation.fleet import load_deployments
+        project_ids = [d['PROJECT_ID'] for d in load_deployments(args.deployments) if d.get('PROJECT_ID')]
+
+    with open(args.rules, 'r') as f:
+        rules_content = f.read()
+
+    # One credential for every project; refreshed here so an auth problem fails fast
+    credentials, _ = google.auth.default(scopes=SCOPES)
+    credentials.refresh(Request())
+
+    print(f"🔐 Rolling out {args.rules} (sha256 {source_hash(rules_content)[:12]}) "
+          f"to {len(project_ids)} projects")
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max(1, min(args.concurrency, len(project_ids)))) as pool:
+        results = list(pool.map(
+            lambda project_id: deploy_project(credentials, project_id, rules_content, args.database,
+                                              force=args.force, dry_run=args.dry_run),
+            project_ids))
+    elapsed = time.perf_counter() - started
+
+    emoji = {UNCHANGED: '⏭️ ', DEPLOYED: '✅', OUTDATED: '📝', FAILED: '❌'}
+    print(f"\n   {'project':<32} {'status':<10} {'seconds':>8}")
+    for result in results:
+        print(f"   {result['project_id']:<32} {result['status']:<10} "
+              f"{result['elapsed_seconds']:8.2f} {emoji[result['status']]}")
+        if result.get('error'):
+            print(f"      {result['error'][:120]}")
+    counts = {status: sum(r['status'] == status for r in results)
+              for status in (DEPLOYED, UNCHANGED, OUTDATED, FAILED)}
+    print(f"\n   {counts}, wall time {elapsed:.2f}s")
+
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump({'timestamp': datetime.now().isoformat(), 'rules': args.rules,
+                       'rules_hash': source_hash(rules_content), 'elapsed_seconds': round(elapsed, 3),
+                       'results': results}, f, indent=2)
+        print(f"💾 Report saved to: {args.report}")
+    return 1 if counts[FAILED] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,439 @@
+"""
+Asynchronous analysis jobs for the AI proxy
+Work that needn't be interactive, such as reviewing a day of a camera's
+captures, is submitted as a job: its items are spooled as a JSONL batch
+prediction input and the job document (ai_analysis_jobs/{job_id}) tracks
+progress. A scheduled worker then either
+
+- runs 'offpeak' jobs item by item through the shared key pool, only during
+  the off-peak hours, so they don't compete with interactive traffic, or
+- submits 'batch' jobs to Vertex AI batch prediction and ingests its output
+  once the batch job has finished.
+
+Results land in ai_analysis_jobs/{job_id}/results/{index}, read back a page at
+a time; a callback URL on an allowed host, when given, is notified once the
+job is done. The spool is GCS in production and a local directory (file://
+URIs) in tests.
+
+A job's items are reserved against the device's quota when it is submitted
+and counted one by one as they are processed; whatever a job ends without
+processing (a failed batch, or expiry before the worker got to it) is given
+back through release_quota.
+"""
+
+import json
+import logging
+import os
+import uuid
+from datetime import datetime, timedelta
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+from urllib.parse import urlparse
+
+import requests
+from google.cloud import firestore
+
+from deadlines import Deadline
+
+logger = logging.getLogger(__name__)
+
+JOBS_COLLECTION = 'ai_analysis_jobs'
+RESULTS_COLLECTION = 'results'
+
+OFFPEAK = 'offpeak'
+BATCH = 'batch'
+MODES = {OFFPEAK, BATCH}
+
+QUEUED = 'queued'
+RUNNING = 'running'
+SUCCEEDED = 'succeeded'
+FAILED = 'failed'
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+# Results are committed this many at a time, with the job's progress
+RESULTS_PER_COMMIT = 20
+# An off-peak item isn't started with less time than this left in the run
+MIN_ITEM_SECONDS = 35
+# Unfinished jobs are ended this long before the TTL policy may delete them
+GIVE_UP_BEFORE_EXPIRY = timedelta(hours=1)
+
+BATCH_DONE_STATES = {'JOB_STATE_SUCCEEDED', 'JOB_STATE_PARTIALLY_SUCCEEDED'}
+BATCH_FAILED_STATES = {'JOB_STATE_FAILED', 'JOB_STATE_CANCELLED', 'JOB_STATE_EXPIRED'}
+
+
+class JobError(ValueError):
+    """Invalid job submission or query"""
+
+
+def parse_hours(spec: str) -> Set[int]:
+    """UTC hours from "start-end" ranges (end exclusive, may wrap midnight), e.g. "22-6,13-14" """
+    hours = set()
+    for part in filter(None, (p.strip() for p in spec.split(','))):
+        start, _, end = part.partition('-')
+        start, end = int(start) % 24, int(end or int(start) + 1) % 24
+        hour = start
+        while True:
+            hours.add(hour)
+            hour = (hour + 1) % 24
+            if hour == end:
+                break
+    return hours
+
+
+class LocalSpool:
+    """Spool in a local directory, addressed by file:// URIs"""
+
+    def __init__(self, directory: str):
+        self.directory = os.path.abspath(directory)
+
+    def uri(self, name: str) -> str:
+        return f"file://{os.path.join(self.directory, name)}"
+
+    def write_lines(self, name: str, lines: List[dict]) -> str:
+        path = os.path.join(self.directory, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as f:
+            f.writelines(json.dumps(line) + '\n' for line in lines)
+        return self.uri(name)
+
+    def read_lines(self, uri: str) -> List[dict]:
+        with open(urlparse(uri).path) as f:
+            return [json.loads(line) for line in f if line.strip()]
+
+    def list(self, uri_prefix: str) -> List[str]:
+        prefix = urlparse(uri_prefix).path
+        root = prefix if os.path.isdir(prefix) else os.path.dirname(prefix)
+        found = []
+        for directory, _, files in os.walk(root):
+            found += [os.path.join(directory, f) for f in files if os.path.join(directory, f).startswith(prefix)]
+        return [f"file://{path}" for path in sorted(found)]
+
+
+class GcsSpool:
+    """Spool in a GCS bucket, addressed by gs:// URIs"""
+
+    def __init__(self, client, bucket_name: str, prefix: str = 'ai-jobs'):
+        self.client = client
+        self.bucket = client.bucket(bucket_name)
+        self.prefix = prefix.strip('/')
+
+    def uri(self, name: str) -> str:
+        return f"gs://{self.bucket.name}/{self.prefix}/{name}"
+
+    def write_lines(self, name: str, lines: List[dict]) -> str:
+        blob = self.bucket.blob(f"{self.prefix}/{name}")
+        blob.upload_from_string(''.join(json.dumps(line) + '\n' for line in lines),
+                                content_type='application/jsonl')
+        return self.uri(name)
+
+    def read_lines(self, uri: str) -> List[dict]:
+        parsed = urlparse(uri)
+        raw = self.client.bucket(parsed.netloc).blob(parsed.path.lstrip('/')).download_as_text()
+        return [json.loads(line) for line in raw.splitlines() if line.strip()]
+
+    def list(self, uri_prefix: str) -> List[str]:
+        parsed = urlparse(uri_prefix)
+        return [f"gs://{parsed.netloc}/{blob.name}"
+                for blob in self.client.list_blobs(parsed.netloc, prefix=parsed.path.lstrip('/'))]
+
+
+class VertexBatchPrediction:
+    """Minimal REST client for Vertex AI batchPredictionJobs"""
+
+    def __init__(self, api_template: str, project_id: str, region: str, token: Callable[[], str]):
+        self.base_url = api_template.format(region=region).rstrip('/')
+        self.parent = f"projects/{project_id}/locations/{region}"
+        self.token = token
+
+    def _headers(self) -> dict:
+        return {'Authorization': f"Bearer {self.token()}", 'Content-Type': 'application/json'}
+
+    def create(self, display_name: str, model: str, input_uri: str, output_prefix: str) -> str:
+        """Start a batch job; returns its resource name"""
+        response = requests.post(f"{self.base_url}/{self.parent}/batchPredictionJobs", headers=self._headers(),
+                                 json={
+                                     'displayName': display_name,
+                                     'model': f"publishers/google/models/{model}",
+                                     'inputConfig': {'instancesFormat': 'jsonl',
+                                                     'gcsSource': {'uris': [input_uri]}},
+                                     'outputConfig': {'predictionsFormat': 'jsonl',
+                                                      'gcsDestination': {'outputUriPrefix': output_prefix}}
+                                 }, timeout=30)
+        response.raise_for_status()
+        return response.json()['name']
+
+    def get(self, name: str) -> dict:
+        response = requests.get(f"{self.base_url}/{name}", headers=self._headers(), timeout=30)
+        response.raise_for_status()
+        return response.json()
+
+
+def validate_items(items, max_items: int) -> List[dict]:
+    """Spool lines for submitted items; each is an ai_proxy-style generateContent body"""
+    if not isinstance(items, list) or not items:
+        raise JobError('items must be a non-empty list')
+    if len(items) > max_items:
+        raise JobError(f'At most {max_items} items per job')
+    lines = []
+    for index, item in enumerate(items):
+        if not isinstance(item, dict) or not isinstance(item.get('contents'), list) or not item['contents']:
+            raise JobError(f'Item {index} needs a non-empty contents list')
+        request = {'contents': item['contents'], 'labels': {'item': str(index)}}
+        if isinstance(item.get('generationConfig'), dict):
+            request['generationConfig'] = item['generationConfig']
+        lines.append({'request': request})
+    return lines
+
+
+class AnalysisJobs:
+    """Job submission, progress and results over Firestore and a spool"""
+
+    def __init__(self, db: firestore.Client, spool, analyze: Callable[[dict, Deadline], dict],
+                 batch_client: Optional[VertexBatchPrediction] = None,
+                 record_usage: Optional[Callable[[dict, bool, int], None]] = None,
+                 release_quota: Optional[Callable[[dict, int], None]] = None,
+                 ttl: timedelta = timedelta(days=7), callback_schemes: Tuple[str, ...] = ('https',),
+                 callback_hosts: Iterable[str] = ()):
+        """analyze(request_data, deadline) makes one ai_proxy-style upstream call;
+        record_usage(job, success, tokens_used) counts one processed item and
+        release_quota(job, count) returns the reservations of unprocessed ones"""
+        self.db = db
+        self.spool = spool
+        self.analyze = analyze
+        self.batch_client = batch_client
+        self.record_usage = record_usage
+        self.release_quota = release_quota
+        self.ttl = ttl
+        self.callback_schemes = callback_schemes
+        self.callback_hosts = frozenset(host.lower() for host in callback_hosts)
+
+    def _job_ref(self, job_id: str):
+        return self.db.collection(JOBS_COLLECTION).document(job_id)
+
+    def create(self, device_id: str, network: str, items, model: str, mode: str = OFFPEAK,
+               callback_url: Optional[str] = None, max_items: int = 1000) -> dict:
+        """Spool the items and queue the job; returns its summary"""
+        if mode not in MODES:
+            raise JobError(f"mode must be one of {sorted(MODES)}")
+        if mode == BATCH and self.batch_client is None:
+            raise JobError('Batch mode is not configured')
+        if callback_url is not None:
+            parsed = urlparse(callback_url) if isinstance(callback_url, str) else None
+            if parsed is None or parsed.scheme not in self.callback_schemes or not parsed.hostname:
+                raise JobError(f"callback_url must be an absolute {'/'.join(self.callback_schemes)} URL")
+            if parsed.hostname.lower() not in self.callback_hosts:
+                raise JobError('callback_url host is not allowed')
+        lines = validate_items(items, max_items)
+
+        job_id = uuid.uuid4().hex
+        now = datetime.utcnow()
+        job = {
+            'device_id': device_id,
+            'network': network,
+            'model': model,
+            'mode': mode,
+            'state': QUEUED,
+            'item_count': len(lines),
+            'next_item': 0,
+            'succeeded': 0,
+            'failed': 0,
+            'input_uri': self.spool.write_lines(f"{job_id}/input.jsonl", lines),
+            'output_prefix': self.spool.uri(f"{job_id}/output/"),
+            'callback_url': callback_url,
+            'created_at': now,
+            'updated_at': now,
+            'expires_at': now + self.ttl
+        }
+        self._job_ref(job_id).set(job)
+        return self.summary(job_id, job)
+
+    @staticmethod
+    def summary(job_id: str, job: dict) -> dict:
+        completed_at = job.get('completed_at')
+        return {
+            'job_id': job_id,
+            'state': job['state'],
+            'mode': job['mode'],
+            'model': job['model'],
+            'item_count': job['item_count'],
+            'succeeded': job.get('succeeded', 0),
+            'failed': job.get('failed', 0),
+            'created_at': job['created_at'].isoformat(),
+            'completed_at': completed_at.isoformat() if completed_at else None
+        }
+
+    def get(self, job_id: str) -> Optional[dict]:
+        snapshot = self._job_ref(job_id).get()
+        return snapshot.to_dict() if snapshot.exists else None
+
+    def results_page(self, job_id: str, page_token: Optional[str] = None,
+                     page_size: int = DEFAULT_PAGE_SIZE) -> Tuple[List[dict], Optional[str]]:
+        """Stored results in item order from page_token; the token for the next page or None"""
+        try:
+            start = int(page_token) if page_token else 0
+        except ValueError:
+            raise JobError('Invalid page_token')
+        page_size = max(1, min(page_size, MAX_PAGE_SIZE))
+        query = (self._job_ref(job_id).collection(RESULTS_COLLECTION)
+                 .where('index', '>=', start).order_by('index').limit(page_size + 1))
+        results = [snapshot.to_dict() for snapshot in query.get()]
+        for result in results:
+            result.pop('expires_at', None)
+        if len(results) > page_size:
+            return results[:page_size], str(results[page_size]['index'])
+        return results, None
+
+    def _store(self, job_id: str, results: List[Tuple[int, dict]], progress: dict):
+        """Write results and the job's progress in one commit"""
+        job_ref = self._job_ref(job_id)
+        expires_at = datetime.utcnow() + self.ttl
+        batch = self.db.batch()
+        for index, result in results:
+            entry = {'index': index, 'success': result['success'], 'tokens_used': result.get('tokens_used', 0),
+                     'expires_at': expires_at}
+            if result['success']:
+                entry['response'] = result['response']
+            else:
+                entry['error'] = result.get('error', 'Analysis failed')
+            batch.set(job_ref.collection(RESULTS_COLLECTION).document(f"{index:06d}"), entry)
+        succeeded = sum(1 for _, result in results if result['success'])
+        progress.update({
+            'succeeded': firestore.Increment(succeeded),
+            'failed': firestore.Increment(len(results) - succeeded),
+            'updated_at': datetime.utcnow()
+        })
+        batch.set(job_ref, progress, merge=True)
+        batch.commit()
+
+    def run(self, deadline: Deadline, offpeak: bool, max_items: int = 500) -> Dict[str, int]:
+        """Advance unfinished jobs: poll batch jobs, and run off-peak items while offpeak"""
+        stats = {'jobs': 0, 'items': 0, 'completed': 0, 'failed': 0, 'expired': 0, 'errors': 0}
+        now = datetime.utcnow()
+        snapshots = self.db.collection(JOBS_COLLECTION).where('state', 'in', [QUEUED, RUNNING]).get()
+        for snapshot in sorted(snapshots, key=lambda s: s.get('created_at')):
+            if deadline.remaining() < MIN_ITEM_SECONDS:
+                break
+            job = snapshot.to_dict()
+            # Ended here rather than by the TTL policy, so its unused reservations are given back
+            expires_at = job.get('expires_at')
+            if expires_at and expires_at.replace(tzinfo=None) - GIVE_UP_BEFORE_EXPIRY <= now:
+                stats['expired'] += 1
+                self._finish(snapshot.id, FAILED)
+                continue
+            if job['mode'] == OFFPEAK and (not offpeak or stats['items'] >= max_items):
+                continue
+            stats['jobs'] += 1
+            try:
+                if job['mode'] == BATCH:
+                    state = self._advance_batch(snapshot.id, job)
+                else:
+                    processed, state = self._advance_offpeak(snapshot.id, job, deadline,
+                                                             max_items - stats['items'])
+                    stats['items'] += processed
+            except Exception as e:
+                # Left as it is for the next run; expires_at bounds how long it is retried
+                logger.error(f"Analysis job {snapshot.id} could not be advanced: {e}")
+                stats['errors'] += 1
+                continue
+            if state in (SUCCEEDED, FAILED):
+                stats['completed' if state == SUCCEEDED else 'failed'] += 1
+                self._finish(snapshot.id, state)
+        return stats
+
+    def _advance_offpeak(self, job_id: str, job: dict, deadline: Deadline, budget: int) -> Tuple[int, str]:
+        """Run items from next_item until the budget, the run or the key pool gives out"""
+        lines = self.spool.read_lines(job['input_uri'])
+        index = job.get('next_item', 0)
+        pending = []
+        processed = 0
+        while index < len(lines) and processed < budget and deadline.remaining() >= MIN_ITEM_SECONDS:
+            request_data = {field: value for field, value in lines[index]['request'].items() if field != 'labels'}
+            request_data['model'] = job['model']
+            result = self.analyze(request_data, deadline)
+            # No capacity right now: leave the item for a later run
+            if result.get('unavailable') or result.get('throttled') or result.get('deadline_exceeded'):
+                break
+            if self.record_usage:
+                self.record_usage(job, result['success'], result.get('tokens_used', 0))
+            pending.append((index, result))
+            index += 1
+            processed += 1
+            if len(pending) >= RESULTS_PER_COMMIT:
+                self._store(job_id, pending, {'state': RUNNING, 'next_item': index})
+                pending = []
+        if pending or job['state'] == QUEUED:
+            self._store(job_id, pending, {'state': RUNNING, 'next_item': index})
+        return processed, SUCCEEDED if index >= len(lines) else RUNNING
+
+    def _advance_batch(self, job_id: str, job: dict) -> str:
+        """Submit the batch job, or ingest its output once it has finished"""
+        if not job.get('batch_job'):
+            name = self.batch_client.create(f"ai-proxy-{job_id}", job['model'], job['input_uri'],
+                                            job['output_prefix'])
+            self._job_ref(job_id).set({'state': RUNNING, 'batch_job': name, 'updated_at': datetime.utcnow()},
+                                      merge=True)
+            return RUNNING
+
+        batch_job = self.batch_client.get(job['batch_job'])
+        state = batch_job.get('state')
+        if state in BATCH_FAILED_STATES:
+            logger.error(f"Batch prediction for job {job_id} ended in {state}: {batch_job.get('error')}")
+            return FAILED
+        if state not in BATCH_DONE_STATES:
+            return RUNNING
+
+        output_dir = batch_job.get('outputInfo', {}).get('gcsOutputDirectory', job['output_prefix'])
+        results = {}
+        for uri in self.spool.list(output_dir):
+            if not uri.endswith('.jsonl'):
+                continue
+            for position, line in enumerate(self.spool.read_lines(uri)):
+                label = line.get('request', {}).get('labels', {}).get('item')
+                index = int(label) if label is not None else position
+                response = line.get('response')
+                if response and not line.get('status'):
+                    tokens = response.get('usageMetadata', {}).get('totalTokenCount', 0)
+                    results[index] = {'success': True, 'response': response, 'tokens_used': tokens}
+                else:
+                    results[index] = {'success': False, 'error': line.get('status') or 'No response'}
+        for index in range(job['item_count']):
+            results.setdefault(index, {'success': False, 'error': 'Missing from batch output'})
+
+        ordered = sorted(results.items())
+        for start in range(0, len(ordered), RESULTS_PER_COMMIT):
+            chunk = ordered[start:start + RESULTS_PER_COMMIT]
+            self._store(job_id, chunk, {'next_item': chunk[-1][0] + 1})
+            if self.record_usage:
+                for _, result in chunk:
+                    self.record_usage(job, result['success'], result.get('tokens_used', 0))
+        # Absolute counts, so an ingestion retried after a crash doesn't double them
+        succeeded = sum(1 for _, result in ordered if result['success'])
+        self._job_ref(job_id).set({'succeeded': succeeded, 'failed': len(ordered) - succeeded}, merge=True)
+        return SUCCEEDED
+
+    def _finish(self, job_id: str, state: str):
+        now = datetime.utcnow()
+        job_ref = self._job_ref(job_id)
+        job_ref.set({'state': state, 'completed_at': now, 'updated_at': now}, merge=True)
+        job = job_ref.get().to_dict()
+        unused = job['item_count'] - job.get('next_item', 0)
+        if self.release_quota and unused > 0:
+            self.release_quota(job, unused)
+        if job.get('callback_url'):
+            self._notify(job_id, job)
+
+    def _notify(self, job_id: str, job: dict):
+        """POST the job's summary to its callback URL; failures are recorded, not retried"""
+        if (urlparse(job['callback_url']).hostname or '').lower() not in self.callback_hosts:
+            logger.warning(f"Callback host for analysis job {job_id} is no longer allowed")
+            self._job_ref(job_id).set({'callback_status': None}, merge=True)
+            return
+        try:
+            # Redirects are not followed, so the host allowlist can't be sidestepped
+            response = requests.post(job['callback_url'], json=self.summary(job_id, job), timeout=10,
+                                     allow_redirects=False)
+            status = response.status_code
+        except requests.exceptions.RequestException as e:
+            logger.warning(f"Callback for analysis job {job_id} failed: {e}")
+            status = None
+        self._job_ref(job_id).set({'callback_status': status}, merge=True)
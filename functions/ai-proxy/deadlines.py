@@ -0,0 +1,52 @@
+"""
+Request deadlines for the AI proxy
+API Gateway gives the backend 30 s (api-gateway-config.yaml) and a client may
+ask for less with X-Request-Timeout. One Deadline per request carries that
+budget through every stage: each Firestore, Secret Manager and upstream call
+takes its timeout from the time left, and a stage that could not finish in
+what remains is not started, so the proxy answers 504 instead of calling
+Gemini for a response nobody will receive.
+"""
+
+import time
+from typing import Optional
+
+DEADLINE_HEADER = 'X-Request-Timeout'
+
+
+class DeadlineExceeded(Exception):
+    """A stage was due to start with too little time left"""
+
+    def __init__(self, stage: str):
+        super().__init__(f"Deadline exceeded before {stage}")
+        self.stage = stage
+
+
+class Deadline:
+    """Time budget for one request, on the monotonic clock"""
+
+    def __init__(self, seconds: float):
+        self.seconds = seconds
+        self.expires_at = time.monotonic() + seconds
+
+    @classmethod
+    def from_request(cls, request, default: float, margin: float = 0.0) -> 'Deadline':
+        """Gateway budget less margin, shortened by a valid client X-Request-Timeout"""
+        seconds = max(0.0, default - margin)
+        try:
+            requested = float(request.headers.get(DEADLINE_HEADER, ''))
+        except ValueError:
+            requested = None
+        if requested is not None and 0 < requested < seconds:
+            seconds = requested
+        return cls(seconds)
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def timeout(self, stage: str, cap: Optional[float] = None, minimum: float = 0.05) -> float:
+        """Timeout for a stage: the time left, at most cap; raises if under minimum"""
+        remaining = self.remaining()
+        if remaining < minimum:
+            raise DeadlineExceeded(stage)
+        return remaining if cap is None else min(cap, remaining)
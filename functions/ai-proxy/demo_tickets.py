@@ -0,0 +1,216 @@
+"""
+Signed demo tickets for the AI proxy
+With tickets enabled, a device's first request goes through the Firestore
+rate limiter as usual and the response carries a short-lived HS256 ticket
+holding the device's window counters. Later requests present the ticket:
+it is verified and advanced locally and a refreshed ticket is returned, so
+admission needs no datastore round trip. Usage is still written to
+Firestore, but a few seconds late, merging many requests into one batch
+commit.
+
+Each ticket carries a nonce that is accepted once per instance. A ticket
+that fails verification or is replayed is not an error; the request simply
+falls back to the full Firestore check, which also re-applies the network and
+global tiers (tickets only enforce the device tier) and issues a new ticket.
+"""
+
+import logging
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime
+from typing import Callable, Dict, Optional
+
+import jwt
+from google.cloud import firestore
+
+from rate_limits import DEVICE, MESSAGES, WINDOWS, Admission, HierarchicalRateLimiter
+
+logger = logging.getLogger(__name__)
+
+ALGORITHM = 'HS256'
+MAX_BATCH_WRITES = 500
+
+
+class NonceWindow:
+    """Nonces seen until their ticket expires, bounded in size"""
+
+    def __init__(self, capacity: int = 100000):
+        self.capacity = capacity
+        self._seen: "OrderedDict[str, float]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def claim(self, nonce: str, expires_at: float) -> bool:
+        """True the first time nonce is presented"""
+        now = time.time()
+        with self._lock:
+            while self._seen and (next(iter(self._seen.values())) < now or len(self._seen) >= self.capacity):
+                self._seen.popitem(last=False)
+            if nonce in self._seen:
+                return False
+            self._seen[nonce] = expires_at
+            return True
+
+
+class TicketDecision:
+    def __init__(self, admission: Admission, ticket: str):
+        self.admission = admission
+        self.ticket = ticket
+
+
+class DemoTickets:
+    """Issues tickets and admits requests that carry one"""
+
+    def __init__(self, secret: Callable[[], str], device_limits: Dict[str, int], ttl: float = 300,
+                 nonces: Optional[NonceWindow] = None):
+        self._secret = secret
+        self.device_limits = device_limits
+        self.ttl = ttl
+        self.nonces = nonces or NonceWindow()
+
+    def issue(self, admission: Admission) -> str:
+        """Ticket for the device's usage after this request is counted"""
+        now = time.time()
+        windows = {limit_key: int(now) // seconds for limit_key, seconds, _ in WINDOWS}
+        counts = {limit_key: admission.counts.get(limit_key, 0) + (1 if admission.allowed else 0)
+                  for limit_key, _, _ in WINDOWS}
+        claims = {
+            'sub': admission.device_id,
+            'net': admission.network,
+            'iat': int(now),
+            'exp': int(now + self.ttl),
+            'jti': uuid.uuid4().hex,
+            'w': windows,
+            'c': counts,
+            't': admission.counts.get('total', 0) + (1 if admission.allowed else 0)
+        }
+        return jwt.encode(claims, self._secret(), algorithm=ALGORITHM)
+
+    def admit(self, ticket: str, device_id: str, network: str) -> Optional[TicketDecision]:
+        """Admission decided from the ticket alone; None means use the Firestore path"""
+        try:
+            claims = jwt.decode(ticket, self._secret(), algorithms=[ALGORITHM],
+                                options={'require': ['exp', 'jti', 'sub']})
+        except jwt.InvalidTokenError as e:
+            logger.info(f"Ticket rejected for device {device_id}: {e}")
+            return None
+        if claims['sub'] != device_id or not self.nonces.claim(claims['jti'], claims['exp']):
+            return None
+
+        now = time.time()
+        admission = Admission(device_id, network, datetime.utcnow(), False)
+        admission.counts['total'] = claims.get('t', 0)
+        for limit_key, seconds, _ in WINDOWS:
+            same_window = claims.get('w', {}).get(limit_key) == int(now) // seconds
+            admission.counts[limit_key] = claims.get('c', {}).get(limit_key, 0) if same_window else 0
+            admission.resets[limit_key] = seconds - now % seconds
+
+        if admission.counts['total'] >= self.device_limits['requests_per_device']:
+            admission.allowed, admission.tier = False, DEVICE
+            admission.message = MESSAGES['requests_per_device']
+        else:
+            for limit_key, _, _ in WINDOWS:
+                if admission.counts[limit_key] >= self.device_limits[limit_key]:
+                    admission.allowed, admission.tier = False, DEVICE
+                    admission.message = MESSAGES[(DEVICE, limit_key)]
+                    admission.limit_key = limit_key
+                    break
+        return TicketDecision(admission, self.issue(admission))
+
+
+def _merge(into: dict, data: dict):
+    """Fold one request's merge data into the pending write for the same document"""
+    for field, value in data.items():
+        previous = into.get(field)
+        if isinstance(value, firestore.Increment) and isinstance(previous, firestore.Increment):
+            into[field] = firestore.Increment(previous.value + value.value)
+        elif isinstance(value, firestore.ArrayUnion) and isinstance(previous, firestore.ArrayUnion):
+            into[field] = firestore.ArrayUnion(list(previous.values) + list(value.values))
+        else:
+            into[field] = value
+
+
+class UsageReconciler:
+    """Batches usage writes for ticket-admitted requests into merged commits
+
+    There is no background thread: gen2 instances get no CPU between
+    requests, so pending usage is committed from the request path by
+    flush_if_due once the oldest entry has waited interval seconds (or
+    max_pending have built up). A failed commit puts its requests back to be
+    retried by the next flush.
+    """
+
+    def __init__(self, limiter: HierarchicalRateLimiter, interval: float = 5.0, max_pending: int = 200):
+        self.limiter = limiter
+        self.interval = interval
+        self.max_pending = max_pending
+        self._pending = []
+        self._oldest = None
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+
+    def enqueue(self, admission: Admission, success: bool, tokens_used: int = 0, upstream: bool = True):
+        if upstream:
+            self.limiter.count_global(admission)
+        with self._lock:
+            if not self._pending:
+                self._oldest = time.monotonic()
+            self._pending.append((admission, success, tokens_used, upstream))
+
+    def due(self) -> bool:
+        with self._lock:
+            return bool(self._pending) and (len(self._pending) >= self.max_pending
+                                            or time.monotonic() - self._oldest >= self.interval)
+
+    def flush_if_due(self, timeout: Optional[float] = None) -> int:
+        """Flush if pending usage is old or plentiful enough and no flush is running"""
+        if not self.due() or not self._flush_lock.acquire(blocking=False):
+            return 0
+        try:
+            return self._flush(timeout)
+        finally:
+            self._flush_lock.release()
+
+    def flush(self, timeout: Optional[float] = None) -> int:
+        """Commit everything pending as merged writes; returns the requests written"""
+        with self._flush_lock:
+            return self._flush(timeout)
+
+    def _groups(self, pending: list) -> list:
+        """Split pending requests into runs whose merged writes fit one commit"""
+        groups, requests, writes = [], [], {}
+        for item in pending:
+            item_writes = self.limiter.usage_writes(*item)
+            new_docs = {ref.path for ref, _ in item_writes} - writes.keys()
+            if requests and len(writes) + len(new_docs) > MAX_BATCH_WRITES:
+                groups.append((requests, writes))
+                requests, writes = [], {}
+            requests.append(item)
+            for ref, data in item_writes:
+                _merge(writes.setdefault(ref.path, [ref, {}])[1], data)
+        if requests:
+            groups.append((requests, writes))
+        return groups
+
+    def _flush(self, timeout: Optional[float]) -> int:
+        with self._lock:
+            pending, oldest = self._pending, self._oldest
+            self._pending = []
+        written = 0
+        groups = self._groups(pending)
+        for index, (requests, writes) in enumerate(groups):
+            try:
+                batch = self.limiter.db.batch()
+                for ref, data in writes.values():
+                    batch.set(ref, data, merge=True)
+                batch.commit(timeout=timeout)
+            except Exception as e:
+                retry = [item for group, _ in groups[index:] for item in group]
+                logger.error(f"Failed to reconcile usage for {len(retry)} requests, will retry: {e}")
+                with self._lock:
+                    self._pending = retry + self._pending
+                    self._oldest = oldest
+                break
+            written += len(requests)
+        return written
@@ -7,7 +7,22 @@ SERVICE_ACCOUNT="ai-proxy-sa@${PROJECT_ID}.iam.gserviceaccount.com"
 
 echo "Deploying AI Proxy to project: $PROJECT_ID"
 
+# Key buckets (key_shaper.py) are per instance, so every instance gets an
+# equal share of each key's RPM/TPM and the pool as a whole stays under the
+# key limits. The cost is that a lone warm instance can use only its share.
+# Concurrency above 1 (which gen2 allows from one vCPU) lets an instance queue
+# callers on its buckets and batch embeddings instead of scaling out.
+# The job worker also draws on the pool, so ai-proxy instances split what it
+# leaves them.
+AI_PROXY_MAX_INSTANCES=10
+AI_PROXY_CONCURRENCY=20
+JOB_WORKER_KEY_SHARE=0.2
+AI_PROXY_KEY_SHARE=$(awk "BEGIN { printf \"%.4f\", (1 - $JOB_WORKER_KEY_SHARE) / $AI_PROXY_MAX_INSTANCES }")
+
 # Deploy the function
+# Cameras call the function URL directly, so the client is the last
+# X-Forwarded-For entry (TRUSTED_PROXY_HOPS=0); set 1 if a load balancer or
+# API Gateway is put in front of it
 gcloud functions deploy ai-proxy \
   --gen2 \
   --runtime=python311 \
@@ -17,10 +32,12 @@ gcloud functions deploy ai-proxy \
   --trigger-http \
   --allow-unauthenticated \
   --service-account=$SERVICE_ACCOUNT \
-  --set-env-vars="GCP_PROJECT=$PROJECT_ID" \
+  --set-env-vars="GCP_PROJECT=$PROJECT_ID,KEY_LIMIT_SHARE=$AI_PROXY_KEY_SHARE" \
   --memory=512MB \
+  --cpu=1 \
+  --concurrency=$AI_PROXY_CONCURRENCY \
   --timeout=60s \
-  --max-instances=100 \
+  --max-instances=$AI_PROXY_MAX_INSTANCES \
   --project=$PROJECT_ID
 
 # Deploy device status endpoint
@@ -39,4 +56,71 @@ gcloud functions deploy ai-proxy-status \
   --max-instances=50 \
   --project=$PROJECT_ID
 
+# Deploy bulk device status endpoint (dashboards)
+gcloud functions deploy ai-proxy-bulk-status \
+  --gen2 \
+  --runtime=python311 \
+  --region=$REGION \
+  --source=. \
+  --entry-point=get_bulk_device_status \
+  --trigger-http \
+  --allow-unauthenticated \
+  --service-account=$SERVICE_ACCOUNT \
+  --set-env-vars="GCP_PROJECT=$PROJECT_ID" \
+  --memory=256MB \
+  --timeout=30s \
+  --max-instances=20 \
+  --project=$PROJECT_ID
+
+# Deploy asynchronous analysis job endpoints. Submission is unauthenticated,
+# so job callbacks are only sent to hosts listed in JOB_CALLBACK_HOSTS
+# (comma-separated); with none listed, callback_url is rejected
+JOB_CALLBACK_HOSTS=${JOB_CALLBACK_HOSTS:-""}
+gcloud functions deploy ai-proxy-jobs \
+  --gen2 \
+  --runtime=python311 \
+  --region=$REGION \
+  --source=. \
+  --entry-point=submit_analysis_job \
+  --trigger-http \
+  --allow-unauthenticated \
+  --service-account=$SERVICE_ACCOUNT \
+  --set-env-vars="^|^GCP_PROJECT=$PROJECT_ID|JOB_CALLBACK_HOSTS=$JOB_CALLBACK_HOSTS" \
+  --memory=256MB \
+  --timeout=60s \
+  --max-instances=20 \
+  --project=$PROJECT_ID
+
+gcloud functions deploy ai-proxy-job-status \
+  --gen2 \
+  --runtime=python311 \
+  --region=$REGION \
+  --source=. \
+  --entry-point=get_analysis_job \
+  --trigger-http \
+  --allow-unauthenticated \
+  --service-account=$SERVICE_ACCOUNT \
+  --set-env-vars="GCP_PROJECT=$PROJECT_ID" \
+  --memory=256MB \
+  --timeout=30s \
+  --max-instances=20 \
+  --project=$PROJECT_ID
+
+# Deploy the job worker (invoke every 10 minutes from Cloud Scheduler); one
+# instance so runs never overlap, holding JOB_WORKER_KEY_SHARE of the key pool
+gcloud functions deploy ai-proxy-job-worker \
+  --gen2 \
+  --runtime=python311 \
+  --region=$REGION \
+  --source=. \
+  --entry-point=run_analysis_jobs \
+  --trigger-http \
+  --no-allow-unauthenticated \
+  --service-account=$SERVICE_ACCOUNT \
+  --set-env-vars="^|^GCP_PROJECT=$PROJECT_ID|KEY_LIMIT_SHARE=$JOB_WORKER_KEY_SHARE|JOB_CALLBACK_HOSTS=$JOB_CALLBACK_HOSTS" \
+  --memory=512MB \
+  --timeout=540s \
+  --max-instances=1 \
+  --project=$PROJECT_ID
+
 echo "AI Proxy deployment complete!"
\ No newline at end of file
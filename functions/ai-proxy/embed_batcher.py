@@ -0,0 +1,106 @@
+"""
+Micro-batching of embedContent requests for the AI proxy
+Concurrent embedContent requests for the same model are collected for a few
+milliseconds, or until a batch is full, and sent upstream as one
+batchEmbedContents call whose embeddings are handed back to each caller in
+order. There is no background thread: the first request into a batch leads
+it, waiting out the window and making the call, while later ones wait for its
+result. A request therefore waits at most the window plus one upstream call.
+
+The call runs on the latest deadline in the batch, so one member's short
+X-Request-Timeout does not cut the others off; requests with less than
+min_deadline left skip batching altogether. When the upstream rejects a batch
+as a whole, send marks the results 'split' and every member retries its own
+item alone, in its own request and on its own deadline.
+
+Batches only form between requests handled by the same instance at the same
+time, so batching needs an instance concurrency above 1.
+"""
+
+import logging
+import threading
+from typing import Callable, Dict, List, Optional
+
+from deadlines import Deadline
+
+logger = logging.getLogger(__name__)
+
+# batchEmbedContents accepts at most 100 requests
+MAX_BATCH_SIZE = 100
+
+
+class _Batch:
+    def __init__(self):
+        self.items: List[dict] = []
+        self.deadlines: List[Deadline] = []
+        self.results: Optional[List[dict]] = None
+        self.full = threading.Event()
+        self.done = threading.Event()
+
+
+class EmbedBatcher:
+    """Coalesces concurrent embedContent requests per model"""
+
+    def __init__(self, send: Callable[[str, List[dict], Deadline], List[dict]], window: float = 0.01,
+                 max_batch: int = MAX_BATCH_SIZE, min_deadline: float = 0.0):
+        """send(model, items, deadline) makes one upstream call within the deadline
+        and returns one result per item"""
+        self.send = send
+        self.window = window
+        self.max_batch = min(max_batch, MAX_BATCH_SIZE)
+        self.min_deadline = min_deadline
+        self._open: Dict[str, _Batch] = {}
+        self._lock = threading.Lock()
+
+    def embed(self, model: str, item: dict, deadline: Deadline) -> Optional[dict]:
+        """Result for one request; None if the batch it joined did not finish within its deadline"""
+        if deadline.remaining() < self.min_deadline:
+            return self._alone(model, item, deadline)
+
+        with self._lock:
+            batch = self._open.get(model)
+            leader = batch is None
+            if leader:
+                batch = self._open[model] = _Batch()
+            index = len(batch.items)
+            batch.items.append(item)
+            batch.deadlines.append(deadline)
+            if len(batch.items) >= self.max_batch:
+                del self._open[model]
+                batch.full.set()
+
+        if not leader:
+            if not batch.done.wait(deadline.remaining()):
+                return None
+            return self._own(model, item, deadline, batch.results[index])
+
+        batch.full.wait(self.window)
+        with self._lock:
+            if self._open.get(model) is batch:
+                del self._open[model]
+        # Members have stopped joining; the call runs until the last of them gives up
+        latest = max(batch.deadlines, key=lambda member: member.expires_at)
+        try:
+            results = self.send(model, batch.items, latest)
+        except Exception as e:
+            logger.error(f"Embedding batch of {len(batch.items)} for {model} failed: {e}")
+            results = [{'success': False, 'error': 'Internal error'}] * len(batch.items)
+        batch.results = results
+        batch.done.set()
+        if not deadline.remaining():
+            return None
+        return self._own(model, item, deadline, results[index])
+
+    def _own(self, model: str, item: dict, deadline: Deadline, result: dict) -> dict:
+        """The member's batch result, or its own call if the batch was rejected as a whole"""
+        if not result.get('split'):
+            return result
+        logger.info(f"Embedding batch for {model} rejected ({result.get('error')}); sending item alone")
+        return self._alone(model, item, deadline)
+
+    def _alone(self, model: str, item: dict, deadline: Deadline) -> dict:
+        try:
+            return self.send(model, [item], deadline)[0]
+        except Exception as e:
+            logger.error(f"Embedding for {model} failed: {e}")
+            return {'success': False, 'error': 'Internal error'}
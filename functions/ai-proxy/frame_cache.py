@@ -0,0 +1,169 @@
+"""
+Per-device near-duplicate frame cache for the AI proxy
+Cameras often resend frames that differ only by sensor noise. This keeps a
+difference hash (dHash) of each device's last analysed frame and returns the
+previous analysis when a new frame is within a Hamming distance threshold and
+the prompt is unchanged, so the request never reaches Gemini.
+"""
+
+import base64
+import binascii
+import hashlib
+import io
+import json
+import threading
+import time
+import logging
+from typing import Optional
+
+try:
+    from PIL import Image
+except ImportError:  # Pillow is optional; the gate is disabled without it
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+HASH_SIZE = 8  # 8x8 gradient bits -> 64-bit hash
+
+
+def dhash(image_bytes: bytes) -> int:
+    """64-bit difference hash of an encoded image"""
+    with Image.open(io.BytesIO(image_bytes)) as image:
+        small = image.convert('L').resize((HASH_SIZE + 1, HASH_SIZE), Image.BILINEAR)
+        pixels = list(small.getdata())
+
+    value = 0
+    for row in range(HASH_SIZE):
+        offset = row * (HASH_SIZE + 1)
+        for col in range(HASH_SIZE):
+            value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return value
+
+
+def hamming(a: int, b: int) -> int:
+    return bin(a ^ b).count('1')
+
+
+def split_request(request_data: dict):
+    """Separate inline images from the rest of the prompt.
+
+    Returns (images, prompt_key) where prompt_key fingerprints everything that
+    affects the answer except the image bytes. A malformed request returns
+    ([], None) so it is never cached; the upstream rejects it instead.
+    """
+    contents = request_data.get('contents', [])
+    if not isinstance(contents, list):
+        return [], None
+    images = []
+    stripped = []
+    for content in contents:
+        if not isinstance(content, dict) or not isinstance(content.get('parts', []), list):
+            return [], None
+        parts = []
+        for part in content.get('parts', []):
+            if not isinstance(part, dict):
+                return [], None
+            inline = part.get('inline_data') or part.get('inlineData')
+            if inline and not isinstance(inline, dict):
+                return [], None
+            if inline and isinstance(inline.get('data'), str) and inline['data']:
+                images.append(inline['data'])
+                parts.append({'image': inline.get('mime_type') or inline.get('mimeType')})
+            else:
+                parts.append(part)
+        stripped.append({'role': content.get('role'), 'parts': parts})
+
+    fingerprint = json.dumps({
+        'model': request_data.get('model'),
+        'endpoint': request_data.get('endpoint'),
+        'contents': stripped,
+        'generationConfig': request_data.get('generationConfig')
+    }, sort_keys=True)
+    return images, hashlib.sha256(fingerprint.encode()).hexdigest()
+
+
+class FrameCache:
+    """Last analysed frame per device, with hit-rate accounting"""
+
+    def __init__(self, max_distance: int = 5, ttl: float = 600, max_devices: int = 5000):
+        self.max_distance = max_distance
+        self.ttl = ttl
+        self.max_devices = max_devices
+        self.entries = {}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.lookups = 0
+
+    @property
+    def available(self) -> bool:
+        return Image is not None
+
+    @property
+    def hit_rate(self) -> float:
+        return self.hits / self.lookups if self.lookups else 0.0
+
+    def fingerprint(self, request_data: dict) -> Optional[dict]:
+        """Hash the request's frames; None when the request can't be gated"""
+        if not self.available:
+            return None
+        images, prompt_key = split_request(request_data)
+        if not images:
+            return None
+        try:
+            hashes = [dhash(base64.b64decode(data)) for data in images]
+        except (binascii.Error, OSError, ValueError, Image.DecompressionBombError) as e:
+            logger.info(f"Frame cache skipped undecodable image: {e}")
+            return None
+        return {'hashes': hashes, 'prompt_key': prompt_key}
+
+    def lookup(self, device_id: str, fingerprint: dict,
+               max_distance: Optional[int] = None) -> Optional[dict]:
+        """Return the cached analysis for a near-identical frame, if any"""
+        threshold = self.max_distance if max_distance is None else min(max_distance, self.max_distance)
+        now = time.time()
+        with self.lock:
+            self.lookups += 1
+            entry = self.entries.get(device_id)
+            hit = (
+                entry is not None
+                and now - entry['stored_at'] < self.ttl
+                and entry['prompt_key'] == fingerprint['prompt_key']
+                and len(entry['hashes']) == len(fingerprint['hashes'])
+            )
+            distance = None
+            if hit:
+                distance = max(hamming(a, b) for a, b in zip(entry['hashes'], fingerprint['hashes']))
+                hit = distance <= threshold
+            if hit:
+                self.hits += 1
+            hit_rate = self.hit_rate
+
+        # Structured log line; a log-based metric charts hit rate per instance
+        logger.info(json.dumps({
+            'metric': 'frame_cache',
+            'device_id': device_id,
+            'hit': hit,
+            'distance': distance,
+            'hit_rate': round(hit_rate, 4)
+        }))
+
+        if not hit:
+            return None
+        return {
+            'response': entry['response'],
+            'distance': distance,
+            'age_seconds': round(now - entry['stored_at'], 1)
+        }
+
+    def store(self, device_id: str, fingerprint: dict, response: dict):
+        """Remember the analysis of the device's latest frame"""
+        with self.lock:
+            if device_id not in self.entries and len(self.entries) >= self.max_devices:
+                oldest = min(self.entries, key=lambda key: self.entries[key]['stored_at'])
+                del self.entries[oldest]
+            self.entries[device_id] = {
+                'hashes': fingerprint['hashes'],
+                'prompt_key': fingerprint['prompt_key'],
+                'response': dict(response),
+                'stored_at': time.time()
+            }
@@ -0,0 +1,136 @@
+"""
+Hedged upstream requests for the AI proxy
+Gemini's tail latency is several times its median. With hedging on, a call
+that has not answered within the model's recent p95 latency is duplicated on
+another region or key; the first successful answer wins and the hedge is
+called off if it has not been sent yet.
+
+Hedges are paid for from a budget that earns a fraction of a hedge per
+request (HEDGE_BUDGET_PERCENT), so at most that share of traffic is ever
+duplicated, however slow the upstream gets. requests cannot abort a call in
+flight, so a losing call that was already sent finishes in the background:
+its response is dropped, but it still settles its own key lease and latency
+sample. Only the winner's tokens are charged to the device.
+"""
+
+import logging
+import queue
+import threading
+import time
+from collections import deque
+from typing import Callable, Deque, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+PRIMARY = 'primary'
+HEDGE = 'hedge'
+
+
+class Hedger:
+    """Runs a call and, past its adaptive delay and within budget, a hedge of it"""
+
+    def __init__(self, budget: float = 0.05, percentile: float = 0.95, min_delay: float = 0.2,
+                 min_samples: int = 20, window: int = 200, burst: float = 5.0):
+        self.budget = budget
+        self.percentile = percentile
+        self.min_delay = min_delay
+        self.min_samples = min_samples
+        self.window = window
+        self.burst = burst
+        self._latencies: Dict[str, Deque[float]] = {}
+        self._credit = 0.0
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+
+    def observe(self, key: str, seconds: float):
+        """Latency of one successful call"""
+        with self._lock:
+            self._latencies.setdefault(key, deque(maxlen=self.window)).append(seconds)
+
+    def delay(self, key: str) -> Optional[float]:
+        """Seconds to wait before hedging; None until enough calls have been seen"""
+        with self._lock:
+            samples = sorted(self._latencies.get(key, ()))
+        if len(samples) < self.min_samples:
+            return None
+        return max(self.min_delay, samples[int(self.percentile * (len(samples) - 1))])
+
+    def _take_credit(self) -> bool:
+        with self._lock:
+            if self._credit < 1.0:
+                return False
+            self._credit -= 1.0
+            self.hedges += 1
+            return True
+
+    def _refund(self):
+        with self._lock:
+            self._credit = min(self.burst, self._credit + 1.0)
+            self.hedges -= 1
+
+    def run(self, key: str, primary: Callable[[], dict],
+            hedge: Callable[[threading.Event], Optional[dict]]) -> dict:
+        """First successful result of primary and, if it is slow, hedge
+
+        hedge receives an event set once the outcome is decided and returns
+        None when it did not send anything (nothing to hedge on, or called off).
+        """
+        outcomes = queue.Queue()
+        decided = threading.Event()
+
+        def attempt(name: str, call: Callable[[], Optional[dict]]):
+            started = time.perf_counter()
+            try:
+                result = call()
+            except Exception as e:
+                logger.error(f"Unexpected error in {name} call: {e}")
+                result = {'success': False, 'error': 'Internal error'}
+            if result is None:
+                self._refund()
+            elif result.get('success'):
+                self.observe(key, time.perf_counter() - started)
+            outcomes.put((name, result))
+
+        with self._lock:
+            self.requests += 1
+            self._credit = min(self.burst, self._credit + self.budget)
+        threading.Thread(target=attempt, args=(PRIMARY, primary), daemon=True).start()
+
+        delay = self.delay(key)
+        try:
+            if delay is None:
+                return outcomes.get()[1]
+            return outcomes.get(timeout=delay)[1]
+        except queue.Empty:
+            pass
+        if not self._take_credit():
+            return outcomes.get()[1]
+
+        threading.Thread(target=attempt, args=(HEDGE, lambda: hedge(decided)), daemon=True).start()
+        result = None
+        try:
+            for _ in range(2):
+                name, outcome = outcomes.get()
+                if outcome is None:
+                    continue
+                result = outcome
+                if outcome.get('success'):
+                    if name == HEDGE:
+                        with self._lock:
+                            self.hedge_wins += 1
+                    break
+        finally:
+            decided.set()
+        return result
+
+    def snapshot(self, key: str) -> dict:
+        delay = self.delay(key)
+        with self._lock:
+            return {
+                'delay_ms': round(delay * 1000, 1) if delay is not None else None,
+                'requests': self.requests,
+                'hedges': self.hedges,
+                'hedge_wins': self.hedge_wins
+            }
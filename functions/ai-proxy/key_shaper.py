@@ -0,0 +1,188 @@
+"""
+Per-key upstream rate shaping for the AI proxy
+Each shared API key has Gemini requests-per-minute and tokens-per-minute
+limits. A pair of token buckets per key tracks both; a request goes to the
+key with the most headroom left, so keys near their limits are routed around
+instead of being driven into 429s. When every key is saturated, callers wait
+for the earliest key to refill, up to a bounded time and queue length, and are
+shed locally otherwise.
+
+Token use is estimated before the call and settled against usageMetadata
+afterwards. Buckets live in this instance only, so limits on the key
+documents should be divided by the number of instances expected to share
+them (KEY_LIMIT_SHARE).
+"""
+
+import logging
+import threading
+import time
+from typing import Dict, Iterable, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Gemini bills an image part at a flat 258 tokens; text is ~4 characters per token
+IMAGE_TOKENS = 258
+CHARS_PER_TOKEN = 4
+# Keys that returned 429 without Retry-After sit out this long
+DEFAULT_BLOCK_SECONDS = 10.0
+
+
+def estimate_tokens(request_data: dict) -> int:
+    """Rough prompt token count for a generateContent or (batch) embedContent request"""
+    contents = list(request_data.get('contents', []))
+    if 'content' in request_data:
+        contents.append(request_data['content'])
+    contents.extend(item.get('content', {}) for item in request_data.get('requests', []))
+    tokens = 0
+    for content in contents:
+        for part in content.get('parts', []):
+            if 'text' in part:
+                tokens += len(part['text']) // CHARS_PER_TOKEN + 1
+            elif 'inline_data' in part or 'inlineData' in part:
+                tokens += IMAGE_TOKENS
+    return max(1, tokens)
+
+
+class _Bucket:
+    """Token bucket holding up to one minute of a per-minute limit"""
+
+    def __init__(self, per_minute: float, now: float):
+        self.capacity = per_minute
+        self.rate = per_minute / 60.0
+        self.level = per_minute
+        self.updated = now
+
+    def refill(self, now: float):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_for(self, amount: float) -> float:
+        """Seconds until amount is available (assumes refill was just called)"""
+        missing = min(amount, self.capacity) - self.level
+        return max(0.0, missing / self.rate) if self.rate else float('inf')
+
+
+class Lease:
+    """One request's claim on a key"""
+
+    def __init__(self, key_id: str, tokens: int, waited: float):
+        self.key_id = key_id
+        self.tokens = tokens
+        self.waited = waited
+
+
+class KeyShaper:
+    """Chooses a key for each upstream call and keeps the pool under its limits"""
+
+    def __init__(self, max_wait: float = 2.0, max_queued: int = 32, limit_share: float = 1.0):
+        self.max_wait = max_wait
+        self.max_queued = max_queued
+        self.limit_share = limit_share
+        self._keys: Dict[str, dict] = {}
+        self._waiting = 0
+        self._cond = threading.Condition()
+
+    def update_keys(self, limits: Dict[str, Tuple[int, int]]):
+        """Set the pool to key_id -> (requests per minute, tokens per minute)"""
+        now = time.monotonic()
+        with self._cond:
+            for key_id in list(self._keys):
+                if key_id not in limits:
+                    del self._keys[key_id]
+            for key_id, (rpm, tpm) in limits.items():
+                rpm, tpm = rpm * self.limit_share, tpm * self.limit_share
+                state = self._keys.get(key_id)
+                if state is None:
+                    self._keys[key_id] = {'requests': _Bucket(rpm, now), 'tokens': _Bucket(tpm, now),
+                                          'blocked_until': 0.0}
+                    continue
+                for bucket, per_minute in ((state['requests'], rpm), (state['tokens'], tpm)):
+                    bucket.refill(now)
+                    bucket.capacity, bucket.rate = per_minute, per_minute / 60.0
+                    bucket.level = min(bucket.level, per_minute)
+            self._cond.notify_all()
+
+    def _pick(self, tokens: int, now: float, exclude: Iterable[str] = ()) -> Tuple[Optional[str], Optional[float]]:
+        """(key with the most headroom that can take the request now, else None and the shortest wait)"""
+        best, best_headroom, shortest = None, -1.0, None
+        for key_id, state in self._keys.items():
+            if key_id in exclude:
+                continue
+            requests, budget = state['requests'], state['tokens']
+            if requests.capacity <= 0 or budget.capacity <= 0:
+                continue
+            requests.refill(now)
+            budget.refill(now)
+            wait = max(state['blocked_until'] - now, requests.wait_for(1), budget.wait_for(tokens))
+            if wait <= 0:
+                headroom = min(requests.level / requests.capacity, budget.level / budget.capacity)
+                if headroom > best_headroom:
+                    best, best_headroom = key_id, headroom
+            elif shortest is None or wait < shortest:
+                shortest = wait
+        return best, shortest
+
+    def acquire(self, tokens: int, max_wait: Optional[float] = None, exclude: Iterable[str] = ()) -> Optional[Lease]:
+        """Reserve capacity on a key other than exclude, waiting up to max_wait; None if the pool stays saturated"""
+        started = time.monotonic()
+        deadline = started + (self.max_wait if max_wait is None else max_wait)
+        queued = False
+        with self._cond:
+            try:
+                while True:
+                    now = time.monotonic()
+                    key_id, wait = self._pick(tokens, now, exclude)
+                    if key_id is not None:
+                        state = self._keys[key_id]
+                        state['requests'].level -= 1
+                        state['tokens'].level -= tokens
+                        return Lease(key_id, tokens, now - started)
+                    if not queued:
+                        if self._waiting >= self.max_queued:
+                            return None
+                        self._waiting += 1
+                        queued = True
+                    if wait is None or now + wait > deadline:
+                        return None
+                    self._cond.wait(wait)
+            finally:
+                if queued:
+                    self._waiting -= 1
+
+    def settle(self, lease: Lease, actual_tokens: Optional[int]):
+        """Correct the token estimate once usageMetadata is known"""
+        if not actual_tokens:
+            return
+        with self._cond:
+            state = self._keys.get(lease.key_id)
+            if state is None:
+                return
+            # Over-estimates are refunded; under-estimates become debt the bucket repays
+            state['tokens'].level -= actual_tokens - lease.tokens
+            if actual_tokens < lease.tokens:
+                self._cond.notify_all()
+
+    def throttled(self, lease: Lease, retry_after: Optional[float] = None):
+        """The key returned 429 anyway: drain it and sit it out"""
+        with self._cond:
+            state = self._keys.get(lease.key_id)
+            if state is None:
+                return
+            state['requests'].level = min(state['requests'].level, 0.0)
+            state['blocked_until'] = time.monotonic() + (retry_after or DEFAULT_BLOCK_SECONDS)
+        logger.warning(f"Key {lease.key_id} throttled upstream, blocked for "
+                       f"{retry_after or DEFAULT_BLOCK_SECONDS:.0f}s")
+
+    def snapshot(self) -> Dict[str, dict]:
+        now = time.monotonic()
+        with self._cond:
+            result = {}
+            for key_id, state in self._keys.items():
+                state['requests'].refill(now)
+                state['tokens'].refill(now)
+                result[key_id] = {
+                    'requests_available': round(state['requests'].level, 2),
+                    'tokens_available': int(state['tokens'].level),
+                    'blocked_seconds': round(max(0.0, state['blocked_until'] - now), 1)
+                }
+            return result
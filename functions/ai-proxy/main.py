@@ -3,21 +3,48 @@ AI Proxy Cloud Function for Anava Vision Magical Installer
 Provides instant AI demo without authentication using shared API keys
 """
 
+import atexit
 import functions_framework
 import requests
 import json
 import time
-import jwt
 import os
 import logging
-from datetime import datetime, timedelta
-from google.cloud import firestore, secretmanager
+import threading
+from functools import partial
+from datetime import datetime
+from google.auth.credentials import AnonymousCredentials
+from google.cloud import firestore, secretmanager, storage
 from google.cloud.exceptions import NotFound
 import hashlib
+import re
+
+from batch_jobs import (AnalysisJobs, GcsSpool, JobError, LocalSpool, VertexBatchPrediction, parse_hours,
+                        validate_items)
+from deadlines import DEADLINE_HEADER, Deadline, DeadlineExceeded
+from demo_tickets import DemoTickets, UsageReconciler
+from embed_batcher import EmbedBatcher
+from frame_cache import FrameCache
+from hedging import Hedger
+from key_shaper import KeyShaper, estimate_tokens
+from upstream_router import (GEMINI, VERTEX, ServiceAccountToken, UpstreamRouter, build_upstreams,
+                             parse_region_models)
+from rate_limits import (GLOBAL, RATE_LIMIT_HEADERS, Admission, HierarchicalRateLimiter, client_ip,
+                         network_key, rate_limit_headers)
 
 # Initialize clients
+# FIRESTORE_EMULATOR_HOST is honoured by the Firestore client itself;
+# SECRET_MANAGER_ENDPOINT points Secret Manager at a local REST stand-in
 db = firestore.Client()
-secrets_client = secretmanager.SecretManagerServiceClient()
+SECRET_MANAGER_ENDPOINT = os.environ.get('SECRET_MANAGER_ENDPOINT')
+if SECRET_MANAGER_ENDPOINT:
+    secrets_client = secretmanager.SecretManagerServiceClient(
+        transport='rest',
+        credentials=AnonymousCredentials(),
+        client_options={'api_endpoint': SECRET_MANAGER_ENDPOINT}
+    )
+else:
+    secrets_client = secretmanager.SecretManagerServiceClient()
 
 # Configuration
 PROJECT_ID = os.environ.get('GCP_PROJECT')
@@ -27,24 +54,186 @@ RATE_LIMITS = {
     'requests_per_day': 500,
     'requests_per_device': 1000  # Total lifetime limit for demo
 }
+# Every device behind one /24 (IPv4) or /64 (IPv6) combined
+NETWORK_RATE_LIMITS = {
+    'requests_per_minute': int(os.environ.get('NETWORK_REQUESTS_PER_MINUTE', '30')),
+    'requests_per_hour': int(os.environ.get('NETWORK_REQUESTS_PER_HOUR', '300')),
+    'requests_per_day': int(os.environ.get('NETWORK_REQUESTS_PER_DAY', '1500'))
+}
+# Everything that reaches the shared key pool
+GLOBAL_RATE_LIMITS = {
+    'requests_per_minute': int(os.environ.get('GLOBAL_REQUESTS_PER_MINUTE', '600')),
+    'requests_per_hour': int(os.environ.get('GLOBAL_REQUESTS_PER_HOUR', '20000')),
+    'requests_per_day': int(os.environ.get('GLOBAL_REQUESTS_PER_DAY', '200000'))
+}
+GLOBAL_COUNTER_SHARDS = int(os.environ.get('GLOBAL_COUNTER_SHARDS', '10'))
+# Each instance re-reads the global shards at most this often
+GLOBAL_COUNT_CACHE_SECONDS = float(os.environ.get('GLOBAL_COUNT_CACHE_SECONDS', '5'))
+# Proxies that append to X-Forwarded-For after the client: 0 when called on the
+# function URL directly, 1 behind an HTTPS load balancer or API Gateway
+TRUSTED_PROXY_HOPS = int(os.environ.get('TRUSTED_PROXY_HOPS', '0'))
 
 # Collections
 SHARED_KEYS_COLLECTION = 'shared_ai_keys'
 USAGE_TRACKING_COLLECTION = 'ai_usage_tracking'
 DEVICE_TOKENS_COLLECTION = 'device_tokens'
+NETWORK_USAGE_COLLECTION = 'ai_network_usage'
+GLOBAL_USAGE_COLLECTION = 'ai_global_usage'
 
 # Gemini API configuration
-GEMINI_API_BASE = 'https://generativelanguage.googleapis.com/v1beta'
+GEMINI_API_BASE = os.environ.get('GEMINI_API_BASE', 'https://generativelanguage.googleapis.com/v1beta')
+GEMINI_API_ENABLED = os.environ.get('GEMINI_API_ENABLED', 'true').lower() == 'true'
+DEFAULT_MODEL = 'gemini-1.5-flash'
+UPSTREAM_TIMEOUT_SECONDS = 30
+# Embedding endpoints exist only on the Gemini API, not on Vertex regions
+EMBED_FIELDS = ['content', 'taskType', 'title', 'outputDimensionality']
+GEMINI_ONLY_ENDPOINTS = {'embedContent', 'batchEmbedContents'}
+
+# Request deadlines: API Gateway's backend deadline (api-gateway-config.yaml) less
+# time to return the response; an upstream call with less than
+# MIN_UPSTREAM_SECONDS left isn't started, and a usage write with less than
+# USAGE_WRITE_MIN_SECONDS left goes to the usage reconciler
+REQUEST_DEADLINE_SECONDS = float(os.environ.get('REQUEST_DEADLINE_SECONDS', '30'))
+DEADLINE_MARGIN_SECONDS = float(os.environ.get('DEADLINE_MARGIN_SECONDS', '0.5'))
+MIN_UPSTREAM_SECONDS = float(os.environ.get('MIN_UPSTREAM_SECONDS', '1'))
+USAGE_WRITE_MIN_SECONDS = float(os.environ.get('USAGE_WRITE_MIN_SECONDS', '0.2'))
+
+# Regional Vertex AI upstreams, e.g. VERTEX_REGIONS=us-central1,asia-northeast1;
+# VERTEX_REGION_MODELS='{"asia-northeast1": ["gemini-1.5-flash"]}' narrows what a region serves
+VERTEX_REGIONS = [r.strip() for r in os.environ.get('VERTEX_REGIONS', '').split(',') if r.strip()]
+VERTEX_API_TEMPLATE = os.environ.get('VERTEX_API_TEMPLATE', 'https://{region}-aiplatform.googleapis.com/v1')
+VERTEX_SERVICE_ACCOUNT = os.environ.get('VERTEX_SERVICE_ACCOUNT')
+IAM_CREDENTIALS_ENDPOINT = os.environ.get('IAM_CREDENTIALS_ENDPOINT', 'https://iamcredentials.googleapis.com')
+upstream_router = UpstreamRouter(
+    build_upstreams(GEMINI_API_BASE if GEMINI_API_ENABLED else None, PROJECT_ID, VERTEX_REGIONS,
+                    VERTEX_API_TEMPLATE, parse_region_models(os.environ.get('VERTEX_REGION_MODELS'))),
+    alpha=float(os.environ.get('UPSTREAM_EWMA_ALPHA', '0.2')),
+    probe_interval=float(os.environ.get('UPSTREAM_PROBE_SECONDS', '30'))
+)
+vertex_token = ServiceAccountToken(VERTEX_SERVICE_ACCOUNT, IAM_CREDENTIALS_ENDPOINT)
+
+# Upstream shaping: per-key limits come from rpm_limit/tpm_limit on each key document
+DEFAULT_KEY_RPM = int(os.environ.get('DEFAULT_KEY_RPM', '15'))
+DEFAULT_KEY_TPM = int(os.environ.get('DEFAULT_KEY_TPM', '1000000'))
+KEY_POOL_REFRESH_SECONDS = float(os.environ.get('KEY_POOL_REFRESH_SECONDS', '60'))
+key_shaper = KeyShaper(
+    max_wait=float(os.environ.get('KEY_MAX_WAIT_SECONDS', '2')),
+    max_queued=int(os.environ.get('KEY_MAX_QUEUED', '32')),
+    limit_share=float(os.environ.get('KEY_LIMIT_SHARE', '1.0'))
+)
+# Hedging (opt-in): duplicate calls slower than the model's p95 on another region or key
+HEDGING_ENABLED = os.environ.get('HEDGING_ENABLED', 'false').lower() == 'true'
+hedger = Hedger(
+    budget=float(os.environ.get('HEDGE_BUDGET_PERCENT', '5')) / 100,
+    percentile=float(os.environ.get('HEDGE_PERCENTILE', '95')) / 100,
+    min_delay=float(os.environ.get('HEDGE_MIN_DELAY_SECONDS', '0.2'))
+)
+# Embedding micro-batching: concurrent embedContent requests for a model become
+# one batchEmbedContents call (batches only form with instance concurrency > 1)
+EMBED_BATCHING_ENABLED = os.environ.get('EMBED_BATCHING_ENABLED', 'false').lower() == 'true'
+EMBED_BATCH_WINDOW_SECONDS = float(os.environ.get('EMBED_BATCH_WINDOW_MS', '10')) / 1000
+EMBED_BATCH_MAX_SIZE = int(os.environ.get('EMBED_BATCH_MAX_SIZE', '100'))
+# Requests with less time than this left (a short X-Request-Timeout) are sent on their own
+EMBED_BATCH_MIN_DEADLINE_SECONDS = float(os.environ.get('EMBED_BATCH_MIN_DEADLINE_SECONDS', '5'))
+_key_pool_lock = threading.Lock()
+_key_pool_loaded_at = 0.0
+_api_keys = {}
+
+# Bulk device status for dashboards
+MAX_BULK_DEVICE_IDS = int(os.environ.get('MAX_BULK_DEVICE_IDS', '500'))
+STATUS_CACHE_TTL_SECONDS = float(os.environ.get('STATUS_CACHE_TTL_SECONDS', '10'))
+STATUS_FIELDS = ['total_requests', 'reserved_requests', 'last_request']
+_status_cache = {}
+_status_cache_lock = threading.Lock()
+
+# Near-duplicate frame gate (opt-in per request with "frame_cache")
+FRAME_CACHE_ENABLED = os.environ.get('FRAME_CACHE_ENABLED', 'true').lower() == 'true'
+frame_cache = FrameCache(
+    max_distance=int(os.environ.get('FRAME_CACHE_MAX_DISTANCE', '5')),
+    ttl=float(os.environ.get('FRAME_CACHE_TTL_SECONDS', '600'))
+)
+
+rate_limiter = HierarchicalRateLimiter(
+    db, USAGE_TRACKING_COLLECTION, NETWORK_USAGE_COLLECTION, GLOBAL_USAGE_COLLECTION,
+    RATE_LIMITS, NETWORK_RATE_LIMITS, GLOBAL_RATE_LIMITS, GLOBAL_COUNTER_SHARDS, GLOBAL_COUNT_CACHE_SECONDS
+)
+
+# Signed demo tickets: admission without a Firestore round trip after the first request
+DEMO_TICKETS_ENABLED = os.environ.get('DEMO_TICKETS_ENABLED', 'false').lower() == 'true'
+DEMO_TICKET_SECRET_NAME = os.environ.get('DEMO_TICKET_SECRET_NAME', 'ai-proxy-ticket-secret')
+_ticket_secret = os.environ.get('DEMO_TICKET_SECRET')
+
+
+def ticket_secret() -> str:
+    global _ticket_secret
+    if not _ticket_secret:
+        _ticket_secret = get_secret(DEMO_TICKET_SECRET_NAME)
+    return _ticket_secret
+
+
+demo_tickets = DemoTickets(
+    ticket_secret, RATE_LIMITS,
+    ttl=float(os.environ.get('DEMO_TICKET_TTL_SECONDS', '300'))
+)
+usage_reconciler = UsageReconciler(
+    rate_limiter,
+    interval=float(os.environ.get('USAGE_FLUSH_SECONDS', '5'))
+)
+# Requests flush overdue usage; whatever is still pending when an idle instance
+# is shut down is committed in its SIGTERM grace period
+atexit.register(usage_reconciler.flush)
+
+# Asynchronous analysis jobs, spooled to GCS (or to JOB_SPOOL_DIR in tests) and
+# advanced by run_analysis_jobs; JOB_BATCH_REGION enables Vertex batch prediction
+JOB_SPOOL_DIR = os.environ.get('JOB_SPOOL_DIR')
+JOB_SPOOL_BUCKET = os.environ.get('JOB_SPOOL_BUCKET', f"{PROJECT_ID}-ai-jobs")
+JOB_BATCH_REGION = os.environ.get('JOB_BATCH_REGION')
+MAX_JOB_ITEMS = int(os.environ.get('MAX_JOB_ITEMS', '1000'))
+JOB_OFFPEAK_HOURS = parse_hours(os.environ.get('JOB_OFFPEAK_HOURS_UTC', '1-6'))
+JOB_RUN_SECONDS = float(os.environ.get('JOB_RUN_SECONDS', '480'))
+JOB_MAX_ITEMS_PER_RUN = int(os.environ.get('JOB_MAX_ITEMS_PER_RUN', '500'))
+JOB_CALLBACK_SCHEMES = tuple(os.environ.get('JOB_CALLBACK_SCHEMES', 'https').split(','))
+# Submission is unauthenticated, so callbacks only go to these hosts; none set disables them
+JOB_CALLBACK_HOSTS = frozenset(filter(None, os.environ.get('JOB_CALLBACK_HOSTS', '').lower().split(',')))
+JOB_ID_PATTERN = re.compile(r'^[0-9a-f]{32}$')
+
+
+def record_job_usage(job: dict, success: bool, tokens_used: int = 0):
+    """Count one processed job item against the submitting device, batched with other usage;
+    the item's request was reserved when the job was submitted"""
+    admission = Admission(job['device_id'], job['network'], datetime.utcnow(), False)
+    admission.reserved = True
+    usage_reconciler.enqueue(admission, success, tokens_used)
+    usage_reconciler.flush_if_due()
+
+
+def release_job_quota(job: dict, unused: int):
+    """Give back the reservations of job items that will never be processed"""
+    rate_limiter.release(job['device_id'], unused)
+
+
+analysis_jobs = AnalysisJobs(
+    db,
+    LocalSpool(JOB_SPOOL_DIR) if JOB_SPOOL_DIR else GcsSpool(storage.Client(), JOB_SPOOL_BUCKET),
+    analyze=lambda request_data, deadline: call_upstream(request_data, deadline),
+    batch_client=VertexBatchPrediction(VERTEX_API_TEMPLATE, PROJECT_ID, JOB_BATCH_REGION, vertex_token.token)
+    if JOB_BATCH_REGION else None,
+    record_usage=record_job_usage,
+    release_quota=release_job_quota,
+    callback_schemes=JOB_CALLBACK_SCHEMES,
+    callback_hosts=JOB_CALLBACK_HOSTS
+)
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
-def get_secret(secret_name: str) -> str:
+def get_secret(secret_name: str, timeout: float = None) -> str:
     """Retrieve secret from Secret Manager"""
     try:
         name = f"projects/{PROJECT_ID}/secrets/{secret_name}/versions/latest"
-        response = secrets_client.access_secret_version(request={"name": name})
+        options = {'timeout': timeout} if timeout is not None else {}
+        response = secrets_client.access_secret_version(request={"name": name}, **options)
         return response.payload.data.decode('UTF-8')
     except Exception as e:
         logger.error(f"Failed to get secret {secret_name}: {e}")
@@ -62,133 +251,89 @@ def generate_device_id(request) -> str:
     return hashlib.sha256(device_string.encode()).hexdigest()[:16]
 
 
-def check_rate_limits(device_id: str) -> tuple[bool, str]:
-    """Check if device has exceeded rate limits"""
-    now = datetime.utcnow()
-    usage_ref = db.collection(USAGE_TRACKING_COLLECTION).document(device_id)
-    
-    try:
-        usage_doc = usage_ref.get()
-        if not usage_doc.exists:
-            # First time user
-            usage_ref.set({
-                'created_at': now,
-                'total_requests': 0,
-                'requests_this_minute': [],
-                'requests_this_hour': [],
-                'requests_this_day': []
-            })
-            return True, "First time user"
-        
-        usage_data = usage_doc.to_dict()
-        
-        # Check lifetime limit
-        if usage_data.get('total_requests', 0) >= RATE_LIMITS['requests_per_device']:
-            return False, "Demo limit reached. Please upgrade to continue."
-        
-        # Clean old timestamps
-        minute_ago = now - timedelta(minutes=1)
-        hour_ago = now - timedelta(hours=1)
-        day_ago = now - timedelta(days=1)
-        
-        requests_this_minute = [ts for ts in usage_data.get('requests_this_minute', []) 
-                                if ts > minute_ago]
-        requests_this_hour = [ts for ts in usage_data.get('requests_this_hour', []) 
-                              if ts > hour_ago]
-        requests_this_day = [ts for ts in usage_data.get('requests_this_day', []) 
-                             if ts > day_ago]
-        
-        # Check rate limits
-        if len(requests_this_minute) >= RATE_LIMITS['requests_per_minute']:
-            return False, "Rate limit exceeded. Please wait a minute."
-        if len(requests_this_hour) >= RATE_LIMITS['requests_per_hour']:
-            return False, "Hourly limit reached. Please wait."
-        if len(requests_this_day) >= RATE_LIMITS['requests_per_day']:
-            return False, "Daily limit reached. Try again tomorrow."
-        
-        return True, "Within limits"
-        
-    except Exception as e:
-        logger.error(f"Rate limit check failed: {e}")
-        return False, "Service error"
+def refresh_key_pool(timeout: float = None):
+    """Reload active keys under their daily quota into the shaper, at most once per refresh period;
+    if the reload fails the current pool is kept"""
+    global _key_pool_loaded_at
+    if time.time() - _key_pool_loaded_at < KEY_POOL_REFRESH_SECONDS:
+        return
+    with _key_pool_lock:
+        if time.time() - _key_pool_loaded_at < KEY_POOL_REFRESH_SECONDS:
+            return
+        try:
+            key_docs = db.collection(SHARED_KEYS_COLLECTION).where('active', '==', True).get(timeout=timeout)
+        except Exception as e:
+            logger.error(f"Failed to refresh key pool: {e}")
+            return
+        limits = {}
+        for key_doc in key_docs:
+            key_data = key_doc.to_dict()
+            if key_data.get('used_today', 0) >= key_data.get('daily_quota', 1000):
+                logger.warning(f"Key {key_doc.id} has reached daily quota")
+                continue
+            limits[key_doc.id] = (key_data.get('rpm_limit', DEFAULT_KEY_RPM),
+                                  key_data.get('tpm_limit', DEFAULT_KEY_TPM))
+        if not limits:
+            logger.error("No available API keys in pool")
+        key_shaper.update_keys(limits)
+        for key_id in list(_api_keys):
+            if key_id not in limits:
+                del _api_keys[key_id]
+        _key_pool_loaded_at = time.time()
 
 
-def get_next_available_key() -> str:
-    """Get next available API key from pool"""
-    keys_ref = db.collection(SHARED_KEYS_COLLECTION)
-    
-    # Get all active keys sorted by usage
-    keys = keys_ref.where('active', '==', True).order_by('used_today').limit(1).get()
-    
-    if not keys:
-        logger.error("No available API keys in pool")
-        return None
-    
-    key_doc = keys[0]
-    key_data = key_doc.to_dict()
-    
-    # Check if key has quota remaining
-    if key_data.get('used_today', 0) >= key_data.get('daily_quota', 1000):
-        logger.warning(f"Key {key_doc.id} has reached daily quota")
-        # Try to find another key
-        keys = keys_ref.where('active', '==', True).where('used_today', '<', 1000).limit(1).get()
-        if not keys:
+def get_api_key(key_id: str, timeout: float = None) -> str:
+    """API key for a pool entry, cached for the life of the instance"""
+    api_key = _api_keys.get(key_id)
+    if api_key is None:
+        try:
+            # In production, use KMS for decryption
+            api_key = get_secret(f"ai-key-{key_id}", timeout)
+        except Exception as e:
+            logger.error(f"Failed to decrypt API key: {e}")
             return None
-        key_doc = keys[0]
-    
-    # Decrypt the API key
-    encrypted_key = key_data.get('api_key')
-    try:
-        # In production, use KMS for decryption
-        api_key = get_secret(f"ai-key-{key_doc.id}")
-        return api_key
-    except Exception as e:
-        logger.error(f"Failed to decrypt API key: {e}")
-        return None
+        _api_keys[key_id] = api_key
+    return api_key
 
 
-def track_usage(device_id: str, success: bool, tokens_used: int = 0):
-    """Track API usage for analytics and rate limiting"""
-    now = datetime.utcnow()
-    usage_ref = db.collection(USAGE_TRACKING_COLLECTION).document(device_id)
-    
-    try:
-        usage_ref.update({
-            'total_requests': firestore.Increment(1),
-            'successful_requests': firestore.Increment(1 if success else 0),
-            'total_tokens': firestore.Increment(tokens_used),
-            'last_request': now,
-            'requests_this_minute': firestore.ArrayUnion([now]),
-            'requests_this_hour': firestore.ArrayUnion([now]),
-            'requests_this_day': firestore.ArrayUnion([now])
-        })
-    except Exception as e:
-        logger.error(f"Failed to track usage: {e}")
-
-
-def proxy_to_gemini(request_data: dict, api_key: str) -> dict:
-    """Proxy request to Gemini API"""
+def proxy_to_gemini(request_data: dict, upstream, deadline: Deadline, api_key: str = None,
+                    access_token: str = None) -> dict:
+    """Proxy request to one Gemini or Vertex upstream, recording its latency and errors"""
+    timeout = deadline.timeout('upstream call', cap=UPSTREAM_TIMEOUT_SECONDS, minimum=MIN_UPSTREAM_SECONDS)
+    started = time.perf_counter()
+    healthy = False
+    # A call cut short by the request's deadline says nothing about the upstream
+    cut_short = False
     try:
         # Extract the model and request type
-        model = request_data.get('model', 'gemini-1.5-flash')
+        model = request_data.get('model', DEFAULT_MODEL)
         endpoint = request_data.get('endpoint', 'generateContent')
         
-        # Build Gemini API URL
-        url = f"{GEMINI_API_BASE}/models/{model}:{endpoint}?key={api_key}"
+        # Build the upstream URL; Gemini API takes the key, Vertex a bearer token
+        url = upstream.url(model, endpoint)
+        params = {'key': api_key} if api_key else None
+        auth_headers = {'Authorization': f'Bearer {access_token}'} if access_token else None
         
         # Prepare request payload
-        gemini_payload = {
-            'contents': request_data.get('contents', []),
-            'generationConfig': request_data.get('generationConfig', {
-                'temperature': 0.7,
-                'topK': 1,
-                'topP': 1,
-                'maxOutputTokens': 2048,
-            })
-        }
+        if endpoint == 'embedContent':
+            gemini_payload = {field: request_data[field] for field in EMBED_FIELDS if field in request_data}
+        elif endpoint == 'batchEmbedContents':
+            gemini_payload = {'requests': request_data.get('requests', [])}
+        else:
+            gemini_payload = {
+                'contents': request_data.get('contents', []),
+                'generationConfig': request_data.get('generationConfig', {
+                    'temperature': 0.7,
+                    'topK': 1,
+                    'topP': 1,
+                    'maxOutputTokens': 2048,
+                })
+            }
         
         # Make request to Gemini
-        response = requests.post(url, json=gemini_payload, timeout=30)
+        response = requests.post(url, params=params, headers=auth_headers, json=gemini_payload, timeout=timeout)
+        # Client errors are the request's fault, not the region's
+        healthy = response.status_code < 500 and response.status_code not in (408, 429)
         response.raise_for_status()
         
         result = response.json()
@@ -200,17 +345,182 @@ def proxy_to_gemini(request_data: dict, api_key: str) -> dict:
         return {
             'success': True,
             'response': result,
-            'tokens_used': tokens_used
+            'tokens_used': tokens_used,
+            'upstream': upstream.name
         }
         
     except requests.exceptions.Timeout:
-        return {'success': False, 'error': 'Request timeout'}
+        if timeout < UPSTREAM_TIMEOUT_SECONDS:
+            cut_short = True
+            return {'success': False, 'error': 'Deadline exceeded', 'deadline_exceeded': True}
+        return {'success': False, 'error': 'Request timeout', 'retryable': True}
+    except requests.exceptions.HTTPError as e:
+        if e.response is not None and e.response.status_code == 429:
+            retry_after = e.response.headers.get('Retry-After', '')
+            # A shared key's 429 is handled by the key shaper; Vertex 429s are regional
+            return {'success': False, 'error': 'Upstream rate limited', 'throttled': True,
+                    'retryable': upstream.kind == VERTEX,
+                    'retry_after': float(retry_after) if retry_after.isdigit() else None}
+        logger.error(f"Gemini API request failed: {e}")
+        return {'success': False, 'error': 'API request failed', 'retryable': not healthy}
     except requests.exceptions.RequestException as e:
         logger.error(f"Gemini API request failed: {e}")
-        return {'success': False, 'error': 'API request failed'}
+        return {'success': False, 'error': 'API request failed', 'retryable': True}
     except Exception as e:
         logger.error(f"Unexpected error in proxy: {e}")
         return {'success': False, 'error': 'Internal error'}
+    finally:
+        if not cut_short:
+            upstream_router.record(upstream, time.perf_counter() - started, healthy)
+
+
+def call_with_shared_key(request_data: dict, upstream, estimated_tokens: int, deadline: Deadline,
+                         used_keys: list = None, max_wait: float = None) -> dict:
+    """Gemini API call on the key with the most headroom; a key that returns
+    429 anyway is benched and the request tries one other key. Keys are
+    appended to used_keys, and keys already in it are skipped"""
+    refresh_key_pool(deadline.timeout('key pool refresh'))
+    used_keys = [] if used_keys is None else used_keys
+    result = None
+    for attempt in range(2):
+        # Never queue for a key past the point where the call itself would no longer fit
+        wait = min(key_shaper.max_wait if max_wait is None else max_wait,
+                   max(0.0, deadline.remaining() - MIN_UPSTREAM_SECONDS))
+        lease = key_shaper.acquire(estimated_tokens, wait, exclude=used_keys)
+        api_key = get_api_key(lease.key_id, deadline.timeout('API key fetch')) if lease else None
+        if not api_key:
+            return {'success': False, 'error': 'No API keys available', 'unavailable': True,
+                    'retryable': True}
+        used_keys.append(lease.key_id)
+
+        result = proxy_to_gemini(request_data, upstream, deadline, api_key=api_key)
+        if not result.get('throttled'):
+            key_shaper.settle(lease, result.get('tokens_used'))
+            break
+        key_shaper.throttled(lease, result.get('retry_after'))
+    return result
+
+
+def call_on(request_data: dict, upstream, estimated_tokens: int, deadline: Deadline, used_keys: list = None,
+            max_wait: float = None) -> dict:
+    """One call on the given upstream, with its kind of credential"""
+    try:
+        if upstream.kind == VERTEX:
+            try:
+                token = vertex_token.token(deadline.timeout('Vertex token', cap=10))
+            except DeadlineExceeded:
+                raise
+            except Exception as e:
+                logger.error(f"Failed to get Vertex access token: {e}")
+                return {'success': False, 'error': 'Upstream authentication failed', 'retryable': True}
+            return proxy_to_gemini(request_data, upstream, deadline, access_token=token)
+        return call_with_shared_key(request_data, upstream, estimated_tokens, deadline, used_keys, max_wait)
+    except DeadlineExceeded as e:
+        logger.warning(f"{e} on {upstream.name}")
+        return {'success': False, 'error': 'Deadline exceeded', 'deadline_exceeded': True}
+
+
+def call_hedged(request_data: dict, upstream, estimated_tokens: int, deadline: Deadline) -> dict:
+    """Call upstream, hedging on another region (or another key of the Gemini API) if it is slow"""
+    model = request_data.get('model', DEFAULT_MODEL)
+    used_keys = []
+
+    def hedge(decided):
+        alternative = upstream_router.choose(model, exclude=[upstream.name])
+        if alternative is None and upstream.kind == GEMINI:
+            alternative = upstream
+        if alternative is None or decided.is_set():
+            return None
+        # A hedge never queues for a key: it is only worth sending right away
+        result = call_on(request_data, alternative, estimated_tokens, deadline, used_keys, max_wait=0)
+        return None if result.get('unavailable') or result.get('deadline_exceeded') else result
+
+    return hedger.run(model, lambda: call_on(request_data, upstream, estimated_tokens, deadline, used_keys),
+                      hedge)
+
+
+def call_upstream(request_data: dict, deadline: Deadline) -> dict:
+    """Send the request to the fastest healthy upstream serving its model, failing over once"""
+    upstream_router.probe_idle(probe_upstream)
+    model = request_data.get('model', DEFAULT_MODEL)
+    estimated_tokens = estimate_tokens(request_data)
+    result = {'success': False, 'error': f'No upstream serves {model}', 'unavailable': True}
+    tried = []
+    if request_data.get('endpoint') in GEMINI_ONLY_ENDPOINTS:
+        tried = [upstream.name for upstream in upstream_router.upstreams if upstream.kind == VERTEX]
+    for attempt in range(2):
+        upstream = upstream_router.choose(model, exclude=tried)
+        if upstream is None:
+            break
+        tried.append(upstream.name)
+        if HEDGING_ENABLED:
+            result = call_hedged(request_data, upstream, estimated_tokens, deadline)
+        else:
+            result = call_on(request_data, upstream, estimated_tokens, deadline)
+        if result['success'] or not result.get('retryable'):
+            break
+    return result
+
+
+def send_embed_batch(model: str, items: list, deadline: Deadline) -> list:
+    """One upstream call for a batch of embedContent requests, split back into one result each"""
+    if len(items) == 1:
+        return [call_upstream(dict(items[0], model=model, endpoint='embedContent'), deadline)]
+    result = call_upstream({
+        'model': model,
+        'endpoint': 'batchEmbedContents',
+        'requests': [dict(item, model=f"models/{model}") for item in items]
+    }, deadline)
+    if not result['success']:
+        # A failure no retry would fix may come from one bad item; each member retries alone
+        split = not any(result.get(flag) for flag in
+                        ('retryable', 'unavailable', 'throttled', 'deadline_exceeded'))
+        return [dict(result, split=split) for _ in items]
+    embeddings = result['response'].get('embeddings', [])
+    if len(embeddings) != len(items):
+        logger.error(f"batchEmbedContents returned {len(embeddings)} embeddings for {len(items)} requests")
+        return [{'success': False, 'error': 'API request failed'} for _ in items]
+
+    # Any reported usage is shared out by each request's estimated size
+    estimates = [estimate_tokens(item) for item in items]
+    tokens_used = result.get('tokens_used', 0)
+    return [{
+        'success': True,
+        'response': {'embedding': embedding},
+        'tokens_used': tokens_used * estimate // sum(estimates),
+        'upstream': result['upstream']
+    } for embedding, estimate in zip(embeddings, estimates)]
+
+
+embed_batcher = EmbedBatcher(send_embed_batch, EMBED_BATCH_WINDOW_SECONDS, EMBED_BATCH_MAX_SIZE,
+                             EMBED_BATCH_MIN_DEADLINE_SECONDS)
+
+
+def probe_upstream(upstream):
+    """countTokens on an idle upstream; None when it can't be probed yet"""
+    model = next(iter(upstream.models)) if upstream.models else DEFAULT_MODEL
+    if upstream.kind == VERTEX:
+        params, auth_headers = None, {'Authorization': f'Bearer {vertex_token.token()}'}
+    else:
+        api_key = next(iter(_api_keys.values()), None)
+        if not api_key:
+            return None
+        params, auth_headers = {'key': api_key}, None
+    response = requests.post(upstream.url(model, 'countTokens'), params=params, headers=auth_headers,
+                             json={'contents': [{'role': 'user', 'parts': [{'text': 'ping'}]}]}, timeout=10)
+    return response.status_code < 500 and response.status_code not in (408, 429)
+
+
+def record_usage_within(deadline: Deadline, admission, success: bool, tokens_used: int = 0,
+                        upstream: bool = True, deferred: bool = False):
+    """Usage write in the time left; deferred (ticket) usage, or any with too little
+    time, goes to the reconciler, whose overdue writes are committed here if time allows"""
+    if deferred or deadline.remaining() < USAGE_WRITE_MIN_SECONDS:
+        usage_reconciler.enqueue(admission, success, tokens_used, upstream)
+    else:
+        rate_limiter.record(admission, success, tokens_used, upstream, timeout=deadline.remaining())
+    if deadline.remaining() >= USAGE_WRITE_MIN_SECONDS:
+        usage_reconciler.flush_if_due(timeout=deadline.remaining())
 
 
 @functions_framework.http
@@ -222,13 +532,15 @@ def ai_proxy(request):
         headers = {
             'Access-Control-Allow-Origin': '*',
             'Access-Control-Allow-Methods': 'POST',
-            'Access-Control-Allow-Headers': 'Content-Type',
+            'Access-Control-Allow-Headers': f'Content-Type, X-Demo-Ticket, {DEADLINE_HEADER}',
             'Access-Control-Max-Age': '3600'
         }
         return ('', 204, headers)
     
     headers = {
         'Access-Control-Allow-Origin': '*',
+        'Access-Control-Expose-Headers': ', '.join(['X-Demo-Ticket', 'X-Frame-Cache', 'X-Upstream'] +
+                                                  RATE_LIMIT_HEADERS),
         'Content-Type': 'application/json'
     }
     
@@ -236,6 +548,7 @@ def ai_proxy(request):
         # Validate request
         if request.method != 'POST':
             return json.dumps({'error': 'Method not allowed'}), 405, headers
+        deadline = Deadline.from_request(request, REQUEST_DEADLINE_SECONDS, DEADLINE_MARGIN_SECONDS)
         
         request_data = request.get_json()
         if not request_data:
@@ -245,37 +558,101 @@ def ai_proxy(request):
         device_id = generate_device_id(request)
         logger.info(f"Processing request for device: {device_id}")
         
-        # Check rate limits
-        allowed, message = check_rate_limits(device_id)
-        if not allowed:
+        # A valid ticket admits locally; otherwise check device, network and
+        # global limits in one read
+        network = network_key(client_ip(request, TRUSTED_PROXY_HOPS))
+        decision = None
+        if DEMO_TICKETS_ENABLED and request.headers.get('X-Demo-Ticket'):
+            try:
+                decision = demo_tickets.admit(request.headers['X-Demo-Ticket'], device_id, network)
+            except Exception as e:
+                logger.error(f"Ticket check failed: {e}")
+        if decision:
+            admission = decision.admission
+            headers['X-Demo-Ticket'] = decision.ticket
+            record_usage = partial(record_usage_within, deadline, deferred=True)
+        else:
+            admission = rate_limiter.admit(device_id, network, timeout=deadline.timeout('admission'))
+            record_usage = partial(record_usage_within, deadline)
+            if DEMO_TICKETS_ENABLED and admission.allowed:
+                try:
+                    headers['X-Demo-Ticket'] = demo_tickets.issue(admission)
+                except Exception as e:
+                    logger.error(f"Failed to issue demo ticket: {e}")
+        # Quota state rides on every response so clients needn't poll get_device_status
+        headers.update(rate_limit_headers(admission, RATE_LIMITS))
+        if not admission.allowed:
+            if admission.tier == GLOBAL:
+                return json.dumps({
+                    'error': 'Service temporarily unavailable',
+                    'message': admission.message
+                }), 503, headers
             return json.dumps({
                 'error': 'Rate limit exceeded',
-                'message': message,
+                'message': admission.message,
                 'upgrade_url': 'https://anava.ai/upgrade'
             }), 429, headers
         
-        # Get available API key
-        api_key = get_next_available_key()
-        if not api_key:
+        # Serve near-identical frames from the device's last analysis
+        frame_fingerprint = None
+        frame_options = request_data.get('frame_cache')
+        if FRAME_CACHE_ENABLED and frame_options:
+            frame_fingerprint = frame_cache.fingerprint(request_data)
+        if frame_fingerprint:
+            max_distance = frame_options.get('max_distance') if isinstance(frame_options, dict) else None
+            if not isinstance(max_distance, int):
+                max_distance = None
+            cached = frame_cache.lookup(device_id, frame_fingerprint, max_distance)
+            headers['X-Frame-Cache'] = 'HIT' if cached else 'MISS'
+            if cached:
+                record_usage(admission, True, 0, upstream=False)
+                response = dict(cached['response'])
+                response['frameCache'] = {
+                    'hit': True,
+                    'distance': cached['distance'],
+                    'ageSeconds': cached['age_seconds']
+                }
+                return json.dumps(response), 200, headers
+
+        # Proxy to the fastest healthy upstream, batching concurrent embeddings
+        if EMBED_BATCHING_ENABLED and request_data.get('endpoint') == 'embedContent':
+            item = {field: request_data[field] for field in EMBED_FIELDS if field in request_data}
+            result = embed_batcher.embed(request_data.get('model', DEFAULT_MODEL), item, deadline) or \
+                {'success': False, 'error': 'Deadline exceeded', 'deadline_exceeded': True}
+        else:
+            result = call_upstream(request_data, deadline)
+        if result.get('unavailable'):
             return json.dumps({
                 'error': 'Service temporarily unavailable',
-                'message': 'No API keys available. Please try again later.'
+                'message': f"{result['error']}. Please try again later."
             }), 503, headers
-        
-        # Proxy to Gemini
-        result = proxy_to_gemini(request_data, api_key)
-        
+
         # Track usage
-        track_usage(device_id, result['success'], result.get('tokens_used', 0))
+        record_usage(admission, result['success'], result.get('tokens_used', 0))
         
+        if result.get('deadline_exceeded'):
+            return json.dumps({
+                'error': 'Deadline exceeded',
+                'message': 'The AI request could not be completed in time'
+            }), 504, headers
         if result['success']:
+            headers['X-Upstream'] = result['upstream']
+            if frame_fingerprint:
+                frame_cache.store(device_id, frame_fingerprint, result['response'])
+                result['response']['frameCache'] = {'hit': False}
             return json.dumps(result['response']), 200, headers
         else:
             return json.dumps({
                 'error': result['error'],
                 'message': 'Failed to process AI request'
-            }), 500, headers
+            }), 503 if result.get('throttled') else 500, headers
             
+    except DeadlineExceeded as e:
+        logger.warning(f"{e}")
+        return json.dumps({
+            'error': 'Deadline exceeded',
+            'message': 'The AI request could not be completed in time'
+        }), 504, headers
     except Exception as e:
         logger.error(f"Unhandled error in ai_proxy: {e}")
         return json.dumps({
@@ -322,16 +699,244 @@ def get_device_status(request):
         
         usage_data = usage_doc.to_dict()
         total_requests = usage_data.get('total_requests', 0)
+        # Requests held for queued analysis jobs are no longer available
+        committed = total_requests + usage_data.get('reserved_requests', 0)
         
         return json.dumps({
             'device_id': device_id,
-            'status': 'active' if total_requests < RATE_LIMITS['requests_per_device'] else 'limit_reached',
+            'status': 'active' if committed < RATE_LIMITS['requests_per_device'] else 'limit_reached',
             'requests_used': total_requests,
-            'requests_remaining': max(0, RATE_LIMITS['requests_per_device'] - total_requests),
+            'requests_remaining': max(0, RATE_LIMITS['requests_per_device'] - committed),
             'daily_limit': RATE_LIMITS['requests_per_day'],
             'created_at': usage_data.get('created_at', datetime.utcnow()).isoformat()
         }), 200, headers
         
     except Exception as e:
         logger.error(f"Error getting device status: {e}")
-        return json.dumps({'error': 'Failed to get status'}), 500, headers
\ No newline at end of file
+        return json.dumps({'error': 'Failed to get status'}), 500, headers
+
+
+def compact_status(usage_data) -> dict:
+    """Short status entry for one device from its masked usage fields (None if never seen)"""
+    if usage_data is None:
+        return {'status': 'new', 'used': 0, 'remaining': RATE_LIMITS['requests_per_device']}
+    total_requests = usage_data.get('total_requests', 0)
+    committed = total_requests + usage_data.get('reserved_requests', 0)
+    last_request = usage_data.get('last_request')
+    return {
+        'status': 'active' if committed < RATE_LIMITS['requests_per_device'] else 'limit_reached',
+        'used': total_requests,
+        'remaining': max(0, RATE_LIMITS['requests_per_device'] - committed),
+        'last_request': last_request.isoformat() if last_request else None
+    }
+
+
+def bulk_device_statuses(device_ids: list) -> dict:
+    """Statuses for many devices: cached entries first, the rest in one masked get_all"""
+    now = time.time()
+    statuses = {}
+    with _status_cache_lock:
+        for device_id in device_ids:
+            cached = _status_cache.get(device_id)
+            if cached and cached[0] > now:
+                statuses[device_id] = cached[1]
+
+    missing = [device_id for device_id in device_ids if device_id not in statuses]
+    if missing:
+        collection = db.collection(USAGE_TRACKING_COLLECTION)
+        refs = [collection.document(device_id) for device_id in missing]
+        fetched = {device_id: compact_status(None) for device_id in missing}
+        for snapshot in db.get_all(refs, field_paths=STATUS_FIELDS):
+            if snapshot.exists:
+                fetched[snapshot.id] = compact_status(snapshot.to_dict())
+        statuses.update(fetched)
+
+        expires = now + STATUS_CACHE_TTL_SECONDS
+        with _status_cache_lock:
+            for device_id in [k for k, (expiry, _) in _status_cache.items() if expiry <= now]:
+                del _status_cache[device_id]
+            for device_id, status in fetched.items():
+                _status_cache[device_id] = (expires, status)
+    return statuses
+
+
+@functions_framework.http
+def get_bulk_device_status(request):
+    """Demo status for many devices in one call
+
+    POST {"device_ids": [...]} or GET ?device_ids=a,b,c; up to MAX_BULK_DEVICE_IDS.
+    """
+    if request.method == 'OPTIONS':
+        headers = {
+            'Access-Control-Allow-Origin': '*',
+            'Access-Control-Allow-Methods': 'GET, POST',
+            'Access-Control-Allow-Headers': 'Content-Type',
+            'Access-Control-Max-Age': '3600'
+        }
+        return ('', 204, headers)
+
+    headers = {
+        'Access-Control-Allow-Origin': '*',
+        'Content-Type': 'application/json'
+    }
+
+    try:
+        if request.method == 'POST':
+            device_ids = (request.get_json(silent=True) or {}).get('device_ids')
+        else:
+            device_ids = [d for d in request.args.get('device_ids', '').split(',') if d]
+        if not isinstance(device_ids, list) or not device_ids or \
+                not all(isinstance(d, str) and d and '/' not in d for d in device_ids):
+            return json.dumps({'error': 'device_ids must be a non-empty list of device IDs'}), 400, headers
+        device_ids = list(dict.fromkeys(device_ids))
+        if len(device_ids) > MAX_BULK_DEVICE_IDS:
+            return json.dumps({
+                'error': f'At most {MAX_BULK_DEVICE_IDS} device_ids per request'
+            }), 400, headers
+
+        return json.dumps({
+            'limits': {
+                'requests_per_device': RATE_LIMITS['requests_per_device'],
+                'requests_per_day': RATE_LIMITS['requests_per_day']
+            },
+            'devices': bulk_device_statuses(device_ids)
+        }), 200, headers
+
+    except Exception as e:
+        logger.error(f"Error getting bulk device status: {e}")
+        return json.dumps({'error': 'Failed to get status'}), 500, headers
+
+
+@functions_framework.http
+def submit_analysis_job(request):
+    """Queue a non-interactive analysis job
+
+    POST {"items": [{"contents": [...], "generationConfig": {...}}, ...], "model": ...,
+    "mode": "offpeak" | "batch", "callback_url": ...}; answers 202 with the job's summary.
+    The submission counts as one request, and every item is reserved against the
+    device's lifetime quota up front, then counted as it is processed.
+    """
+    if request.method == 'OPTIONS':
+        headers = {
+            'Access-Control-Allow-Origin': '*',
+            'Access-Control-Allow-Methods': 'POST',
+            'Access-Control-Allow-Headers': 'Content-Type',
+            'Access-Control-Max-Age': '3600'
+        }
+        return ('', 204, headers)
+
+    headers = {
+        'Access-Control-Allow-Origin': '*',
+        'Access-Control-Expose-Headers': ', '.join(RATE_LIMIT_HEADERS),
+        'Content-Type': 'application/json'
+    }
+
+    try:
+        if request.method != 'POST':
+            return json.dumps({'error': 'Method not allowed'}), 405, headers
+        request_data = request.get_json(silent=True)
+        if not request_data:
+            return json.dumps({'error': 'Invalid request body'}), 400, headers
+
+        device_id = generate_device_id(request)
+        network = network_key(client_ip(request, TRUSTED_PROXY_HOPS))
+        deadline = Deadline.from_request(request, REQUEST_DEADLINE_SECONDS, DEADLINE_MARGIN_SECONDS)
+        admission = rate_limiter.admit(device_id, network, timeout=deadline.timeout('admission'))
+        headers.update(rate_limit_headers(admission, RATE_LIMITS))
+        if not admission.allowed:
+            return json.dumps({
+                'error': 'Rate limit exceeded',
+                'message': admission.message
+            }), 503 if admission.tier == GLOBAL else 429, headers
+
+        # The submission itself is a request on every tier but the global one
+        record_usage_within(deadline, admission, True, 0, upstream=False)
+
+        # The whole job has to fit in what the device has left today, and its
+        # items are held against the lifetime quota until they are processed
+        items = validate_items(request_data.get('items'), MAX_JOB_ITEMS)
+        remaining = min(RATE_LIMITS['requests_per_device'] - admission.counts.get('total', 0),
+                        RATE_LIMITS['requests_per_day'] - admission.counts.get('requests_per_day', 0)) - 1
+        reserved = False
+        if len(items) <= remaining:
+            reserved, remaining = rate_limiter.reserve(device_id, len(items), timeout=deadline.timeout('reservation'))
+        if not reserved:
+            return json.dumps({
+                'error': 'Rate limit exceeded',
+                'message': f"The job has {len(items)} items but only {max(0, remaining)} requests remain."
+            }), 429, headers
+
+        try:
+            job = analysis_jobs.create(device_id, network, request_data['items'],
+                                       request_data.get('model', DEFAULT_MODEL), request_data.get('mode', 'offpeak'),
+                                       request_data.get('callback_url'), MAX_JOB_ITEMS)
+        except Exception:
+            rate_limiter.release(device_id, len(items))
+            raise
+        logger.info(f"Queued analysis job {job['job_id']} with {job['item_count']} items for device {device_id}")
+        return json.dumps(job), 202, headers
+
+    except JobError as e:
+        return json.dumps({'error': str(e)}), 400, headers
+    except DeadlineExceeded as e:
+        logger.warning(f"{e}")
+        return json.dumps({'error': 'Deadline exceeded'}), 504, headers
+    except Exception as e:
+        logger.error(f"Error submitting analysis job: {e}")
+        return json.dumps({'error': 'Failed to submit job'}), 500, headers
+
+
+@functions_framework.http
+def get_analysis_job(request):
+    """Job state and a page of its results: GET ?job_id=...&page_token=...&page_size=..."""
+    if request.method == 'OPTIONS':
+        headers = {
+            'Access-Control-Allow-Origin': '*',
+            'Access-Control-Allow-Methods': 'GET',
+            'Access-Control-Allow-Headers': 'Content-Type',
+            'Access-Control-Max-Age': '3600'
+        }
+        return ('', 204, headers)
+
+    headers = {
+        'Access-Control-Allow-Origin': '*',
+        'Content-Type': 'application/json'
+    }
+
+    try:
+        job_id = request.args.get('job_id', '')
+        if not JOB_ID_PATTERN.match(job_id):
+            return json.dumps({'error': 'job_id is required'}), 400, headers
+        try:
+            page_size = int(request.args.get('page_size', '50'))
+        except ValueError:
+            return json.dumps({'error': 'page_size must be an integer'}), 400, headers
+
+        job = analysis_jobs.get(job_id)
+        if job is None:
+            return json.dumps({'error': 'Job not found'}), 404, headers
+        results, next_page_token = analysis_jobs.results_page(job_id, request.args.get('page_token'), page_size)
+        response = analysis_jobs.summary(job_id, job)
+        response.update({'results': results, 'next_page_token': next_page_token})
+        return json.dumps(response), 200, headers
+
+    except JobError as e:
+        return json.dumps({'error': str(e)}), 400, headers
+    except Exception as e:
+        logger.error(f"Error getting analysis job: {e}")
+        return json.dumps({'error': 'Failed to get job'}), 500, headers
+
+
+@functions_framework.http
+def run_analysis_jobs(request):
+    """Scheduled worker: advance queued and running analysis jobs"""
+    headers = {'Content-Type': 'application/json'}
+    try:
+        offpeak = datetime.utcnow().hour in JOB_OFFPEAK_HOURS
+        stats = analysis_jobs.run(Deadline(JOB_RUN_SECONDS), offpeak, JOB_MAX_ITEMS_PER_RUN)
+        stats['usage_recorded'] = usage_reconciler.flush()
+        logger.info(f"Analysis job run finished (offpeak={offpeak}): {stats}")
+        return json.dumps(stats), 200, headers
+    except Exception as e:
+        logger.error(f"Analysis job run failed: {e}")
+        return json.dumps({'error': 'Job run failed'}), 500, headers
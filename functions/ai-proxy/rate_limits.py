@@ -0,0 +1,362 @@
+"""
+Hierarchical rate limits for the AI proxy
+A request is admitted only if its device, its source network (/24 for IPv4,
+/64 for IPv6) and the whole proxy are all under their limits. Device IDs are
+derived from client-supplied fields and are cheap to mint, so the network
+tier is what actually bounds a single abuser, and the global tier protects
+the shared key pool from overall overload.
+
+Every tier is read with one get_all and every counter is written in one batch
+commit. Network and global counters are fixed windows stored one document per
+window; the global windows are split across shards so no single document
+takes the proxy's whole write rate. Old window documents carry expires_at for
+a Firestore TTL policy.
+
+The global shards are only read when an instance's cached totals are older
+than global_cache_seconds; in between, the instance adds the requests it
+recorded itself. A request therefore costs 4 reads (device plus 3 network
+windows) rather than 4 + 3 x shards, and other instances' traffic is seen at
+most that many seconds late.
+"""
+
+import ipaddress
+import logging
+import random
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Tuple
+
+from google.cloud import firestore
+
+logger = logging.getLogger(__name__)
+
+DEVICE = 'device'
+NETWORK = 'network'
+GLOBAL = 'global'
+
+# (limit key, window seconds, document ID prefix)
+WINDOWS = [
+    ('requests_per_minute', 60, 'm'),
+    ('requests_per_hour', 3600, 'h'),
+    ('requests_per_day', 86400, 'd'),
+]
+
+MESSAGES = {
+    'requests_per_device': "Demo limit reached. Please upgrade to continue.",
+    (DEVICE, 'requests_per_minute'): "Rate limit exceeded. Please wait a minute.",
+    (DEVICE, 'requests_per_hour'): "Hourly limit reached. Please wait.",
+    (DEVICE, 'requests_per_day'): "Daily limit reached. Try again tomorrow.",
+    NETWORK: "Too many requests from your network. Please wait.",
+    GLOBAL: "The demo service is busy. Please try again shortly.",
+}
+
+
+def network_key(ip: Optional[str]) -> str:
+    """Document-safe key for the /24 or /64 containing ip"""
+    try:
+        address = ipaddress.ip_address((ip or '').strip())
+    except ValueError:
+        return 'unknown'
+    if address.version == 6 and address.ipv4_mapped:
+        address = address.ipv4_mapped
+    prefix = 24 if address.version == 4 else 64
+    network = ipaddress.ip_network(f"{address}/{prefix}", strict=False)
+    return f"{network.network_address}_{prefix}"
+
+
+def client_ip(request, trusted_hops: int = 0) -> Optional[str]:
+    """Client address from X-Forwarded-For, skipping trusted_hops proxies
+
+    Google's frontend appends the address it saw as the last entry; anything
+    before that is client-supplied. Called directly on its cloudfunctions.net
+    URL (as deploy.sh deploys it) that last entry is the client, so
+    trusted_hops is 0. Behind an external HTTPS load balancer or API Gateway,
+    each of which appends its own address after the client's, use 1.
+    """
+    entries = [entry.strip() for entry in request.headers.get('X-Forwarded-For', '').split(',')]
+    if len(entries) > trusted_hops and entries[-1 - trusted_hops]:
+        return entries[-1 - trusted_hops]
+    return request.remote_addr
+
+
+def fixed_window_reset(now: datetime, seconds: int) -> float:
+    """Seconds until the fixed window containing now (naive UTC) ends"""
+    timestamp = now.replace(tzinfo=timezone.utc).timestamp()
+    return seconds - timestamp % seconds
+
+
+class Admission:
+    """Outcome of one admit() call, carried through to record()"""
+
+    def __init__(self, device_id: str, network: str, now: datetime, new_device: bool,
+                 allowed: bool = True, tier: Optional[str] = None, message: str = "Within limits"):
+        self.device_id = device_id
+        self.network = network
+        self.now = now
+        self.new_device = new_device
+        # Counts a request whose lifetime quota was reserved in advance (an analysis job item)
+        self.reserved = False
+        self.allowed = allowed
+        self.tier = tier
+        self.message = message
+        # Window limit key that refused the request
+        self.limit_key: Optional[str] = None
+        # Device usage seen at admission: lifetime 'total' and a count per window limit key
+        self.counts: Dict[str, int] = {'total': 0}
+        # Seconds until each device window frees a request
+        self.resets: Dict[str, float] = {}
+
+
+class HierarchicalRateLimiter:
+    """Device, network and global limits checked and recorded together"""
+
+    def __init__(self, db: firestore.Client, device_collection: str, network_collection: str,
+                 global_collection: str, device_limits: Dict[str, int], network_limits: Dict[str, int],
+                 global_limits: Dict[str, int], global_shards: int = 10, global_cache_seconds: float = 5.0):
+        self.db = db
+        self.device_collection = device_collection
+        self.network_collection = network_collection
+        self.global_collection = global_collection
+        self.limits = {DEVICE: device_limits, NETWORK: network_limits, GLOBAL: global_limits}
+        self.global_shards = global_shards
+        self.global_cache_seconds = global_cache_seconds
+        # Global totals per window as of the last shard read, plus this instance's requests since
+        self._global_windows: Optional[tuple] = None
+        self._global_read_at = 0.0
+        self._global_counts: Dict[str, int] = {}
+        self._global_local: Dict[str, int] = {}
+        self._global_lock = threading.Lock()
+
+    @staticmethod
+    def _window(now: datetime, seconds: int) -> int:
+        return int(now.replace(tzinfo=timezone.utc).timestamp()) // seconds
+
+    def _network_ref(self, network: str, prefix: str, window: int):
+        return self.db.collection(self.network_collection).document(f"{network}_{prefix}{window}")
+
+    def _global_refs(self, prefix: str, window: int) -> List:
+        collection = self.db.collection(self.global_collection)
+        return [collection.document(f"{prefix}{window}_{shard}") for shard in range(self.global_shards)]
+
+    def _global_due(self, windows: tuple) -> bool:
+        with self._global_lock:
+            return (windows != self._global_windows
+                    or time.monotonic() - self._global_read_at >= self.global_cache_seconds)
+
+    def _global_totals(self, windows: tuple, read: Optional[Dict[str, int]]) -> Dict[str, int]:
+        """Cached global totals, replaced by read when the shards were just read"""
+        with self._global_lock:
+            if read is not None:
+                self._global_windows = windows
+                self._global_read_at = time.monotonic()
+                self._global_counts = read
+                self._global_local = {}
+            if windows != self._global_windows:
+                return {}
+            return {limit_key: count + self._global_local.get(limit_key, 0)
+                    for limit_key, count in self._global_counts.items()}
+
+    def admit(self, device_id: str, network: str, timeout: Optional[float] = None) -> Admission:
+        """Check every tier against one consistent read; fails closed on errors and timeouts"""
+        now = datetime.utcnow()
+        device_ref = self.db.collection(self.device_collection).document(device_id)
+        windows = tuple(self._window(now, seconds) for _, seconds, _ in WINDOWS)
+        read_global = self._global_due(windows)
+        counters = {}
+        for (limit_key, _, prefix), window in zip(WINDOWS, windows):
+            counters[(NETWORK, limit_key)] = [self._network_ref(network, prefix, window)]
+            if read_global:
+                counters[(GLOBAL, limit_key)] = self._global_refs(prefix, window)
+
+        refs = [device_ref] + [ref for group in counters.values() for ref in group]
+        try:
+            snapshots = {snapshot.reference.path: snapshot for snapshot in self.db.get_all(refs, timeout=timeout)}
+        except Exception as e:
+            logger.error(f"Rate limit check failed: {e}")
+            return Admission(device_id, network, now, False, allowed=False, message="Service error")
+
+        def count(ref) -> int:
+            snapshot = snapshots.get(ref.path)
+            return (snapshot.get('count') or 0) if snapshot is not None and snapshot.exists else 0
+
+        totals = {(NETWORK, limit_key): count(counters[(NETWORK, limit_key)][0]) for limit_key, _, _ in WINDOWS}
+        global_read = ({limit_key: sum(count(ref) for ref in counters[(GLOBAL, limit_key)])
+                        for limit_key, _, _ in WINDOWS} if read_global else None)
+        for limit_key, total in self._global_totals(windows, global_read).items():
+            totals[(GLOBAL, limit_key)] = total
+
+        device = snapshots.get(device_ref.path)
+        new_device = device is None or not device.exists
+        admission = Admission(device_id, network, now, new_device)
+
+        # Broadest tier first, so a global overload isn't reported as the device's fault
+        for tier in (GLOBAL, NETWORK):
+            for limit_key, seconds, _ in WINDOWS:
+                limit = self.limits[tier].get(limit_key)
+                if limit is not None and totals.get((tier, limit_key), 0) >= limit:
+                    admission.allowed, admission.tier, admission.message = False, tier, MESSAGES[tier]
+                    admission.limit_key = limit_key
+                    admission.resets[limit_key] = fixed_window_reset(now, seconds)
+                    return admission
+
+        if new_device:
+            admission.counts.update({limit_key: 0 for limit_key, _, _ in WINDOWS})
+            admission.resets.update({limit_key: seconds for limit_key, seconds, _ in WINDOWS})
+            admission.message = "First time user"
+            return admission
+
+        usage = device.to_dict()
+        # Requests held for queued analysis jobs count as already used
+        admission.counts['total'] = usage.get('total_requests', 0) + usage.get('reserved_requests', 0)
+        for limit_key, seconds, _ in WINDOWS:
+            since = now - timedelta(seconds=seconds)
+            field = limit_key.replace('requests_per_', 'requests_this_')
+            recent = [ts.replace(tzinfo=None) for ts in usage.get(field, []) if ts.replace(tzinfo=None) > since]
+            admission.counts[limit_key] = len(recent)
+            # Sliding window: the oldest request in it is the next to age out
+            admission.resets[limit_key] = (min(recent) - since).total_seconds() if recent else seconds
+
+        if admission.counts['total'] >= self.limits[DEVICE]['requests_per_device']:
+            admission.allowed, admission.tier = False, DEVICE
+            admission.message = MESSAGES['requests_per_device']
+            return admission
+        for limit_key, _, _ in WINDOWS:
+            if admission.counts[limit_key] >= self.limits[DEVICE][limit_key]:
+                admission.allowed, admission.tier = False, DEVICE
+                admission.message = MESSAGES[(DEVICE, limit_key)]
+                admission.limit_key = limit_key
+                return admission
+        return admission
+
+    def usage_writes(self, admission: Admission, success: bool, tokens_used: int = 0,
+                     upstream: bool = True) -> List[tuple]:
+        """(document reference, merge data) pairs that count one request on every tier
+
+        upstream is False for requests answered without calling Gemini (frame
+        cache hits); they count against the device and network but not the
+        global tier, which exists to protect the key pool.
+        """
+        now = admission.now
+        device = {
+            'total_requests': firestore.Increment(1),
+            'successful_requests': firestore.Increment(1 if success else 0),
+            'total_tokens': firestore.Increment(tokens_used),
+            'last_request': now,
+            'requests_this_minute': firestore.ArrayUnion([now]),
+            'requests_this_hour': firestore.ArrayUnion([now]),
+            'requests_this_day': firestore.ArrayUnion([now])
+        }
+        if admission.new_device:
+            device['created_at'] = admission.now
+        if admission.reserved:
+            device['reserved_requests'] = firestore.Increment(-1)
+        writes = [(self.db.collection(self.device_collection).document(admission.device_id), device)]
+
+        for _, seconds, prefix in WINDOWS:
+            window = self._window(admission.now, seconds)
+            counter = {
+                'count': firestore.Increment(1),
+                'expires_at': datetime.utcfromtimestamp((window + 2) * seconds)
+            }
+            writes.append((self._network_ref(admission.network, prefix, window), counter))
+            if upstream:
+                writes.append((random.choice(self._global_refs(prefix, window)), counter))
+        return writes
+
+    def record(self, admission: Admission, success: bool, tokens_used: int = 0, upstream: bool = True,
+               timeout: Optional[float] = None):
+        """Count an admitted request against every tier in one commit"""
+        batch = self.db.batch()
+        for ref, data in self.usage_writes(admission, success, tokens_used, upstream):
+            batch.set(ref, data, merge=True)
+        if upstream:
+            self.count_global(admission)
+        try:
+            batch.commit(timeout=timeout)
+        except Exception as e:
+            logger.error(f"Failed to track usage: {e}")
+
+    def reserve(self, device_id: str, count: int, timeout: Optional[float] = None) -> Tuple[bool, int]:
+        """Hold count lifetime requests for queued work, if the device has them left
+
+        Returns (reserved, lifetime requests that were left). The hold is
+        taken back one request at a time as the work is recorded with
+        admission.reserved set, or all at once with release().
+        """
+        device_ref = self.db.collection(self.device_collection).document(device_id)
+        limit = self.limits[DEVICE]['requests_per_device']
+
+        @firestore.transactional
+        def hold(transaction) -> Tuple[bool, int]:
+            snapshot = device_ref.get(transaction=transaction, timeout=timeout)
+            usage = snapshot.to_dict() if snapshot.exists else {}
+            left = limit - usage.get('total_requests', 0) - usage.get('reserved_requests', 0)
+            if count > left:
+                return False, max(0, left)
+            transaction.set(device_ref, {'reserved_requests': firestore.Increment(count)}, merge=True)
+            return True, left
+
+        return hold(self.db.transaction())
+
+    def release(self, device_id: str, count: int):
+        """Give back reserved requests that will not be used"""
+        if count > 0:
+            self.db.collection(self.device_collection).document(device_id).set(
+                {'reserved_requests': firestore.Increment(-count)}, merge=True)
+
+    def count_global(self, admission: Admission):
+        """Add a request to this instance's cached global totals until the next shard read"""
+        windows = tuple(self._window(admission.now, seconds) for _, seconds, _ in WINDOWS)
+        with self._global_lock:
+            if windows == self._global_windows:
+                for limit_key, _, _ in WINDOWS:
+                    self._global_local[limit_key] = self._global_local.get(limit_key, 0) + 1
+
+
+WINDOW_NAMES = {'requests_per_minute': 'Minute', 'requests_per_hour': 'Hour', 'requests_per_day': 'Day'}
+RATE_LIMIT_HEADERS = ['RateLimit-Limit', 'RateLimit-Remaining', 'RateLimit-Reset', 'RateLimit-Policy',
+                      'X-Demo-Limit', 'X-Demo-Remaining', 'Retry-After'] + [
+    f"X-RateLimit-{field}-{name}" for name in WINDOW_NAMES.values()
+    for field in ('Limit', 'Remaining', 'Reset')]
+
+
+def rate_limit_headers(admission: Admission, device_limits: Dict[str, int]) -> Dict[str, str]:
+    """Quota headers for a response, from the admission alone
+
+    Remaining counts include the current request. The unprefixed RateLimit-*
+    headers (IETF draft) describe whichever device window runs out first;
+    X-RateLimit-*-Minute/Hour/Day describe each window.
+    """
+    headers = {}
+    tightest = None
+    policy = []
+    for limit_key, seconds, _ in WINDOWS:
+        if limit_key not in admission.counts:
+            continue
+        limit = device_limits[limit_key]
+        used = admission.counts[limit_key] + (1 if admission.allowed else 0)
+        remaining = max(0, limit - used)
+        reset = max(1, int(admission.resets.get(limit_key, seconds) + 0.999))
+        name = WINDOW_NAMES[limit_key]
+        headers[f"X-RateLimit-Limit-{name}"] = str(limit)
+        headers[f"X-RateLimit-Remaining-{name}"] = str(remaining)
+        headers[f"X-RateLimit-Reset-{name}"] = str(reset)
+        policy.append(f"{limit};w={seconds}")
+        if tightest is None or remaining < tightest[1]:
+            tightest = (limit, remaining, reset)
+    if tightest:
+        headers['RateLimit-Limit'], headers['RateLimit-Remaining'], headers['RateLimit-Reset'] = \
+            (str(value) for value in tightest)
+        headers['RateLimit-Policy'] = ', '.join(policy)
+
+    lifetime = device_limits.get('requests_per_device')
+    # Only known when the device's usage was read (not for network, global or error refusals)
+    if lifetime is not None and tightest is not None:
+        used = admission.counts['total'] + (1 if admission.allowed else 0)
+        headers['X-Demo-Limit'] = str(lifetime)
+        headers['X-Demo-Remaining'] = str(max(0, lifetime - used))
+
+    if not admission.allowed and admission.limit_key:
+        headers['Retry-After'] = str(max(1, int(admission.resets.get(admission.limit_key, 60) + 0.999)))
+    return headers
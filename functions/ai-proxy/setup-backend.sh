@@ -44,12 +44,39 @@ gcloud projects add-iam-policy-binding $PROJECT_ID \
     --member="serviceAccount:ai-proxy-sa@${PROJECT_ID}.iam.gserviceaccount.com" \
     --role="roles/secretmanager.secretAccessor"
 
+# Regional Vertex AI upstreams (VERTEX_REGIONS)
+gcloud projects add-iam-policy-binding $PROJECT_ID \
+    --member="serviceAccount:ai-proxy-sa@${PROJECT_ID}.iam.gserviceaccount.com" \
+    --role="roles/aiplatform.user"
+
 # Create Firestore database
 echo "🗄️ Creating Firestore database..."
 gcloud firestore databases create \
     --location=$REGION \
     --project=$PROJECT_ID || echo "Firestore database already exists"
 
+# Expire old network and global rate limit windows, and finished analysis jobs
+for COLLECTION in ai_network_usage ai_global_usage ai_analysis_jobs results; do
+    gcloud firestore fields ttls update expires_at \
+        --collection-group=$COLLECTION \
+        --enable-ttl \
+        --async \
+        --project=$PROJECT_ID || echo "TTL policy for $COLLECTION already exists"
+done
+
+# Spool bucket for analysis jobs (batch prediction input and output)
+echo "🪣 Creating analysis job spool bucket..."
+gcloud storage buckets create gs://${PROJECT_ID}-ai-jobs \
+    --location=$REGION \
+    --project=$PROJECT_ID || echo "Bucket already exists"
+echo '{"rule": [{"action": {"type": "Delete"}, "condition": {"age": 7}}]}' > ai-jobs-lifecycle.json
+gcloud storage buckets update gs://${PROJECT_ID}-ai-jobs \
+    --lifecycle-file=ai-jobs-lifecycle.json \
+    --project=$PROJECT_ID
+gcloud storage buckets add-iam-policy-binding gs://${PROJECT_ID}-ai-jobs \
+    --member="serviceAccount:ai-proxy-sa@${PROJECT_ID}.iam.gserviceaccount.com" \
+    --role="roles/storage.objectAdmin"
+
 # Create collections
 echo "📚 Setting up Firestore collections..."
 cat <<EOF > firestore-setup.js
@@ -62,6 +89,8 @@ async function setup() {
   await db.collection('shared_ai_keys').doc('key_001').set({
     api_key: 'ENCRYPTED_KEY_PLACEHOLDER',
     daily_quota: 1000,
+    rpm_limit: 15,
+    tpm_limit: 1000000,
     used_today: 0,
     active: true,
     last_reset: new Date().toISOString().split('T')[0]
@@ -86,6 +115,9 @@ echo "2. Store API keys in Secret Manager:"
 echo "   gcloud secrets create ai-key-key_001 --data-file=- --project=$PROJECT_ID"
 echo "   (Then paste the API key and press Ctrl+D)"
 echo ""
+echo "   Optional, for DEMO_TICKETS_ENABLED=true (signed demo tickets):"
+echo "   openssl rand -base64 48 | gcloud secrets create ai-proxy-ticket-secret --data-file=- --project=$PROJECT_ID"
+echo ""
 echo "3. Update the proxy URLs in your .env file:"
 echo "   AI_PROXY_URL=https://ai-proxy-${REGION}-${PROJECT_ID}.cloudfunctions.net/ai-proxy"
 echo "   AI_PROXY_STATUS_URL=https://ai-proxy-status-${REGION}-${PROJECT_ID}.cloudfunctions.net/ai-proxy-status"
@@ -94,4 +126,9 @@ echo "4. Deploy the functions:"
 echo "   cd functions/ai-proxy"
 echo "   ./deploy.sh $PROJECT_ID $REGION"
 echo ""
+echo "5. Schedule the analysis job worker:"
+echo "   gcloud scheduler jobs create http ai-proxy-job-worker --schedule='*/10 * * * *' \\"
+echo "     --uri=https://${REGION}-${PROJECT_ID}.cloudfunctions.net/ai-proxy-job-worker \\"
+echo "     --oidc-service-account-email=ai-proxy-sa@${PROJECT_ID}.iam.gserviceaccount.com --location=$REGION"
+echo ""
 echo "✨ Setup script complete!"
\ No newline at end of file
@@ -0,0 +1,202 @@
+"""
+Latency-aware upstream routing for the AI proxy
+An upstream is either the global Gemini API (authenticated with a shared API
+key) or one regional Vertex AI endpoint (authenticated with a service account
+token). Each upstream keeps an exponentially weighted moving average of its
+latency and error rate; a request goes to the fastest healthy upstream that
+serves the requested model. Requests also probe, with countTokens, the
+upstream that has gone longest without traffic, so idle regions keep fresh
+estimates and failed ones are noticed when they recover. Probes ride on
+requests rather than a timer because gen2 instances get no CPU between them.
+"""
+
+import json
+import logging
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Callable, Dict, Iterable, List, Optional
+
+import google.auth
+import requests
+from google.auth.transport.requests import Request
+
+logger = logging.getLogger(__name__)
+
+GEMINI = 'gemini'
+VERTEX = 'vertex'
+SCOPES = ['https://www.googleapis.com/auth/cloud-platform']
+# Latency assumed for an upstream before its first sample, in seconds
+PRIOR_LATENCY = 2.0
+
+
+class Upstream:
+    """One backend that can serve generateContent"""
+
+    def __init__(self, name: str, kind: str, base_url: str, region: Optional[str] = None,
+                 project_id: Optional[str] = None, models: Optional[Iterable[str]] = None):
+        self.name = name
+        self.kind = kind
+        self.base_url = base_url.rstrip('/')
+        self.region = region
+        self.project_id = project_id
+        self.models = set(models) if models else None
+        self.latency: Optional[float] = None
+        self.error_rate = 0.0
+        self.samples = 0
+        self.last_sample = 0.0
+        self.last_probe = 0.0
+
+    def serves(self, model: str) -> bool:
+        return self.models is None or model in self.models
+
+    def url(self, model: str, endpoint: str) -> str:
+        if self.kind == VERTEX:
+            return (f"{self.base_url}/projects/{self.project_id}/locations/{self.region}"
+                    f"/publishers/google/models/{model}:{endpoint}")
+        return f"{self.base_url}/models/{model}:{endpoint}"
+
+    def as_dict(self) -> dict:
+        return {
+            'kind': self.kind,
+            'region': self.region,
+            'latency_ms': round(self.latency * 1000, 1) if self.latency is not None else None,
+            'error_rate': round(self.error_rate, 3),
+            'samples': self.samples
+        }
+
+
+def build_upstreams(gemini_api_base: Optional[str], project_id: Optional[str], vertex_regions: List[str],
+                    vertex_api_template: str, region_models: Optional[Dict[str, List[str]]] = None) -> List[Upstream]:
+    """Gemini API (when gemini_api_base is set) plus one Vertex upstream per region"""
+    upstreams = []
+    if gemini_api_base:
+        upstreams.append(Upstream('gemini-global', GEMINI, gemini_api_base))
+    for region in vertex_regions:
+        upstreams.append(Upstream(f"vertex-{region}", VERTEX, vertex_api_template.format(region=region),
+                                  region=region, project_id=project_id,
+                                  models=(region_models or {}).get(region)))
+    return upstreams
+
+
+class UpstreamRouter:
+    """Chooses an upstream per request from latency and error EWMAs"""
+
+    def __init__(self, upstreams: List[Upstream], alpha: float = 0.2, max_error_rate: float = 0.5,
+                 probe_interval: float = 30.0):
+        self.upstreams = upstreams
+        self.alpha = alpha
+        self.max_error_rate = max_error_rate
+        self.probe_interval = probe_interval
+        self._lock = threading.Lock()
+
+    def choose(self, model: str, exclude: Iterable[str] = ()) -> Optional[Upstream]:
+        """Fastest healthy upstream serving model; the least failing one if none is healthy"""
+        with self._lock:
+            candidates = [u for u in self.upstreams if u.serves(model) and u.name not in exclude]
+            if not candidates:
+                return None
+            healthy = [u for u in candidates if u.error_rate < self.max_error_rate]
+            if healthy:
+                return min(healthy, key=lambda u: PRIOR_LATENCY if u.latency is None else u.latency)
+            return min(candidates, key=lambda u: u.error_rate)
+
+    def record(self, upstream: Upstream, seconds: float, ok: bool):
+        """Fold one call into the upstream's EWMAs; failed calls only move the error rate"""
+        with self._lock:
+            if ok:
+                upstream.latency = seconds if upstream.latency is None else \
+                    self.alpha * seconds + (1 - self.alpha) * upstream.latency
+            upstream.error_rate = self.alpha * (0.0 if ok else 1.0) + (1 - self.alpha) * upstream.error_rate
+            upstream.samples += 1
+            upstream.last_sample = time.monotonic()
+
+    def probe_idle(self, probe: Callable[[Upstream], Optional[bool]]):
+        """Probe the upstream idle longest, if idle past probe_interval
+
+        Called on the request path; the probe runs on its own thread while the
+        request's upstream call is in flight. probe returns ok, or None to skip.
+        """
+        if len(self.upstreams) < 2:
+            return
+        now = time.monotonic()
+        with self._lock:
+            idle = [u for u in self.upstreams if now - max(u.last_sample, u.last_probe) >= self.probe_interval]
+            if not idle:
+                return
+            upstream = min(idle, key=lambda u: max(u.last_sample, u.last_probe))
+            upstream.last_probe = now
+        threading.Thread(target=self._probe, args=(upstream, probe), daemon=True).start()
+
+    def _probe(self, upstream: Upstream, probe: Callable[[Upstream], Optional[bool]]):
+        started = time.perf_counter()
+        try:
+            ok = probe(upstream)
+        except Exception as e:
+            logger.warning(f"Probe of {upstream.name} failed: {e}")
+            ok = False
+        if ok is not None:
+            self.record(upstream, time.perf_counter() - started, ok)
+
+    def snapshot(self) -> Dict[str, dict]:
+        with self._lock:
+            return {u.name: u.as_dict() for u in self.upstreams}
+
+
+class ServiceAccountToken:
+    """Vertex access token: the function's own, or a target service account's
+
+    With a target account the function's credential impersonates it through
+    IAM generateAccessToken, the same exchange the token vending machine
+    makes. Tokens are cached until five minutes before they expire.
+    """
+
+    def __init__(self, target_service_account: Optional[str] = None,
+                 iam_endpoint: str = 'https://iamcredentials.googleapis.com'):
+        self.target_service_account = target_service_account
+        self.iam_endpoint = iam_endpoint.rstrip('/')
+        self._credentials = None
+        self._token = None
+        self._expires_at = 0.0
+        self._lock = threading.Lock()
+
+    def token(self, timeout: float = 10) -> str:
+        with self._lock:
+            if self._token and time.time() < self._expires_at - 300:
+                return self._token
+            if self._credentials is None:
+                self._credentials, _ = google.auth.default(scopes=SCOPES)
+            if not self._credentials.valid:
+                self._credentials.refresh(Request())
+
+            if not self.target_service_account:
+                self._token = self._credentials.token
+                expiry = self._credentials.expiry
+                self._expires_at = expiry.replace(tzinfo=timezone.utc).timestamp() if expiry else time.time() + 3600
+                return self._token
+
+            response = requests.post(
+                f"{self.iam_endpoint}/v1/projects/-/serviceAccounts/"
+                f"{self.target_service_account}:generateAccessToken",
+                headers={"Authorization": f"Bearer {self._credentials.token}",
+                         "Content-Type": "application/json"},
+                json={"scope": SCOPES}, timeout=timeout)
+            response.raise_for_status()
+            data = response.json()
+            self._token = data['accessToken']
+            expire_time = data.get('expireTime')
+            self._expires_at = datetime.fromisoformat(expire_time.replace('Z', '+00:00')).timestamp() \
+                if expire_time else time.time() + 3600
+            return self._token
+
+
+def parse_region_models(value: Optional[str]) -> Dict[str, List[str]]:
+    """VERTEX_REGION_MODELS: JSON object of region -> models it serves"""
+    if not value:
+        return {}
+    try:
+        parsed = json.loads(value)
+    except ValueError:
+        logger.error("VERTEX_REGION_MODELS is not valid JSON; serving every model everywhere")
+        return {}
+    return {region: list(models) for region, models in parsed.items()}
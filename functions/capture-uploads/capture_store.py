@@ -0,0 +1,215 @@
+"""
+Content-addressed capture store
+Captures are named by the SHA-256 of their bytes, so byte-identical frames from
+static scenes map to one object. A Firestore index (capture_index/{sha256})
+records each object and how many captures reference it; a small in-memory cache
+of that index keeps repeat lookups off Firestore.
+
+Upload URLs for pending entries only create the object (if-generation-match 0),
+and an upload is promoted to stored only after its bytes hash to the entry's
+SHA-256, so a caller cannot put other content under someone else's hash.
+"""
+
+import hashlib
+import re
+import threading
+import time
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+from google.api_core.exceptions import AlreadyExists, FailedPrecondition, NotFound
+from google.cloud import firestore
+
+CAPTURE_INDEX_COLLECTION = 'capture_index'
+CONTENT_PREFIX = 'captures/sha256'
+
+STATE_PENDING = 'pending'
+STATE_STORED = 'stored'
+
+# How long a known hash is trusted from the local cache
+INDEX_CACHE_TTL = 300
+INDEX_CACHE_MAX_ENTRIES = 10000
+
+# A pending upload older than this is checked against the bucket
+PENDING_CHECK_AFTER = 60
+
+# Uploads larger than this are not hashed and never promoted
+MAX_VERIFY_BYTES = 20 * 1024 * 1024
+
+SHA256_HEX = re.compile(r'^[0-9a-f]{64}$')
+
+logger = logging.getLogger(__name__)
+
+
+def content_object_name(sha256: str, content_type: str) -> str:
+    """Object path for content with the given hash"""
+    extension = 'png' if content_type == 'image/png' else 'jpg'
+    return f"{CONTENT_PREFIX}/{sha256[:2]}/{sha256}.{extension}"
+
+
+class CaptureStore:
+    """Deduplicating index over content-addressed capture objects"""
+
+    def __init__(self, db, bucket):
+        self.db = db
+        self.bucket = bucket
+        self._cache = {}
+        self._lock = threading.Lock()
+
+    def _cached(self, sha256: str) -> Optional[dict]:
+        with self._lock:
+            hit = self._cache.get(sha256)
+            if hit and hit[1] > time.time():
+                return hit[0]
+            self._cache.pop(sha256, None)
+        return None
+
+    def _remember(self, sha256: str, entry: dict):
+        with self._lock:
+            if len(self._cache) >= INDEX_CACHE_MAX_ENTRIES:
+                # Drop the oldest insertion; dicts keep insertion order
+                self._cache.pop(next(iter(self._cache)))
+            self._cache[sha256] = (entry, time.time() + INDEX_CACHE_TTL)
+
+    def _forget(self, sha256: str):
+        with self._lock:
+            self._cache.pop(sha256, None)
+
+    def acquire(self, sha256: str, content_type: str, device_id: str,
+                size: int = 0) -> dict:
+        """Reference content by hash.
+
+        Returns the index entry plus 'exists': True when the object is already
+        stored and the caller can skip the upload, or False when the caller
+        must upload to entry['object'].
+        """
+        index_ref = self.db.collection(CAPTURE_INDEX_COLLECTION).document(sha256)
+        now = datetime.now(timezone.utc)
+
+        entry = self._cached(sha256)
+        if entry is not None:
+            # Known stored object: one blind increment, no read
+            try:
+                index_ref.update({
+                    'ref_count': firestore.Increment(1),
+                    'last_referenced': now
+                })
+                return dict(entry, exists=True)
+            except NotFound:
+                # Cleaned up since it was cached
+                self._forget(sha256)
+
+        snapshot = index_ref.get()
+        if snapshot.exists:
+            entry = snapshot.to_dict()
+            if entry.get('state') == STATE_PENDING and self._upload_landed(entry, now):
+                entry['state'] = STATE_STORED
+            updates = {
+                'ref_count': firestore.Increment(1),
+                'last_referenced': now,
+                'state': entry.get('state', STATE_PENDING)
+            }
+            index_ref.update(updates)
+            if entry.get('state') == STATE_STORED:
+                self._remember(sha256, entry)
+                return dict(entry, exists=True)
+            return dict(entry, exists=False)
+
+        entry = {
+            'sha256': sha256,
+            'object': content_object_name(sha256, content_type),
+            'gcs_uri': f"gs://{self.bucket.name}/{content_object_name(sha256, content_type)}",
+            'content_type': content_type,
+            'size': size,
+            'state': STATE_PENDING,
+            'ref_count': 1,
+            'first_device': device_id,
+            'created_at': now,
+            'last_referenced': now
+        }
+        try:
+            index_ref.create(entry)
+        except AlreadyExists:
+            # Another camera registered the same bytes first
+            index_ref.update({
+                'ref_count': firestore.Increment(1),
+                'last_referenced': now
+            })
+        return dict(entry, exists=False)
+
+    def _upload_landed(self, entry: dict, now: datetime) -> bool:
+        """Promote a pending entry once its object is in the bucket with matching bytes"""
+        created_at = entry.get('created_at')
+        if created_at and now - created_at < timedelta(seconds=PENDING_CHECK_AFTER):
+            return False
+        try:
+            blob = self.bucket.get_blob(entry['object'])
+            if blob is None:
+                return False
+            if (blob.size or 0) <= MAX_VERIFY_BYTES:
+                data = blob.download_as_bytes(if_generation_match=blob.generation)
+                if hashlib.sha256(data).hexdigest() == entry['sha256']:
+                    return True
+            # Wrong content: remove it so the next caller can upload the real bytes
+            logger.warning(f"Capture object {entry['object']} does not match its hash, deleting")
+            blob.delete(if_generation_match=blob.generation)
+            return False
+        except Exception as e:
+            logger.warning(f"Could not check capture object {entry.get('object')}: {e}")
+            return False
+
+    def release(self, sha256: str):
+        """Drop one reference; cleanup removes objects that reach zero"""
+        self._forget(sha256)
+        self.db.collection(CAPTURE_INDEX_COLLECTION).document(sha256).update({
+            'ref_count': firestore.Increment(-1)
+        })
+
+    def cleanup(self, grace_seconds: int = 86400, page_size: int = 500) -> int:
+        """Delete objects and index entries with no remaining references
+
+        Only entries unreferenced for the whole grace period are queried
+        (composite index in firestore-indexes.json), a page at a time until
+        none are left. Each index entry is deleted on the precondition that it
+        is unchanged since the query, so an acquire() racing the cleanup keeps
+        its entry. The object goes only after that delete commits, and only
+        the generation seen before it, never a fresh upload for a re-registered
+        hash.
+        """
+        cutoff = datetime.now(timezone.utc) - timedelta(seconds=grace_seconds)
+        query = (self.db.collection(CAPTURE_INDEX_COLLECTION)
+                 .where('ref_count', '<=', 0)
+                 .where('last_referenced', '<', cutoff)
+                 .order_by('ref_count')
+                 .order_by('last_referenced')
+                 .limit(page_size))
+
+        deleted = 0
+        last = None
+        while True:
+            page = list((query.start_after(last) if last is not None else query).stream())
+            for snapshot in page:
+                deleted += self._delete_unreferenced(snapshot)
+            if len(page) < page_size:
+                return deleted
+            last = page[-1]
+
+    def _delete_unreferenced(self, snapshot) -> int:
+        """Delete one unreferenced entry and then its object; 0 if it was referenced again"""
+        entry = snapshot.to_dict()
+        blob = self.bucket.get_blob(entry['object'])
+        try:
+            snapshot.reference.delete(
+                option=self.db.write_option(last_update_time=snapshot.update_time))
+        except (FailedPrecondition, NotFound):
+            # Referenced again (or removed) since the query
+            return 0
+        self._forget(snapshot.id)
+        if blob is not None:
+            try:
+                blob.delete(if_generation_match=blob.generation)
+            except Exception as e:
+                # Already gone or replaced - the index entry is gone either way
+                logger.info(f"Capture object {entry.get('object')} not deleted: {e}")
+        return 1
@@ -0,0 +1,61 @@
+#!/bin/bash
+# Deploy Capture Upload URL Cloud Function
+
+PROJECT_ID=${1:-"anava-magical-backend"}
+REGION=${2:-"us-central1"}
+SERVICE_ACCOUNT="capture-uploads-sa@${PROJECT_ID}.iam.gserviceaccount.com"
+
+echo "Deploying Capture Upload URL vendor to project: $PROJECT_ID"
+
+# The service account needs roles/storage.objectAdmin on the analytics bucket,
+# roles/datastore.user for the capture index, and
+# roles/iam.serviceAccountTokenCreator on ITSELF to sign URLs.
+# Cameras call it directly, so it is public at the IAM layer; every request must
+# carry the device's Firebase ID token, whose uid has to match device_id.
+gcloud functions deploy capture-upload-urls \
+  --gen2 \
+  --runtime=python311 \
+  --region=$REGION \
+  --source=. \
+  --entry-point=vend_upload_urls \
+  --trigger-http \
+  --allow-unauthenticated \
+  --service-account=$SERVICE_ACCOUNT \
+  --set-env-vars="GCP_PROJECT=$PROJECT_ID,FIREBASE_PROJECT_ID=$PROJECT_ID,SIGNER_SERVICE_ACCOUNT_EMAIL=$SERVICE_ACCOUNT,UPLOAD_URL_TTL_SECONDS=300" \
+  --memory=256MB \
+  --timeout=30s \
+  --max-instances=50 \
+  --project=$PROJECT_ID
+
+# Deploy reference release endpoint
+gcloud functions deploy capture-release \
+  --gen2 \
+  --runtime=python311 \
+  --region=$REGION \
+  --source=. \
+  --entry-point=release_captures \
+  --trigger-http \
+  --no-allow-unauthenticated \
+  --service-account=$SERVICE_ACCOUNT \
+  --set-env-vars="GCP_PROJECT=$PROJECT_ID" \
+  --memory=256MB \
+  --timeout=60s \
+  --project=$PROJECT_ID
+
+# Deploy unreferenced capture cleanup (invoke daily from Cloud Scheduler)
+gcloud functions deploy capture-cleanup \
+  --gen2 \
+  --runtime=python311 \
+  --region=$REGION \
+  --source=. \
+  --entry-point=cleanup_captures \
+  --trigger-http \
+  --no-allow-unauthenticated \
+  --service-account=$SERVICE_ACCOUNT \
+  --set-env-vars="GCP_PROJECT=$PROJECT_ID,CAPTURE_CLEANUP_GRACE_SECONDS=86400" \
+  --memory=256MB \
+  --timeout=300s \
+  --max-instances=1 \
+  --project=$PROJECT_ID
+
+echo "Capture Upload URL vendor deployment complete!"
@@ -0,0 +1,300 @@
+"""
+Capture Upload URL Cloud Function for Anava Vision cameras
+Vends short-lived V4 signed URLs so cameras PUT JPEG frames straight to
+gs://{project}-anava-analytics/captures/... instead of sending base64 through
+ai_proxy. Analyses then reference the object with a fileData part. Callers
+authenticate with the device's Firebase ID token and can only vend URLs under
+their own device ID.
+
+When cameras send the SHA-256 of each frame, captures are stored by content
+hash and byte-identical frames skip the upload entirely (see capture_store).
+"""
+
+import functions_framework
+import json
+import os
+import re
+import threading
+import uuid
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+import google.auth
+from google.auth import iam
+from google.auth.transport import requests as google_requests
+from google.cloud import firestore, storage
+from google.oauth2 import id_token, service_account
+
+from capture_store import CaptureStore, SHA256_HEX
+
+# Initialize clients
+storage_client = storage.Client()
+db = firestore.Client()
+
+# Configuration
+PROJECT_ID = os.environ.get('GCP_PROJECT')
+CAPTURE_BUCKET = os.environ.get('CAPTURE_BUCKET', f"{PROJECT_ID}-anava-analytics")
+CAPTURE_PREFIX = 'captures'
+SIGNER_SERVICE_ACCOUNT = os.environ.get('SIGNER_SERVICE_ACCOUNT_EMAIL')
+URL_TTL_SECONDS = int(os.environ.get('UPLOAD_URL_TTL_SECONDS', '300'))
+MAX_URLS_PER_REQUEST = 50
+ALLOWED_CONTENT_TYPES = {'image/jpeg', 'image/png'}
+FIREBASE_PROJECT_ID = os.environ.get('FIREBASE_PROJECT_ID', PROJECT_ID)
+TOKEN_URI = 'https://oauth2.googleapis.com/token'
+
+CLEANUP_GRACE_SECONDS = int(os.environ.get('CAPTURE_CLEANUP_GRACE_SECONDS', '86400'))
+
+SAFE_ID = re.compile(r'^[A-Za-z0-9_.-]{1,128}$')
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Signing credentials are built once per instance and reused for every URL
+_signing_credentials = None
+_signing_lock = threading.Lock()
+_signing_pool = ThreadPoolExecutor(max_workers=8)
+_auth_request = google_requests.Request()
+
+capture_store = CaptureStore(db, storage_client.bucket(CAPTURE_BUCKET))
+
+
+def get_signing_credentials():
+    """Return cached credentials able to sign V4 URLs.
+
+    Uses the local private key when one is available, otherwise signs through
+    the IAM signBlob API with the function's own service account. The IAM
+    signer refreshes its access token on demand, so it is safe to cache.
+    """
+    global _signing_credentials
+    if _signing_credentials is not None:
+        return _signing_credentials
+
+    with _signing_lock:
+        if _signing_credentials is None:
+            credentials, _ = google.auth.default(
+                scopes=['https://www.googleapis.com/auth/cloud-platform'])
+            if isinstance(credentials, service_account.Credentials):
+                _signing_credentials = credentials
+            else:
+                request = google_requests.Request()
+                credentials.refresh(request)
+                sa_email = SIGNER_SERVICE_ACCOUNT or credentials.service_account_email
+                signer = iam.Signer(request, credentials, sa_email)
+                _signing_credentials = service_account.Credentials(
+                    signer, sa_email, TOKEN_URI)
+            logger.info(f"Initialized URL signer for {_signing_credentials.service_account_email}")
+    return _signing_credentials
+
+
+def authenticated_device(request):
+    """Device ID (Firebase uid) from the caller's Firebase ID token, or None
+
+    Cameras exchange the custom token from device-auth for an ID token and
+    send it as a bearer token. Behind API Gateway the original header arrives
+    as X-Forwarded-Authorization.
+    """
+    authorization = (request.headers.get('X-Forwarded-Authorization')
+                     or request.headers.get('Authorization', ''))
+    scheme, _, token = authorization.partition(' ')
+    if scheme.lower() != 'bearer' or not token:
+        return None
+    try:
+        claims = id_token.verify_firebase_token(token, _auth_request, audience=FIREBASE_PROJECT_ID)
+    except Exception as e:
+        logger.warning(f"Rejected Firebase ID token: {e}")
+        return None
+    return claims.get('sub') if claims else None
+
+
+def capture_object_name(device_id: str, capture_id: str, content_type: str) -> str:
+    """Build the object path for a capture"""
+    extension = 'png' if content_type == 'image/png' else 'jpg'
+    day = datetime.now(timezone.utc).strftime('%Y/%m/%d')
+    return f"{CAPTURE_PREFIX}/{device_id}/{day}/{capture_id}.{extension}"
+
+
+def valid_size(size) -> bool:
+    """Byte size as sent by a camera: a non-negative integer"""
+    return isinstance(size, int) and not isinstance(size, bool) and size >= 0
+
+
+def existing_capture(entry: dict) -> dict:
+    """Describe an already stored capture - no upload needed"""
+    return {
+        'upload_url': None,
+        'exists': True,
+        'sha256': entry['sha256'],
+        'object': entry['object'],
+        'gcs_uri': entry['gcs_uri'],
+        'file_data': {'mimeType': entry['content_type'], 'fileUri': entry['gcs_uri']}
+    }
+
+
+def vend_content_addressed(device_id: str, captures: list, content_type: str) -> list:
+    """Reference each hash in the capture store, signing URLs only for new content"""
+    def vend(capture):
+        entry = capture_store.acquire(capture['sha256'], content_type, device_id,
+                                      capture.get('size', 0))
+        if entry['exists']:
+            return existing_capture(entry)
+        # Create-only, so an upload cannot replace bytes already verified
+        upload = sign_upload_url(entry['object'], content_type,
+                                 {'x-goog-if-generation-match': '0'})
+        upload.update({'exists': False, 'sha256': entry['sha256']})
+        return upload
+
+    return list(_signing_pool.map(vend, captures))
+
+
+def sign_upload_url(object_name: str, content_type: str, extra_headers: dict = None) -> dict:
+    """Create one signed PUT URL for an object; extra_headers must be sent with the PUT"""
+    blob = storage_client.bucket(CAPTURE_BUCKET).blob(object_name)
+    expires_at = datetime.now(timezone.utc) + timedelta(seconds=URL_TTL_SECONDS)
+    url = blob.generate_signed_url(
+        version='v4',
+        expiration=timedelta(seconds=URL_TTL_SECONDS),
+        method='PUT',
+        content_type=content_type,
+        headers=extra_headers,
+        credentials=get_signing_credentials()
+    )
+    gcs_uri = f"gs://{CAPTURE_BUCKET}/{object_name}"
+    return {
+        'upload_url': url,
+        'method': 'PUT',
+        'headers': dict(extra_headers or {}, **{'Content-Type': content_type}),
+        'object': object_name,
+        'gcs_uri': gcs_uri,
+        'file_data': {'mimeType': content_type, 'fileUri': gcs_uri},
+        'expires_at': expires_at.isoformat()
+    }
+
+
+@functions_framework.http
+def vend_upload_urls(request):
+    """Vend one or more signed upload URLs for a device"""
+    if request.method == 'OPTIONS':
+        headers = {
+            'Access-Control-Allow-Origin': '*',
+            'Access-Control-Allow-Methods': 'POST',
+            'Access-Control-Allow-Headers': 'Content-Type, Authorization',
+            'Access-Control-Max-Age': '3600'
+        }
+        return ('', 204, headers)
+
+    headers = {
+        'Access-Control-Allow-Origin': '*',
+        'Content-Type': 'application/json'
+    }
+
+    if request.method != 'POST':
+        return json.dumps({'error': 'Method not allowed'}), 405, headers
+
+    authenticated_id = authenticated_device(request)
+    if authenticated_id is None:
+        return json.dumps({'error': 'Missing or invalid Firebase ID token'}), 401, headers
+
+    request_data = request.get_json(silent=True)
+    if not request_data or not isinstance(request_data, dict):
+        return json.dumps({'error': 'Invalid request body'}), 400, headers
+
+    device_id = str(request_data.get('device_id', authenticated_id))
+    if not SAFE_ID.match(device_id):
+        return json.dumps({'error': "'device_id' missing or invalid"}), 400, headers
+    if device_id != authenticated_id:
+        return json.dumps({'error': 'Token does not belong to this device'}), 403, headers
+
+    content_type = request_data.get('content_type', 'image/jpeg')
+    if content_type not in ALLOWED_CONTENT_TYPES:
+        return json.dumps({'error': f"Unsupported content type: {content_type}"}), 400, headers
+
+    # Content-addressed mode: captures are described by their SHA-256
+    captures = request_data.get('captures')
+    if captures is not None:
+        if not isinstance(captures, list) or len(captures) > MAX_URLS_PER_REQUEST:
+            return json.dumps({'error': f"'captures' must be a list of at most {MAX_URLS_PER_REQUEST}"}), 400, headers
+        if not all(isinstance(c, dict) and SHA256_HEX.match(str(c.get('sha256', '')))
+                   for c in captures):
+            return json.dumps({'error': 'Each capture needs a lowercase hex sha256'}), 400, headers
+        if not all(valid_size(c.get('size', 0)) for c in captures):
+            return json.dumps({'error': "'size' must be a non-negative integer"}), 400, headers
+        try:
+            uploads = vend_content_addressed(device_id, captures, content_type)
+            return json.dumps({
+                'bucket': CAPTURE_BUCKET,
+                'expires_in': URL_TTL_SECONDS,
+                'uploads': uploads,
+                'skipped': sum(1 for upload in uploads if upload['exists'])
+            }), 200, headers
+        except Exception as e:
+            logger.error(f"Failed to vend content-addressed uploads for {device_id}: {e}")
+            return json.dumps({'error': 'Failed to create upload URLs'}), 500, headers
+
+    # Callers may name their captures (e.g. after event IDs) or just ask for a count
+    capture_ids = request_data.get('capture_ids')
+    if capture_ids is None:
+        try:
+            count = int(request_data.get('count', 1))
+        except (TypeError, ValueError):
+            return json.dumps({'error': "'count' must be an integer"}), 400, headers
+        capture_ids = [uuid.uuid4().hex for _ in range(max(1, min(count, MAX_URLS_PER_REQUEST + 1)))]
+    elif not isinstance(capture_ids, list):
+        return json.dumps({'error': "'capture_ids' must be a list"}), 400, headers
+    capture_ids = [str(capture_id) for capture_id in capture_ids]
+
+    if len(capture_ids) > MAX_URLS_PER_REQUEST:
+        return json.dumps({'error': f"At most {MAX_URLS_PER_REQUEST} URLs per request"}), 400, headers
+    if not all(SAFE_ID.match(capture_id) for capture_id in capture_ids):
+        return json.dumps({'error': 'Invalid capture id'}), 400, headers
+
+    try:
+        object_names = [capture_object_name(device_id, capture_id, content_type)
+                        for capture_id in capture_ids]
+        uploads = list(_signing_pool.map(
+            lambda name: sign_upload_url(name, content_type), object_names))
+
+        return json.dumps({
+            'bucket': CAPTURE_BUCKET,
+            'expires_in': URL_TTL_SECONDS,
+            'uploads': uploads
+        }), 200, headers
+
+    except Exception as e:
+        logger.error(f"Failed to vend upload URLs for {device_id}: {e}")
+        return json.dumps({'error': 'Failed to create upload URLs'}), 500, headers
+
+
+@functions_framework.http
+def release_captures(request):
+    """Drop references to content-addressed captures (e.g. when events are deleted)"""
+    headers = {'Content-Type': 'application/json'}
+
+    if request.method != 'POST':
+        return json.dumps({'error': 'Method not allowed'}), 405, headers
+
+    request_data = request.get_json(silent=True) or {}
+    hashes = [h for h in request_data.get('sha256', []) if SHA256_HEX.match(str(h))]
+
+    released = 0
+    for sha256 in hashes:
+        try:
+            capture_store.release(sha256)
+            released += 1
+        except Exception as e:
+            logger.warning(f"Failed to release capture {sha256}: {e}")
+
+    return json.dumps({'released': released}), 200, headers
+
+
+@functions_framework.http
+def cleanup_captures(request):
+    """Scheduled cleanup of captures no longer referenced by any event"""
+    headers = {'Content-Type': 'application/json'}
+    try:
+        deleted = capture_store.cleanup(grace_seconds=CLEANUP_GRACE_SECONDS)
+        logger.info(f"Deleted {deleted} unreferenced captures")
+        return json.dumps({'deleted': deleted}), 200, headers
+    except Exception as e:
+        logger.error(f"Capture cleanup failed: {e}")
+        return json.dumps({'error': 'Cleanup failed'}), 500, headers
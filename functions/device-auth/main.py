@@ -1,10 +1,17 @@
+import os
 import functions_framework
 import firebase_admin
 from firebase_admin import auth
 
 # Initialize Firebase Admin SDK
+# With FIREBASE_AUTH_EMULATOR_HOST set, firebase_admin mints unsigned custom
+# tokens and needs no service account, so the function runs against the auth
+# emulator or local stand-ins
 if not firebase_admin._apps:
-    firebase_admin.initialize_app()
+    if os.environ.get("FIREBASE_AUTH_EMULATOR_HOST"):
+        firebase_admin.initialize_app(options={"projectId": os.environ.get("GOOGLE_CLOUD_PROJECT", "demo-anava")})
+    else:
+        firebase_admin.initialize_app()
 
 @functions_framework.http
 def device_authenticator(request):
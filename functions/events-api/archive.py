@@ -0,0 +1,272 @@
+"""
+Event archive for Anava Vision
+Rolls events older than N days into one gzip'd, column-oriented JSON blob per
+device per day in GCS, records the archived range in a small manifest document
+(devices/{id}/event_archives/{YYYY-MM-DD}) and deletes the Firestore documents
+in batches. EventArchive reads the blobs back for the events query API.
+"""
+
+import gzip
+import json
+import threading
+import logging
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Iterator, List, Optional
+
+from google.cloud.firestore_v1.base_query import FieldFilter
+
+DEVICES_COLLECTION = 'devices'
+EVENTS_COLLECTION = 'events'
+ARCHIVES_COLLECTION = 'event_archives'
+ARCHIVE_PREFIX = 'archive/events'
+TIMESTAMP_FIELD = 'timestamp'
+
+# Firestore allows at most 500 writes per batch
+DELETE_BATCH_SIZE = 500
+BLOB_CACHE_SIZE = 64
+
+logger = logging.getLogger(__name__)
+
+
+def day_bounds(day: str):
+    start = datetime.strptime(day, '%Y-%m-%d').replace(tzinfo=timezone.utc)
+    return start, start + timedelta(days=1)
+
+
+def archive_object_name(device_id: str, day: str) -> str:
+    return f"{ARCHIVE_PREFIX}/{device_id}/{day}.json.gz"
+
+
+def _encode_value(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, (str, int, float, bool)) or value is None:
+        return value
+    if isinstance(value, (list, dict)):
+        return json.loads(json.dumps(value, default=str))
+    return str(value)
+
+
+def encode_blob(device_id: str, day: str, events: List[dict]) -> bytes:
+    """Pack events column by column: one list per field, aligned by row"""
+    columns = OrderedDict()
+    datetime_columns = set()
+    for row, event in enumerate(events):
+        for field, value in event['data'].items():
+            column = columns.setdefault(field, [None] * len(events))
+            column[row] = _encode_value(value)
+            if isinstance(value, datetime):
+                datetime_columns.add(field)
+
+    blob = {
+        'version': 1,
+        'device_id': device_id,
+        'day': day,
+        'count': len(events),
+        'paths': [event['path'] for event in events],
+        'datetime_columns': sorted(datetime_columns),
+        'columns': columns
+    }
+    return gzip.compress(json.dumps(blob, separators=(',', ':')).encode())
+
+
+def decode_blob(raw: bytes) -> List[dict]:
+    """Unpack a blob into [{'path', 'id', 'data'}] ordered by timestamp"""
+    blob = json.loads(gzip.decompress(raw))
+    columns = blob['columns']
+    datetime_columns = set(blob.get('datetime_columns', []))
+    events = []
+    for row, path in enumerate(blob['paths']):
+        data = {}
+        for field, column in columns.items():
+            value = column[row]
+            if value is None:
+                continue
+            data[field] = datetime.fromisoformat(value) if field in datetime_columns else value
+        events.append({'path': path, 'id': path.rsplit('/', 1)[-1], 'data': data})
+    return events
+
+
+def _sort_key(event: dict):
+    return event['data'].get(TIMESTAMP_FIELD), event['path']
+
+
+def compact_device_day(db, bucket, device_id: str, day: str) -> int:
+    """Archive one device-day of events. Returns the number of documents deleted.
+
+    Idempotent: rerunning a day merges any stragglers into the existing blob.
+    """
+    start, end = day_bounds(day)
+    query = (db.collection_group(EVENTS_COLLECTION)
+             .where(filter=FieldFilter('deviceId', '==', device_id))
+             .where(filter=FieldFilter(TIMESTAMP_FIELD, '>=', start))
+             .where(filter=FieldFilter(TIMESTAMP_FIELD, '<', end)))
+    snapshots = list(query.stream())
+    if not snapshots:
+        return 0
+
+    blob = bucket.blob(archive_object_name(device_id, day))
+    manifest_ref = (db.collection(DEVICES_COLLECTION).document(device_id)
+                    .collection(ARCHIVES_COLLECTION).document(day))
+
+    archived = {}
+    if manifest_ref.get().exists:
+        for event in decode_blob(blob.download_as_bytes()):
+            archived[event['path']] = event
+    for snapshot in snapshots:
+        archived[snapshot.reference.path] = {
+            'path': snapshot.reference.path,
+            'id': snapshot.id,
+            'data': snapshot.to_dict()
+        }
+
+    events = sorted(archived.values(), key=_sort_key)
+    blob.upload_from_string(encode_blob(device_id, day, events), content_type='application/gzip')
+
+    # The manifest makes the archive authoritative for the day before any delete
+    manifest_ref.set({
+        'day': day,
+        'start': start,
+        'end': end,
+        'count': len(events),
+        'object': f"gs://{bucket.name}/{blob.name}",
+        'sessions': sorted({event['path'].split('/')[3] for event in events}),
+        'updated_at': datetime.now(timezone.utc)
+    })
+
+    deleted = 0
+    for offset in range(0, len(snapshots), DELETE_BATCH_SIZE):
+        batch = db.batch()
+        for snapshot in snapshots[offset:offset + DELETE_BATCH_SIZE]:
+            batch.delete(snapshot.reference)
+        batch.commit()
+        deleted += len(snapshots[offset:offset + DELETE_BATCH_SIZE])
+    return deleted
+
+
+def _next_timestamp(db, device_id: str, after: datetime, cutoff: datetime) -> Optional[datetime]:
+    """Timestamp of the device's first event in [after, cutoff), or None"""
+    if after >= cutoff:
+        return None
+    nxt = list(db.collection_group(EVENTS_COLLECTION)
+               .where(filter=FieldFilter('deviceId', '==', device_id))
+               .where(filter=FieldFilter(TIMESTAMP_FIELD, '>=', after))
+               .where(filter=FieldFilter(TIMESTAMP_FIELD, '<', cutoff))
+               .order_by(TIMESTAMP_FIELD)
+               .limit(1)
+               .select([TIMESTAMP_FIELD])
+               .stream())
+    return nxt[0].get(TIMESTAMP_FIELD) if nxt else None
+
+
+def compact_events(db, bucket, older_than_days: int, max_device_days: int = 200) -> dict:
+    """Archive every device's events older than the cutoff, bounded per run"""
+    cutoff = (datetime.now(timezone.utc) - timedelta(days=older_than_days)).replace(
+        hour=0, minute=0, second=0, microsecond=0)
+    stats = {'device_days': 0, 'events_archived': 0, 'devices': 0}
+
+    for device in db.collection(DEVICES_COLLECTION).select([]).stream():
+        if stats['device_days'] >= max_device_days:
+            break
+        oldest = list(db.collection_group(EVENTS_COLLECTION)
+                      .where(filter=FieldFilter('deviceId', '==', device.id))
+                      .where(filter=FieldFilter(TIMESTAMP_FIELD, '<', cutoff))
+                      .order_by(TIMESTAMP_FIELD)
+                      .limit(1)
+                      .select([TIMESTAMP_FIELD])
+                      .stream())
+        if not oldest:
+            continue
+
+        stats['devices'] += 1
+        timestamp = oldest[0].get(TIMESTAMP_FIELD)
+        while timestamp is not None and stats['device_days'] < max_device_days:
+            day_start = timestamp.astimezone(timezone.utc).replace(
+                hour=0, minute=0, second=0, microsecond=0)
+            day = day_start.strftime('%Y-%m-%d')
+            try:
+                stats['events_archived'] += compact_device_day(db, bucket, device.id, day)
+            except Exception as e:
+                logger.error(f"Failed to archive {device.id} {day}: {e}")
+            stats['device_days'] += 1
+            # Jump straight to the next day that has events instead of walking empty ones
+            timestamp = _next_timestamp(db, device.id, day_start + timedelta(days=1), cutoff)
+    return stats
+
+
+class EventArchive:
+    """Reads archived events back for queries that cover archived days"""
+
+    def __init__(self, db, bucket):
+        self.db = db
+        self.bucket = bucket
+        self._blobs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def manifests(self, device_id: str, start: Optional[datetime],
+                  end: Optional[datetime]) -> List[dict]:
+        query = (self.db.collection(DEVICES_COLLECTION).document(device_id)
+                 .collection(ARCHIVES_COLLECTION))
+        if start:
+            query = query.where(filter=FieldFilter('end', '>', start))
+        manifests = [snapshot.to_dict() for snapshot in query.stream()]
+        if end:
+            manifests = [m for m in manifests if m['start'] < end]
+        return sorted(manifests, key=lambda m: m['day'])
+
+    def _day_events(self, device_id: str, day: str) -> List[dict]:
+        key = (device_id, day)
+        with self._lock:
+            if key in self._blobs:
+                self._blobs.move_to_end(key)
+                return self._blobs[key]
+        events = decode_blob(self.bucket.blob(archive_object_name(device_id, day)).download_as_bytes())
+        with self._lock:
+            self._blobs[key] = events
+            if len(self._blobs) > BLOB_CACHE_SIZE:
+                self._blobs.popitem(last=False)
+        return events
+
+    def covered_days(self, manifests: List[dict]) -> set:
+        """Archived days; live documents on these days are superseded"""
+        return {m['day'] for m in manifests}
+
+    def spans(self, manifests: List[dict]) -> List[tuple]:
+        """Archived time ranges with consecutive days merged, oldest first"""
+        spans = []
+        for manifest in manifests:
+            if spans and spans[-1][1] == manifest['start']:
+                spans[-1] = (spans[-1][0], manifest['end'])
+            else:
+                spans.append((manifest['start'], manifest['end']))
+        return spans
+
+    def events(self, device_id: str, manifests: List[dict], session_id: Optional[str],
+               start: Optional[datetime], end: Optional[datetime],
+               descending: bool = False) -> Iterator[dict]:
+        """Archived events in query order as {'path', 'id', 'data'}"""
+        for manifest in (reversed(manifests) if descending else manifests):
+            events = self._day_events(device_id, manifest['day'])
+            for event in (reversed(events) if descending else events):
+                timestamp = event['data'].get(TIMESTAMP_FIELD)
+                if start and timestamp < start:
+                    continue
+                if end and timestamp >= end:
+                    continue
+                if session_id and event['path'].split('/')[3] != session_id:
+                    continue
+                yield event
+
+    def count(self, device_id: str, manifests: List[dict], session_id: Optional[str],
+              start: Optional[datetime], end: Optional[datetime]) -> int:
+        """Archived events in range; whole days are counted from their manifest"""
+        total = 0
+        for manifest in manifests:
+            whole_day = ((not start or start <= manifest['start'])
+                         and (not end or manifest['end'] <= end))
+            if whole_day and not session_id:
+                total += manifest['count']
+            else:
+                total += sum(1 for _ in self.events(device_id, [manifest], session_id, start, end))
+        return total
@@ -0,0 +1,38 @@
+#!/bin/bash
+# Deploy Events API Cloud Function
+
+PROJECT_ID=${1:-"anava-magical-backend"}
+REGION=${2:-"us-central1"}
+
+echo "Deploying Events API to project: $PROJECT_ID"
+
+gcloud functions deploy events-api \
+  --gen2 \
+  --runtime=python311 \
+  --region=$REGION \
+  --source=. \
+  --entry-point=query_events \
+  --trigger-http \
+  --no-allow-unauthenticated \
+  --set-env-vars="GCP_PROJECT=$PROJECT_ID" \
+  --memory=256MB \
+  --timeout=60s \
+  --max-instances=50 \
+  --project=$PROJECT_ID
+
+# Deploy event compaction (invoke nightly from Cloud Scheduler)
+gcloud functions deploy events-compaction \
+  --gen2 \
+  --runtime=python311 \
+  --region=$REGION \
+  --source=. \
+  --entry-point=compact_old_events \
+  --trigger-http \
+  --no-allow-unauthenticated \
+  --set-env-vars="GCP_PROJECT=$PROJECT_ID,ARCHIVE_AFTER_DAYS=30" \
+  --memory=512MB \
+  --timeout=540s \
+  --max-instances=1 \
+  --project=$PROJECT_ID
+
+echo "Events API deployment complete!"
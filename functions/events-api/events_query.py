@@ -0,0 +1,253 @@
+"""
+Read API for camera events
+Cursor-paginated, field-masked queries over devices/{id}/sessions/{sid}/events
+(or all of a device's sessions via the events collection group), filtered on the
+indexed timestamp field. Pages are bounded, so each call costs at most
+page_size document reads and only the requested fields cross the wire.
+
+When an EventArchive is supplied, days that have been compacted to GCS are
+read from their archive blobs and merged into the same ordering and cursors.
+"""
+
+import base64
+import heapq
+import json
+import re
+from datetime import datetime, timezone
+from typing import Iterator, List, Optional, Tuple
+
+from google.cloud import firestore
+from google.cloud.firestore_v1.base_query import FieldFilter
+
+DEVICES_COLLECTION = 'devices'
+SESSIONS_COLLECTION = 'sessions'
+EVENTS_COLLECTION = 'events'
+TIMESTAMP_FIELD = 'timestamp'
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 500
+
+# Fields returned when the caller doesn't ask for specific ones; excludes the
+# long free-text description
+DEFAULT_FIELDS = ['eventId', 'eventType', 'timestamp', 'confidence', 'sessionId', 'deviceId']
+
+FIELD_PATH = re.compile(r'^[A-Za-z_][A-Za-z0-9_]*(\.[A-Za-z_][A-Za-z0-9_]*)*$')
+
+
+class QueryError(ValueError):
+    """Invalid query parameters"""
+
+
+def encode_cursor(timestamp: datetime, path: str) -> str:
+    """Opaque cursor pointing just past an event"""
+    raw = json.dumps({'t': timestamp.isoformat(), 'p': path})
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, str]:
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        raw = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        return datetime.fromisoformat(raw['t']), raw['p']
+    except (ValueError, KeyError, TypeError) as e:
+        raise QueryError(f"Invalid cursor: {e}")
+
+
+def validate_fields(fields: Optional[List[str]]) -> List[str]:
+    """Field mask for the query; timestamp is always included for the cursor"""
+    fields = list(fields) if fields else list(DEFAULT_FIELDS)
+    for field in fields:
+        if not FIELD_PATH.match(field):
+            raise QueryError(f"Invalid field: {field}")
+    if TIMESTAMP_FIELD not in fields:
+        fields.append(TIMESTAMP_FIELD)
+    return fields
+
+
+def events_source(db, device_id: str, session_id: Optional[str] = None):
+    """Events of one session, or of every session of a device"""
+    if session_id:
+        return (db.collection(DEVICES_COLLECTION).document(device_id)
+                .collection(SESSIONS_COLLECTION).document(session_id)
+                .collection(EVENTS_COLLECTION))
+    return (db.collection_group(EVENTS_COLLECTION)
+            .where(filter=FieldFilter('deviceId', '==', device_id)))
+
+
+def _filtered(db, device_id: str, session_id: Optional[str],
+              start: Optional[datetime], end: Optional[datetime]):
+    query = events_source(db, device_id, session_id)
+    if start:
+        query = query.where(filter=FieldFilter(TIMESTAMP_FIELD, '>=', start))
+    if end:
+        query = query.where(filter=FieldFilter(TIMESTAMP_FIELD, '<', end))
+    return query
+
+
+def _page_query(db, device_id: str, session_id: Optional[str],
+                start: Optional[datetime], end: Optional[datetime],
+                fields: Optional[List[str]], page_size: int,
+                cursor: Optional[str], descending: bool):
+    direction = firestore.Query.DESCENDING if descending else firestore.Query.ASCENDING
+    query = (_filtered(db, device_id, session_id, start, end)
+             .order_by(TIMESTAMP_FIELD, direction=direction)
+             .order_by('__name__', direction=direction)
+             .select(validate_fields(fields)))
+
+    if cursor:
+        timestamp, path = decode_cursor(cursor)
+        query = query.start_after({TIMESTAMP_FIELD: timestamp, '__name__': db.document(path)})
+
+    # One extra document tells us whether another page exists
+    return query.limit(page_size + 1)
+
+
+def _project(data: dict, fields: List[str]) -> dict:
+    """Apply a field mask to an archived event, as select() does for live ones"""
+    projected = {}
+    for field in fields:
+        value = data
+        for part in field.split('.'):
+            if not isinstance(value, dict) or part not in value:
+                break
+            value = value[part]
+        else:
+            projected[field] = value
+    return projected
+
+
+class EventPage:
+    """Streams one page of events; next_cursor is known once iteration ends"""
+
+    def __init__(self, db, device_id: str, session_id: Optional[str] = None,
+                 start: Optional[datetime] = None, end: Optional[datetime] = None,
+                 fields: Optional[List[str]] = None, page_size: int = DEFAULT_PAGE_SIZE,
+                 cursor: Optional[str] = None, descending: bool = False, archive=None):
+        self.page_size = max(1, min(int(page_size), MAX_PAGE_SIZE))
+        self.fields = validate_fields(fields)
+        self.query = _page_query(db, device_id, session_id, start, end, self.fields,
+                                 self.page_size, cursor, descending)
+        self.cursor = decode_cursor(cursor) if cursor else None
+        self.device_id = device_id
+        self.session_id = session_id
+        self.start = start
+        self.end = end
+        self.descending = descending
+        self.archive = archive
+        self.next_cursor = None
+        self.returned = 0
+
+    def _live(self, covered_days: set) -> Iterator[Tuple]:
+        fetched = 0
+        last = None
+        for snapshot in self.query.stream():
+            fetched += 1
+            timestamp = snapshot.get(TIMESTAMP_FIELD)
+            last = (timestamp, snapshot.reference.path)
+            # Archived days are authoritative; skip documents awaiting deletion
+            if covered_days and timestamp.astimezone(timezone.utc).strftime('%Y-%m-%d') in covered_days:
+                continue
+            yield timestamp, snapshot.reference.path, snapshot.id, snapshot.to_dict()
+        if fetched > self.page_size:
+            # The over-fetch was used up by skipped documents: mark where the
+            # live query stopped so merging doesn't run past unread documents
+            yield last[0], last[1], None, None
+
+    def _archived(self, manifests: List[dict]) -> Iterator[Tuple]:
+        for event in self.archive.events(self.device_id, manifests, self.session_id,
+                                         self.start, self.end, self.descending):
+            timestamp = event['data'].get(TIMESTAMP_FIELD)
+            if self.cursor:
+                position = (timestamp, event['path'])
+                if (position <= self.cursor) if not self.descending else (position >= self.cursor):
+                    continue
+            yield timestamp, event['path'], event['id'], _project(event['data'], self.fields)
+
+    def _records(self) -> Iterator[Tuple]:
+        if not self.archive:
+            return self._live(set())
+        manifests = self.archive.manifests(self.device_id, self.start, self.end)
+        if not manifests:
+            return self._live(set())
+        return heapq.merge(self._live(self.archive.covered_days(manifests)),
+                           self._archived(manifests),
+                           key=lambda record: (record[0], record[1]),
+                           reverse=self.descending)
+
+    def __iter__(self) -> Iterator[dict]:
+        last = None
+        for timestamp, path, event_id, data in self._records():
+            if event_id is None:
+                self.next_cursor = encode_cursor(timestamp, path)
+                return
+            if self.returned == self.page_size:
+                self.next_cursor = encode_cursor(last[0], last[1])
+                return
+            event = dict(data)
+            event['id'] = event_id
+            self.returned += 1
+            last = (timestamp, path)
+            yield event
+
+
+def query_events(db, device_id: str, session_id: Optional[str] = None,
+                 start: Optional[datetime] = None, end: Optional[datetime] = None,
+                 fields: Optional[List[str]] = None, page_size: int = DEFAULT_PAGE_SIZE,
+                 cursor: Optional[str] = None, descending: bool = False, archive=None
+                 ) -> Tuple[List[dict], Optional[str]]:
+    """Fetch one page of events.
+
+    Returns (events, next_cursor); next_cursor is None on the last page.
+    """
+    page = EventPage(db, device_id, session_id, start, end, fields, page_size, cursor,
+                     descending, archive)
+    events = list(page)
+    return events, page.next_cursor
+
+
+def _count(db, device_id: str, session_id: Optional[str],
+           start: Optional[datetime], end: Optional[datetime]) -> int:
+    result = _filtered(db, device_id, session_id, start, end).count().get()
+    return int(result[0][0].value)
+
+
+def count_events(db, device_id: str, session_id: Optional[str] = None,
+                 start: Optional[datetime] = None, end: Optional[datetime] = None,
+                 archive=None) -> int:
+    """Server-side count aggregation; billed per 1000 index entries, not per document
+
+    With an archive, archived days are counted from the archive and live
+    documents still awaiting deletion on those days are left out, one
+    aggregation per run of consecutive archived days.
+    """
+    total = _count(db, device_id, session_id, start, end)
+    if not archive:
+        return total
+    manifests = archive.manifests(device_id, start, end)
+    if not manifests:
+        return total
+    for span_start, span_end in archive.spans(manifests):
+        total -= _count(db, device_id, session_id,
+                        max(span_start, start) if start else span_start,
+                        min(span_end, end) if end else span_end)
+    return total + archive.count(device_id, manifests, session_id, start, end)
+
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)
+
+
+def iter_ndjson(page: EventPage, count: Optional[int] = None) -> Iterator[str]:
+    """Render a page as NDJSON while it streams in.
+
+    One {"event": ...} line per event as soon as Firestore returns it, then a
+    {"page": ...} trailer with the cursor for the next request.
+    """
+    for event in page:
+        yield json.dumps({'event': event}, default=_json_default) + '\n'
+    trailer = {'returned': page.returned, 'next_cursor': page.next_cursor}
+    if count is not None:
+        trailer['count'] = count
+    yield json.dumps({'page': trailer}) + '\n'
@@ -0,0 +1,117 @@
+"""
+Events API Cloud Function for Anava Vision
+Streams camera events as NDJSON with cursor pagination, field masks and
+timestamp range filters, so consumers no longer fetch whole event documents.
+Also hosts the scheduled compaction job that archives old events to GCS;
+queries over archived days are served from the archive transparently.
+"""
+
+import functions_framework
+import json
+import os
+import logging
+from datetime import datetime, timezone
+
+from flask import Response, stream_with_context
+from google.cloud import firestore, storage
+
+from archive import EventArchive, compact_events
+from events_query import EventPage, QueryError, count_events, iter_ndjson
+
+# Initialize clients
+db = firestore.Client()
+storage_client = storage.Client()
+
+# Configuration
+PROJECT_ID = os.environ.get('GCP_PROJECT')
+ARCHIVE_BUCKET = os.environ.get('ARCHIVE_BUCKET', f"{PROJECT_ID}-anava-analytics")
+ARCHIVE_AFTER_DAYS = int(os.environ.get('ARCHIVE_AFTER_DAYS', '30'))
+MAX_DEVICE_DAYS_PER_RUN = int(os.environ.get('ARCHIVE_MAX_DEVICE_DAYS_PER_RUN', '200'))
+
+archive = EventArchive(db, storage_client.bucket(ARCHIVE_BUCKET))
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def parse_time(value):
+    """Parse an ISO-8601 timestamp query parameter"""
+    if not value:
+        return None
+    try:
+        parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except ValueError:
+        raise QueryError(f"Invalid timestamp: {value}")
+    # Stored timestamps are UTC; treat naive input the same way
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+
+@functions_framework.http
+def query_events(request):
+    """List events for a device (optionally one session) as NDJSON
+
+    Query parameters: device_id, session_id, start, end, fields (comma
+    separated), page_size, cursor, order (asc|desc), count (true|false)
+    """
+    if request.method == 'OPTIONS':
+        headers = {
+            'Access-Control-Allow-Origin': '*',
+            'Access-Control-Allow-Methods': 'GET',
+            'Access-Control-Allow-Headers': 'Content-Type, Authorization',
+            'Access-Control-Max-Age': '3600'
+        }
+        return ('', 204, headers)
+
+    headers = {
+        'Access-Control-Allow-Origin': '*',
+        'Content-Type': 'application/json'
+    }
+
+    if request.method != 'GET':
+        return json.dumps({'error': 'Method not allowed'}), 405, headers
+
+    device_id = request.args.get('device_id')
+    if not device_id:
+        return json.dumps({'error': "'device_id' missing"}), 400, headers
+
+    try:
+        session_id = request.args.get('session_id')
+        start = parse_time(request.args.get('start'))
+        end = parse_time(request.args.get('end'))
+        fields = [f for f in request.args.get('fields', '').split(',') if f] or None
+        page = EventPage(
+            db, device_id, session_id, start, end, fields,
+            page_size=int(request.args.get('page_size', 100)),
+            cursor=request.args.get('cursor'),
+            descending=request.args.get('order', 'asc') == 'desc',
+            archive=archive
+        )
+        # Counting is a separate aggregation; only pay for it when asked
+        count = None
+        if request.args.get('count') == 'true':
+            count = count_events(db, device_id, session_id, start, end, archive=archive)
+    except (QueryError, ValueError) as e:
+        return json.dumps({'error': str(e)}), 400, headers
+    except Exception as e:
+        logger.error(f"Failed to prepare events query for {device_id}: {e}")
+        return json.dumps({'error': 'Failed to query events'}), 500, headers
+
+    return Response(
+        stream_with_context(iter_ndjson(page, count)),
+        status=200,
+        headers={'Access-Control-Allow-Origin': '*', 'Cache-Control': 'no-store'},
+        mimetype='application/x-ndjson'
+    )
+
+
+@functions_framework.http
+def compact_old_events(request):
+    """Scheduled job: archive events older than ARCHIVE_AFTER_DAYS to GCS"""
+    headers = {'Content-Type': 'application/json'}
+    try:
+        stats = compact_events(db, archive.bucket, ARCHIVE_AFTER_DAYS, MAX_DEVICE_DAYS_PER_RUN)
+        logger.info(f"Event compaction finished: {stats}")
+        return json.dumps(stats), 200, headers
+    except Exception as e:
+        logger.error(f"Event compaction failed: {e}")
+        return json.dumps({'error': 'Compaction failed'}), 500, headers
@@ -0,0 +1,173 @@
+"""
+Heartbeat coalescer for camera devices
+Holds the latest heartbeat per device in memory and turns the steady stream of
+lastSeen/status updates into periodic batched writes. Status transitions
+(online -> offline and back) bypass the batch and are written immediately.
+"""
+
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+# Firestore allows at most 500 writes per batch/commit
+MAX_BATCH_SIZE = 500
+
+# Defaults, overridable per instance
+DEFAULT_FLUSH_INTERVAL = 30.0   # seconds between batched flushes
+DEFAULT_OFFLINE_AFTER = 180.0   # seconds of silence before a device is offline
+
+STATUS_ONLINE = 'online'
+STATUS_OFFLINE = 'offline'
+
+# writer(updates) persists [(device_id, fields), ...] as one batch
+Writer = Callable[[List[Tuple[str, dict]]], None]
+
+
+class DeviceState:
+    """Latest known and last persisted state for one device"""
+
+    __slots__ = ('status', 'last_seen', 'extra', 'written_status',
+                 'written_last_seen', 'dirty')
+
+    def __init__(self):
+        self.status = None
+        self.last_seen = 0.0
+        self.extra = {}
+        self.written_status = None
+        self.written_last_seen = 0.0
+        self.dirty = False
+
+    def fields(self) -> dict:
+        fields = dict(self.extra)
+        fields['status'] = self.status
+        fields['lastSeen'] = self.last_seen
+        return fields
+
+
+class HeartbeatCoalescer:
+    """Coalesces per-device heartbeats into batched writes"""
+
+    def __init__(self, writer: Writer,
+                 flush_interval: float = DEFAULT_FLUSH_INTERVAL,
+                 offline_after: float = DEFAULT_OFFLINE_AFTER,
+                 clock: Callable[[], float] = time.time):
+        self.writer = writer
+        self.flush_interval = flush_interval
+        self.offline_after = offline_after
+        self.clock = clock
+        self.devices: Dict[str, DeviceState] = {}
+        self.last_flush = clock()
+        self.lock = threading.Lock()
+        self.stats = {
+            'heartbeats': 0,
+            'immediate_writes': 0,
+            'batched_writes': 0,
+            'batches': 0,
+        }
+
+    def record(self, device_id: str, status: str = STATUS_ONLINE,
+               extra: Optional[dict] = None) -> bool:
+        """Record a heartbeat. Returns True if it was written immediately."""
+        now = self.clock()
+        with self.lock:
+            self.stats['heartbeats'] += 1
+            state = self.devices.get(device_id)
+            if state is None:
+                state = self.devices[device_id] = DeviceState()
+
+            state.status = status
+            state.last_seen = now
+            if extra:
+                state.extra.update(extra)
+
+            if state.status == state.written_status:
+                state.dirty = True
+                return False
+
+            # Meaningful transition - persist without waiting for the batch
+            taken = self._take([(device_id, state)])
+            self.stats['immediate_writes'] += 1
+
+        self._write(taken)
+        return True
+
+    def flush_if_due(self) -> int:
+        """Flush if the flush interval has elapsed. Returns devices written."""
+        if self.clock() - self.last_flush < self.flush_interval:
+            return 0
+        return self.flush()
+
+    def flush(self) -> int:
+        """Write every changed device and mark silent devices offline
+
+        The changed states are swapped out under the lock and written outside
+        it, so a slow Firestore commit does not hold up incoming heartbeats.
+        """
+        now = self.clock()
+        with self.lock:
+            self.last_flush = now
+            self._forget_offline()
+            expired = self._take(self._expire_silent(now))
+            self.stats['immediate_writes'] += len(expired)
+
+            pending = self._take([(device_id, state) for device_id, state in self.devices.items()
+                                  if state.dirty])
+            self.stats['batches'] += -(-len(pending) // MAX_BATCH_SIZE)
+            self.stats['batched_writes'] += len(pending)
+
+        for taken in (expired, pending):
+            for start in range(0, len(taken), MAX_BATCH_SIZE):
+                self._write(taken[start:start + MAX_BATCH_SIZE])
+        return len(pending)
+
+    def staleness(self) -> float:
+        """Largest gap between a device's latest heartbeat and its persisted lastSeen"""
+        with self.lock:
+            gaps = [state.last_seen - state.written_last_seen
+                    for state in self.devices.values() if state.dirty]
+        return max(gaps, default=0.0)
+
+    def _expire_silent(self, now: float) -> List[Tuple[str, DeviceState]]:
+        """Transition devices that stopped sending heartbeats to offline"""
+        expired = []
+        for device_id, state in self.devices.items():
+            if state.status != STATUS_OFFLINE and now - state.last_seen >= self.offline_after:
+                state.status = STATUS_OFFLINE
+                expired.append((device_id, state))
+        return expired
+
+    def _forget_offline(self):
+        """Drop devices whose offline state is already persisted, so memory tracks the live fleet
+
+        A forgotten device that comes back is a new transition and is written at once.
+        """
+        for device_id in [device_id for device_id, state in self.devices.items()
+                          if state.status == STATUS_OFFLINE and state.written_status == STATUS_OFFLINE
+                          and not state.dirty]:
+            del self.devices[device_id]
+
+    def _take(self, states: List[Tuple[str, DeviceState]]) -> list:
+        """Snapshot states for writing and mark them persisted. Call with the lock held."""
+        taken = []
+        for device_id, state in states:
+            taken.append((device_id, state, state.fields(),
+                          state.written_status, state.written_last_seen))
+            state.written_status = state.status
+            state.written_last_seen = state.last_seen
+            state.dirty = False
+        return taken
+
+    def _write(self, taken: list):
+        """Persist snapshots from _take; on failure they are marked dirty again"""
+        try:
+            self.writer([(device_id, fields) for device_id, _, fields, _, _ in taken])
+        except Exception:
+            with self.lock:
+                for _, state, fields, written_status, written_last_seen in taken:
+                    # Leave states alone if a newer write has already claimed them
+                    if (state.written_status == fields['status']
+                            and state.written_last_seen == fields['lastSeen']):
+                        state.written_status = written_status
+                        state.written_last_seen = written_last_seen
+                    state.dirty = True
+            raise
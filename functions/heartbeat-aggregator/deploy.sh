@@ -0,0 +1,35 @@
+#!/bin/bash
+# Deploy Heartbeat Aggregator Cloud Function
+
+PROJECT_ID=${1:-"anava-magical-backend"}
+REGION=${2:-"us-central1"}
+
+echo "Deploying Heartbeat Aggregator to project: $PROJECT_ID"
+
+# Coalesced state is held in memory, so keep a single instance. Cameras call
+# it directly, so it is public at the IAM layer; every request must carry the
+# device's Firebase ID token and may only report for that device.
+gcloud functions deploy heartbeat-aggregator \
+  --gen2 \
+  --runtime=python311 \
+  --region=$REGION \
+  --source=. \
+  --entry-point=heartbeat_aggregator \
+  --trigger-http \
+  --allow-unauthenticated \
+  --set-env-vars="GCP_PROJECT=$PROJECT_ID,FIREBASE_PROJECT_ID=$PROJECT_ID,HEARTBEAT_FLUSH_INTERVAL=30,HEARTBEAT_OFFLINE_AFTER=180" \
+  --memory=256MB \
+  --timeout=30s \
+  --min-instances=1 \
+  --max-instances=1 \
+  --project=$PROJECT_ID
+
+# The flush ticker must run between requests to persist batched lastSeen values
+# and offline transitions while the fleet is quiet; gen2 throttles CPU outside
+# requests unless told otherwise. This bills the one instance as always on.
+gcloud run services update heartbeat-aggregator \
+  --region=$REGION \
+  --no-cpu-throttling \
+  --project=$PROJECT_ID
+
+echo "Heartbeat Aggregator deployment complete!"
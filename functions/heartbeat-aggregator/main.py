@@ -0,0 +1,181 @@
+"""
+Heartbeat Aggregator Cloud Function for Anava Vision cameras
+Accepts camera heartbeats and coalesces them into batched devices/{id} writes
+instead of one full document write per heartbeat.
+
+State lives in instance memory, so deploy with a single instance (or session
+affinity) to keep each device's heartbeats on the same coalescer. Each caller
+authenticates with its Firebase ID token and can only report for its own
+device.
+"""
+
+import functions_framework
+import json
+import os
+import re
+import threading
+import time
+import logging
+from datetime import datetime, timezone
+from google.auth.transport import requests as google_requests
+from google.cloud import firestore
+from google.oauth2 import id_token
+
+from coalescer import HeartbeatCoalescer, STATUS_ONLINE
+
+# Initialize clients
+db = firestore.Client()
+
+# Configuration
+DEVICES_COLLECTION = 'devices'
+FLUSH_INTERVAL = float(os.environ.get('HEARTBEAT_FLUSH_INTERVAL', '30'))
+OFFLINE_AFTER = float(os.environ.get('HEARTBEAT_OFFLINE_AFTER', '180'))
+VALID_STATUSES = {'online', 'offline', 'error', 'maintenance'}
+FIREBASE_PROJECT_ID = os.environ.get('FIREBASE_PROJECT_ID', os.environ.get('GCP_PROJECT'))
+
+SAFE_ID = re.compile(r'^[A-Za-z0-9_.-]{1,128}$')
+# Verified ID tokens are remembered until they expire, so heartbeats don't
+# re-verify the same token every few seconds
+MAX_VERIFIED_TOKENS = 10000
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+_auth_request = google_requests.Request()
+_verified_tokens = {}
+_verified_lock = threading.Lock()
+
+
+def authenticated_device(request):
+    """Device ID (Firebase uid) from the caller's Firebase ID token, or None
+
+    Behind API Gateway the original header arrives as X-Forwarded-Authorization.
+    """
+    authorization = (request.headers.get('X-Forwarded-Authorization')
+                     or request.headers.get('Authorization', ''))
+    scheme, _, token = authorization.partition(' ')
+    if scheme.lower() != 'bearer' or not token:
+        return None
+
+    now = time.time()
+    with _verified_lock:
+        cached = _verified_tokens.get(token)
+    if cached and cached[1] > now:
+        return cached[0]
+    try:
+        claims = id_token.verify_firebase_token(token, _auth_request, audience=FIREBASE_PROJECT_ID)
+    except Exception as e:
+        logger.warning(f"Rejected Firebase ID token: {e}")
+        return None
+    if not claims or not claims.get('sub'):
+        return None
+    with _verified_lock:
+        if len(_verified_tokens) >= MAX_VERIFIED_TOKENS:
+            for key in [key for key, (_, expires) in _verified_tokens.items() if expires <= now]:
+                del _verified_tokens[key]
+            if len(_verified_tokens) >= MAX_VERIFIED_TOKENS:
+                _verified_tokens.pop(next(iter(_verified_tokens)))
+        _verified_tokens[token] = (claims['sub'], claims.get('exp', now))
+    return claims['sub']
+
+
+def write_devices(updates: list):
+    """Persist coalesced device states in a single Firestore batch
+
+    An entry that can't be addressed is logged and skipped rather than failing
+    the batch, which would otherwise be retried with it forever.
+    """
+    batch = db.batch()
+    for device_id, fields in updates:
+        try:
+            ref = db.collection(DEVICES_COLLECTION).document(device_id)
+        except ValueError as e:
+            logger.error(f"Skipping heartbeat for invalid device ID {device_id!r}: {e}")
+            continue
+        doc = dict(fields)
+        doc['lastSeen'] = datetime.fromtimestamp(fields['lastSeen'], tz=timezone.utc)
+        batch.set(ref, doc, merge=True)
+    batch.commit()
+
+
+coalescer = HeartbeatCoalescer(write_devices,
+                               flush_interval=FLUSH_INTERVAL,
+                               offline_after=OFFLINE_AFTER)
+
+
+def _flush_loop():
+    """Ticker so idle periods still flush and expire devices
+
+    Needs CPU between requests: deploy.sh turns off CPU throttling for the
+    function's single instance.
+    """
+    while True:
+        time.sleep(1)
+        try:
+            coalescer.flush_if_due()
+        except Exception as e:
+            logger.error(f"Heartbeat flush failed: {e}")
+
+
+threading.Thread(target=_flush_loop, daemon=True).start()
+
+
+@functions_framework.http
+def heartbeat_aggregator(request):
+    """Accept one heartbeat or a list of heartbeats"""
+    headers = {
+        'Access-Control-Allow-Origin': '*',
+        'Content-Type': 'application/json'
+    }
+
+    if request.method != 'POST':
+        return json.dumps({'error': 'Method not allowed'}), 405, headers
+
+    authenticated_id = authenticated_device(request)
+    if authenticated_id is None:
+        return json.dumps({'error': 'Missing or invalid Firebase ID token'}), 401, headers
+    if not SAFE_ID.match(authenticated_id):
+        return json.dumps({'error': 'Invalid device ID'}), 400, headers
+
+    request_data = request.get_json(silent=True)
+    if not request_data or not isinstance(request_data, dict):
+        return json.dumps({'error': 'Invalid request body'}), 400, headers
+
+    heartbeats = request_data.get('heartbeats', [request_data])
+    if not isinstance(heartbeats, list):
+        return json.dumps({'error': 'heartbeats must be a list'}), 400, headers
+    accepted = 0
+    rejected = 0
+    immediate = 0
+
+    try:
+        for heartbeat in heartbeats:
+            if not isinstance(heartbeat, dict):
+                rejected += 1
+                continue
+            # A device may only report for itself
+            device_id = str(heartbeat.get('device_id', authenticated_id))
+            status = heartbeat.get('status', STATUS_ONLINE)
+            if device_id != authenticated_id or status not in VALID_STATUSES:
+                rejected += 1
+                continue
+            extra = {k: v for k, v in heartbeat.items()
+                     if k in ('firmwareVersion', 'model', 'ipAddress')}
+            if coalescer.record(device_id, status, extra):
+                immediate += 1
+            accepted += 1
+
+        # CPU may be throttled between requests, so also flush on the request path
+        coalescer.flush_if_due()
+
+        return json.dumps({
+            'accepted': accepted,
+            'rejected': rejected,
+            'written_immediately': immediate,
+            'flush_interval': FLUSH_INTERVAL
+        }), 200, headers
+
+    except Exception as e:
+        logger.error(f"Error recording heartbeats: {e}")
+        return json.dumps({'error': 'Failed to record heartbeat'}), 500, headers
@@ -2,9 +2,37 @@ import functions_framework
 import os
 import requests
 import json
+import time
 
-STS_ENDPOINT = "https://sts.googleapis.com/v1/token"
-IAM_ENDPOINT_TEMPLATE = "https://iamcredentials.googleapis.com/v1/projects/-/serviceAccounts/{sa_email}:generateAccessToken"
+# Overridable so the function can run against local stand-ins
+STS_ENDPOINT = os.environ.get("STS_ENDPOINT", "https://sts.googleapis.com/v1/token")
+IAM_CREDENTIALS_ENDPOINT = os.environ.get("IAM_CREDENTIALS_ENDPOINT", "https://iamcredentials.googleapis.com")
+IAM_ENDPOINT_TEMPLATE = IAM_CREDENTIALS_ENDPOINT.rstrip("/") + "/v1/projects/-/serviceAccounts/{sa_email}:generateAccessToken"
+
+# API Gateway's backend deadline (api-gateway-config.yaml) less time to answer;
+# clients may ask for less with X-Request-Timeout. STS and IAM get what is left.
+REQUEST_DEADLINE_SECONDS = float(os.environ.get("REQUEST_DEADLINE_SECONDS", "30"))
+DEADLINE_MARGIN_SECONDS = float(os.environ.get("DEADLINE_MARGIN_SECONDS", "0.5"))
+MIN_STAGE_SECONDS = 0.5
+
+class DeadlineExceeded(Exception):
+    pass
+
+def request_deadline(request):
+    seconds = REQUEST_DEADLINE_SECONDS - DEADLINE_MARGIN_SECONDS
+    try:
+        requested = float(request.headers.get("X-Request-Timeout", ""))
+        if 0 < requested < seconds:
+            seconds = requested
+    except ValueError:
+        pass
+    return time.monotonic() + seconds
+
+def time_left(deadline, stage):
+    left = deadline - time.monotonic()
+    if left < MIN_STAGE_SECONDS:
+        raise DeadlineExceeded(f"Deadline exceeded before {stage}")
+    return left
 
 @functions_framework.http
 def token_vendor_machine(request):
@@ -20,6 +48,7 @@ def token_vendor_machine(request):
     if request.method != 'POST': 
         return ('Method Not Allowed', 405)
     
+    deadline = request_deadline(request)
     try:
         req_json = request.get_json(silent=True)
         if not req_json: 
@@ -42,7 +71,7 @@ def token_vendor_machine(request):
             "requested_token_type": "urn:ietf:params:oauth:token-type:access_token"
         }
         
-        sts_r = requests.post(STS_ENDPOINT, json=sts_p)
+        sts_r = requests.post(STS_ENDPOINT, json=sts_p, timeout=time_left(deadline, "STS"))
         sts_r.raise_for_status()
         sts_j = sts_r.json()
         fed_at = sts_j.get("access_token")
@@ -56,7 +85,7 @@ def token_vendor_machine(request):
         iam_p = {"scope": ["https://www.googleapis.com/auth/cloud-platform"]}
         iam_h = {"Authorization": f"Bearer {fed_at}", "Content-Type": "application/json"}
         
-        sa_r = requests.post(iam_ep, json=iam_p, headers=iam_h)
+        sa_r = requests.post(iam_ep, json=iam_p, headers=iam_h, timeout=time_left(deadline, "IAM"))
         sa_r.raise_for_status()
         sa_j = sa_r.json()
         gcp_at = sa_j.get("accessToken")
@@ -69,6 +98,9 @@ def token_vendor_machine(request):
         print(f"TVMFn: GCP SA token for {target_sa} OK.")
         return ({"gcp_access_token": gcp_at, "expires_in": exp_in}, 200)
         
+    except (DeadlineExceeded, requests.exceptions.Timeout) as e:
+        print(f"TVMFn Deadline: {e}")
+        return ("TVM Deadline Exceeded", 504)
     except requests.exceptions.HTTPError as e: 
         print(f"TVMFn HTTPError: {e} - Resp: {e.response.text if e.response else 'N/A'}")
         return (f"TVM HTTP Err {e.response.status_code if e.response else ''}", 500)
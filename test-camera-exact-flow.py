@@ -7,6 +7,8 @@ import requests
 import sys
 from datetime import datetime
 
+from validation.firestore_rest import FirestoreRest
+
 # Configuration for montest2-rtvn deployment
 CONFIG = {
     "API_GATEWAY_URL": "https://anava-api-anava-iot-gateway-6qm4nm1m.uc.gateway.dev",
@@ -75,86 +77,58 @@ firestore_headers = {
     "Content-Type": "application/json"
 }
 
-# STEP 2: Write device document
-print("\n2️⃣ WRITE DEVICE DOCUMENT")
-try:
-    url = f"https://firestore.googleapis.com/v1/projects/{CONFIG['PROJECT_ID']}/databases/(default)/documents/devices/{CONFIG['DEVICE_ID']}"
-    data = {
-        "fields": {
-            "deviceId": {"stringValue": CONFIG['DEVICE_ID']},
-            "model": {"stringValue": "AXIS-P3265"},
-            "firmwareVersion": {"stringValue": "11.11.76"},
-            "status": {"stringValue": "online"},
-            "lastSeen": {"timestampValue": datetime.utcnow().isoformat() + "Z"}
-        }
-    }
-    response = requests.patch(url, headers=firestore_headers, json=data, timeout=30)
-    if response.status_code == 200:
-        print(f"   ✅ Device document written")
-    elif response.status_code == 403:
-        print(f"   ❌ 403 FORBIDDEN on device document")
-        print(f"      Error: {response.json().get('error', {}).get('message', response.text)}")
-    else:
-        print(f"   ⚠️ Status {response.status_code}: {response.text[:200]}")
-except Exception as e:
-    print(f"   ❌ Error: {e}")
-
-# STEP 3: Create session
-print("\n3️⃣ CREATE SESSION")
+# STEP 2: Write device, session and event in one commit
+print("\n2️⃣ WRITE DEVICE, SESSION AND EVENT")
 session_id = f"session-{datetime.now().strftime('%Y%m%d%H%M%S')}"
-try:
-    url = f"https://firestore.googleapis.com/v1/projects/{CONFIG['PROJECT_ID']}/databases/(default)/documents/devices/{CONFIG['DEVICE_ID']}/sessions/{session_id}"
-    data = {
-        "fields": {
-            "sessionId": {"stringValue": session_id},
-            "deviceId": {"stringValue": CONFIG['DEVICE_ID']},
-            "startTime": {"timestampValue": datetime.utcnow().isoformat() + "Z"},
-            "status": {"stringValue": "active"}
-        }
-    }
-    response = requests.patch(url, headers=firestore_headers, json=data, timeout=30)
-    if response.status_code == 200:
-        print(f"   ✅ Session created: {session_id}")
-    elif response.status_code == 403:
-        print(f"   ❌ 403 FORBIDDEN on session creation")
-        print(f"      Path: devices/{CONFIG['DEVICE_ID']}/sessions/{session_id}")
-        print(f"      Error: {response.json().get('error', {}).get('message', response.text)}")
-    else:
-        print(f"   ⚠️ Status {response.status_code}: {response.text[:200]}")
-except Exception as e:
-    print(f"   ❌ Error: {e}")
-
-# STEP 4: Write event
-print("\n4️⃣ WRITE DETECTION EVENT")
 event_id = f"event-{datetime.now().strftime('%Y%m%d%H%M%S%f')}"
+device_path = f"devices/{CONFIG['DEVICE_ID']}"
+session_path = f"{device_path}/sessions/{session_id}"
+event_path = f"{session_path}/events/{event_id}"
+firestore = FirestoreRest(requests.Session(), "https://firestore.googleapis.com", CONFIG['PROJECT_ID'], tokens['gcp'])
+now = datetime.utcnow()
 try:
-    url = f"https://firestore.googleapis.com/v1/projects/{CONFIG['PROJECT_ID']}/databases/(default)/documents/devices/{CONFIG['DEVICE_ID']}/sessions/{session_id}/events/{event_id}"
-    data = {
-        "fields": {
-            "eventId": {"stringValue": event_id},
-            "sessionId": {"stringValue": session_id},
-            "deviceId": {"stringValue": CONFIG['DEVICE_ID']},
-            "eventType": {"stringValue": "person_detected"},
-            "timestamp": {"timestampValue": datetime.utcnow().isoformat() + "Z"},
-            "confidence": {"doubleValue": 0.92},
-            "description": {"stringValue": "Person detected in parking area"},
-            "imageUrl": {"stringValue": f"gs://{CONFIG['PROJECT_ID']}-anava-analytics/captures/{event_id}.jpg"}
+    firestore.write_tree({
+        device_path: {
+            "deviceId": CONFIG['DEVICE_ID'],
+            "model": "AXIS-P3265",
+            "firmwareVersion": "11.11.76",
+            "status": "online",
+            "lastSeen": now
+        },
+        session_path: {
+            "sessionId": session_id,
+            "deviceId": CONFIG['DEVICE_ID'],
+            "startTime": now,
+            "status": "active"
+        },
+        event_path: {
+            "eventId": event_id,
+            "sessionId": session_id,
+            "deviceId": CONFIG['DEVICE_ID'],
+            "eventType": "person_detected",
+            "timestamp": now,
+            "confidence": 0.92,
+            "description": "Person detected in parking area",
+            "imageUrl": f"gs://{CONFIG['PROJECT_ID']}-anava-analytics/captures/{event_id}.jpg"
         }
-    }
-    response = requests.patch(url, headers=firestore_headers, json=data, timeout=30)
-    if response.status_code == 200:
-        print(f"   ✅ Event written: {event_id}")
-    elif response.status_code == 403:
-        print(f"   ❌ 403 FORBIDDEN on event write")
-        print(f"      Path: devices/{CONFIG['DEVICE_ID']}/sessions/{session_id}/events/{event_id}")
+    })
+    print(f"   ✅ Device document written")
+    print(f"   ✅ Session created: {session_id}")
+    print(f"   ✅ Event written: {event_id}")
+except requests.HTTPError as e:
+    response = e.response
+    if response.status_code == 403:
+        # The commit is atomic, so a rule denying any one path rejects all three
+        print(f"   ❌ 403 FORBIDDEN on device/session/event write")
+        print(f"      Paths: {device_path}, {session_path}, {event_path}")
         print(f"      Error: {response.json().get('error', {}).get('message', response.text)}")
     else:
         print(f"   ⚠️ Status {response.status_code}: {response.text[:200]}")
 except Exception as e:
     print(f"   ❌ Error: {e}")
 
-# STEP 5: Read back to verify
-print("\n5️⃣ READ BACK DATA")
+# STEP 3: Read back to verify
+print("\n3️⃣ READ BACK DATA")
 try:
     # Read device
     url = f"https://firestore.googleapis.com/v1/projects/{CONFIG['PROJECT_ID']}/databases/(default)/documents/devices/{CONFIG['DEVICE_ID']}"
@@ -183,8 +157,8 @@ try:
 except Exception as e:
     print(f"   ❌ Error reading: {e}")
 
-# STEP 6: Test Gemini API call
-print("\n6️⃣ TEST GEMINI API CALL")
+# STEP 4: Test Gemini API call
+print("\n4️⃣ TEST GEMINI API CALL")
 try:
     test_image_base64 = "iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR42mP8/5+hHgAHggJ/PchI7wAAAABJRU5ErkJggg=="
     
@@ -220,16 +194,14 @@ try:
 except Exception as e:
     print(f"   ❌ Error: {e}")
 
-# STEP 7: Clean up
-print("\n7️⃣ CLEANUP")
+# STEP 5: Clean up
+print("\n5️⃣ CLEANUP")
 try:
-    # Delete in reverse order
-    requests.delete(f"https://firestore.googleapis.com/v1/projects/{CONFIG['PROJECT_ID']}/databases/(default)/documents/devices/{CONFIG['DEVICE_ID']}/sessions/{session_id}/events/{event_id}", headers=firestore_headers, timeout=10)
-    requests.delete(f"https://firestore.googleapis.com/v1/projects/{CONFIG['PROJECT_ID']}/databases/(default)/documents/devices/{CONFIG['DEVICE_ID']}/sessions/{session_id}", headers=firestore_headers, timeout=10)
-    requests.delete(f"https://firestore.googleapis.com/v1/projects/{CONFIG['PROJECT_ID']}/databases/(default)/documents/devices/{CONFIG['DEVICE_ID']}", headers=firestore_headers, timeout=10)
-    print(f"   ✅ Test data cleaned up")
-except:
-    print(f"   ⚠️ Cleanup may have partially failed")
+    # Removes the session and event subcollections with the device
+    deleted = firestore.delete_tree(f"devices/{CONFIG['DEVICE_ID']}")
+    print(f"   ✅ Test data cleaned up ({deleted} documents)")
+except Exception as e:
+    print(f"   ⚠️ Cleanup may have partially failed: {e}")
 
 print("\n" + "=" * 70)
 print("📊 SUMMARY")
@@ -3,12 +3,15 @@
 Complete end-to-end test of camera authentication and functionality
 Tests: Auth flow, Firestore writes, and Gemini API calls
 """
-import json
 import requests
 import sys
 import base64
+import time
 from datetime import datetime
 
+from validation.firestore_rest import FirestoreRest
+from validation.streaming import read_stream
+
 # Configuration for testdada-n73m deployment
 CONFIG = {
     "API_GATEWAY_URL": "https://anava-api-anava-iot-gateway-58sszmdx.uc.gateway.dev",
@@ -92,82 +95,48 @@ def get_gcp_token():
 
 tokens['gcp'] = test_step("Step 3: Get GCP Access Token via Token Vendor", get_gcp_token)
 
-# STEP 4: Write to Firestore (device document)
-def write_device_to_firestore():
-    url = f"https://firestore.googleapis.com/v1/projects/{CONFIG['PROJECT_ID']}/databases/(default)/documents/devices/{CONFIG['DEVICE_ID']}"
-    headers = {
-        "Authorization": f"Bearer {tokens['gcp']}",
-        "Content-Type": "application/json"
-    }
-    data = {
-        "fields": {
-            "deviceId": {"stringValue": CONFIG['DEVICE_ID']},
-            "updatedAt": {"timestampValue": datetime.utcnow().isoformat() + "Z"},
-            "status": {"stringValue": "active"},
-            "model": {"stringValue": "AXIS-TEST"},
-            "testRun": {"booleanValue": True},
-            "testTimestamp": {"timestampValue": datetime.utcnow().isoformat() + "Z"}
-        }
-    }
-    response = requests.patch(url, headers=headers, json=data, timeout=30)
-    response.raise_for_status()
-    doc_name = response.json().get('name', 'unknown')
-    print(f"   Created/Updated document: {doc_name}")
-    return doc_name
-
-test_step("Step 4: Write Device Document to Firestore", write_device_to_firestore)
-
-# STEP 5: Write session to Firestore
-def write_session_to_firestore():
+# STEP 4: Write device, session and event to Firestore in one commit
+def write_test_data_to_firestore():
+    firestore = FirestoreRest(requests.Session(), "https://firestore.googleapis.com", CONFIG['PROJECT_ID'], tokens['gcp'])
     session_id = f"session-{datetime.now().strftime('%Y%m%d%H%M%S')}"
-    url = f"https://firestore.googleapis.com/v1/projects/{CONFIG['PROJECT_ID']}/databases/(default)/documents/devices/{CONFIG['DEVICE_ID']}/sessions/{session_id}"
-    headers = {
-        "Authorization": f"Bearer {tokens['gcp']}",
-        "Content-Type": "application/json"
-    }
-    data = {
-        "fields": {
-            "deviceId": {"stringValue": CONFIG['DEVICE_ID']},
-            "sessionId": {"stringValue": session_id},
-            "startTime": {"timestampValue": datetime.utcnow().isoformat() + "Z"},
-            "status": {"stringValue": "active"},
-            "updatedAt": {"timestampValue": datetime.utcnow().isoformat() + "Z"}
-        }
-    }
-    response = requests.patch(url, headers=headers, json=data, timeout=30)
-    response.raise_for_status()
-    print(f"   Created session: {session_id}")
-    return session_id
-
-session_id = test_step("Step 5: Write Session to Firestore", write_session_to_firestore)
-
-# STEP 6: Write event to Firestore
-def write_event_to_firestore():
     event_id = f"event-{datetime.now().strftime('%Y%m%d%H%M%S')}"
-    url = f"https://firestore.googleapis.com/v1/projects/{CONFIG['PROJECT_ID']}/databases/(default)/documents/devices/{CONFIG['DEVICE_ID']}/sessions/{session_id}/events/{event_id}"
-    headers = {
-        "Authorization": f"Bearer {tokens['gcp']}",
-        "Content-Type": "application/json"
-    }
-    data = {
-        "fields": {
-            "deviceId": {"stringValue": CONFIG['DEVICE_ID']},
-            "sessionId": {"stringValue": session_id},
-            "eventId": {"stringValue": event_id},
-            "eventType": {"stringValue": "test_detection"},
-            "timestamp": {"timestampValue": datetime.utcnow().isoformat() + "Z"},
-            "description": {"stringValue": "End-to-end test event"},
-            "confidence": {"doubleValue": 0.95}
+    device_path = f"devices/{CONFIG['DEVICE_ID']}"
+    session_path = f"{device_path}/sessions/{session_id}"
+    now = datetime.utcnow()
+    firestore.write_tree({
+        device_path: {
+            "deviceId": CONFIG['DEVICE_ID'],
+            "updatedAt": now,
+            "status": "active",
+            "model": "AXIS-TEST",
+            "testRun": True,
+            "testTimestamp": now
+        },
+        session_path: {
+            "deviceId": CONFIG['DEVICE_ID'],
+            "sessionId": session_id,
+            "startTime": now,
+            "status": "active",
+            "updatedAt": now
+        },
+        f"{session_path}/events/{event_id}": {
+            "deviceId": CONFIG['DEVICE_ID'],
+            "sessionId": session_id,
+            "eventId": event_id,
+            "eventType": "test_detection",
+            "timestamp": now,
+            "description": "End-to-end test event",
+            "confidence": 0.95
         }
-    }
-    response = requests.patch(url, headers=headers, json=data, timeout=30)
-    response.raise_for_status()
+    })
+    print(f"   Created document: {firestore.name(device_path)}")
+    print(f"   Created session: {session_id}")
     print(f"   Created event: {event_id}")
-    return event_id
+    return session_id, event_id
 
-event_id = test_step("Step 6: Write Event to Firestore", write_event_to_firestore)
+session_id, event_id = test_step("Step 4: Write Device, Session and Event to Firestore", write_test_data_to_firestore)
 
-# STEP 7: Call Vertex AI Gemini API
+# STEP 5: Call Vertex AI Gemini API
 def call_gemini_api():
     # Prepare a simple test image (1x1 white pixel)
     test_image_base64 = "iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR42mP8/5+hHgAHggJ/PchI7wAAAABJRU5ErkJggg=="
@@ -202,34 +171,30 @@ def call_gemini_api():
         }
     }
     
-    response = requests.post(url, headers=headers, json=data, timeout=30)
-    
-    if response.status_code == 200:
-        # Parse streaming response
-        lines = response.text.strip().split('\n')
-        for line in lines:
-            if line.strip():
-                try:
-                    chunk = json.loads(line)
-                    if 'candidates' in chunk and chunk['candidates']:
-                        text = chunk['candidates'][0].get('content', {}).get('parts', [{}])[0].get('text', '')
-                        if text:
-                            print(f"   Gemini response: {text[:100]}...")
-                            return True
-                except:
-                    pass
-        print("   Gemini responded (no text extracted)")
-        return True
-    elif response.status_code == 403:
-        print(f"   ⚠️  Gemini API returned 403 - check Vertex AI permissions")
-        print(f"   Response: {response.text[:200]}")
-        return False
-    else:
-        response.raise_for_status()
-
-test_step("Step 7: Call Vertex AI Gemini API", call_gemini_api)
-
-# STEP 8: Read back from Firestore to verify
+    started = time.perf_counter()
+    with requests.post(url, headers=headers, json=data, timeout=30, stream=True) as response:
+        if response.status_code == 200:
+            # Parse chunks as they arrive so first-token latency is visible
+            result = read_stream(response, started)
+            timings = result.timings.as_dict()
+            print(f"   TTFB: {timings['time_to_first_byte_ms']}ms, "
+                  f"TTFT: {timings['time_to_first_token_ms']}ms, "
+                  f"total: {timings['total_ms']}ms over {timings['chunks']} chunks")
+            if result.text:
+                print(f"   Gemini response: {result.text[:100]}...")
+            else:
+                print("   Gemini responded (no text extracted)")
+            return True
+        elif response.status_code == 403:
+            print(f"   ⚠️  Gemini API returned 403 - check Vertex AI permissions")
+            print(f"   Response: {response.text[:200]}")
+            return False
+        else:
+            response.raise_for_status()
+
+test_step("Step 5: Call Vertex AI Gemini API", call_gemini_api)
+
+# STEP 6: Read back from Firestore to verify
 def read_from_firestore():
     url = f"https://firestore.googleapis.com/v1/projects/{CONFIG['PROJECT_ID']}/databases/(default)/documents/devices/{CONFIG['DEVICE_ID']}"
     headers = {
@@ -242,26 +207,17 @@ def read_from_firestore():
     print(f"   Read document with {len(doc.get('fields', {}))} fields")
     return True
 
-test_step("Step 8: Read Device from Firestore", read_from_firestore)
+test_step("Step 6: Read Device from Firestore", read_from_firestore)
 
-# STEP 9: Clean up test data
+# STEP 7: Clean up test data
 def cleanup_test_data():
-    # Delete event
-    url = f"https://firestore.googleapis.com/v1/projects/{CONFIG['PROJECT_ID']}/databases/(default)/documents/devices/{CONFIG['DEVICE_ID']}/sessions/{session_id}/events/{event_id}"
-    requests.delete(url, headers={"Authorization": f"Bearer {tokens['gcp']}"}, timeout=10)
-    
-    # Delete session
-    url = f"https://firestore.googleapis.com/v1/projects/{CONFIG['PROJECT_ID']}/databases/(default)/documents/devices/{CONFIG['DEVICE_ID']}/sessions/{session_id}"
-    requests.delete(url, headers={"Authorization": f"Bearer {tokens['gcp']}"}, timeout=10)
-    
-    # Delete device
-    url = f"https://firestore.googleapis.com/v1/projects/{CONFIG['PROJECT_ID']}/databases/(default)/documents/devices/{CONFIG['DEVICE_ID']}"
-    requests.delete(url, headers={"Authorization": f"Bearer {tokens['gcp']}"}, timeout=10)
-    
-    print("   Cleaned up test documents")
+    # The device, its sessions and their events, in one batched recursive delete
+    firestore = FirestoreRest(requests.Session(), "https://firestore.googleapis.com", CONFIG['PROJECT_ID'], tokens['gcp'])
+    deleted = firestore.delete_tree(f"devices/{CONFIG['DEVICE_ID']}")
+    print(f"   Cleaned up {deleted} test documents")
     return True
 
-test_step("Step 9: Clean Up Test Data", cleanup_test_data)
+test_step("Step 7: Clean Up Test Data", cleanup_test_data)
 
 # SUMMARY
 print("\n" + "=" * 70)
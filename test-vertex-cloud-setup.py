@@ -10,6 +10,8 @@ import base64
 import time
 from datetime import datetime
 
+from validation.streaming import read_stream
+
 # Configuration for csci-468209 deployment
 CONFIG = {
     "API_GATEWAY_URL": "https://csci-gw-5ks9avkc.ue.gateway.dev",
@@ -328,38 +330,29 @@ def test_vertex_ai_gemini():
         }
     }
     
-    response = requests.post(gemini_url, headers=headers, json=request_data, timeout=30)
-    
-    if response.status_code == 200:
-        # Parse streaming response
-        response_text = ""
-        lines = response.text.strip().split('\n')
-        for line in lines:
-            if line.strip():
-                try:
-                    chunk = json.loads(line)
-                    if 'candidates' in chunk and chunk['candidates']:
-                        content = chunk['candidates'][0].get('content', {})
-                        parts = content.get('parts', [])
-                        for part in parts:
-                            if 'text' in part:
-                                response_text += part['text']
-                except json.JSONDecodeError:
-                    continue
-        
-        if response_text:
-            print(f"   Gemini response: {response_text[:200]}...")
-            return True
-        else:
-            print("   Gemini API responded but no text content found")
+    started = time.perf_counter()
+    with requests.post(gemini_url, headers=headers, json=request_data, timeout=30, stream=True) as response:
+        if response.status_code == 200:
+            # Parse chunks as they arrive so first-token latency is visible
+            result = read_stream(response, started)
+            timings = result.timings.as_dict()
+            print(f"   TTFB: {timings['time_to_first_byte_ms']}ms, "
+                  f"TTFT: {timings['time_to_first_token_ms']}ms, "
+                  f"total: {timings['total_ms']}ms over {timings['chunks']} chunks")
+
+            if result.text:
+                print(f"   Gemini response: {result.text[:200]}...")
+                return True
+            else:
+                print("   Gemini API responded but no text content found")
+                return False
+        elif response.status_code == 403:
+            error_data = response.json() if response.headers.get('content-type', '').startswith('application/json') else {}
+            print(f"   ⚠️  Permission denied - check Vertex AI API permissions")
+            print(f"   Error: {error_data}")
             return False
-    elif response.status_code == 403:
-        error_data = response.json() if response.headers.get('content-type', '').startswith('application/json') else {}
-        print(f"   ⚠️  Permission denied - check Vertex AI API permissions")
-        print(f"   Error: {error_data}")
-        return False
-    else:
-        response.raise_for_status()
+        else:
+            response.raise_for_status()
 
 gemini_result, success = test_step("Step 7: Vertex AI Gemini API", test_vertex_ai_gemini, critical=False)
 test_results['passed' if success else 'failed'] += 1
@@ -1,11 +1,20 @@
 #!/usr/bin/env python3
 """
 Enhanced Vertex AI region testing for csci-468209
+Probes every region x model cell concurrently with several samples per cell and
+reports availability, time to first token, total latency p50/p95 and output
+tokens/sec, as a table and as JSON, plus the fastest serving region per model.
 """
+import argparse
 import json
+import math
 import requests
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
 
+from validation.streaming import StreamParseError, read_stream
+
 # Get tokens from the main validation
 CONFIG = {
     "API_GATEWAY_URL": "https://csci-gw-5ks9avkc.ue.gateway.dev",
@@ -15,6 +24,37 @@ CONFIG = {
     "DEVICE_ID": f"test-device-{datetime.now().strftime('%Y%m%d-%H%M%S')}"
 }
 
+# Test different regions
+REGIONS = [
+    'us-east1',
+    'us-central1',
+    'us-west1',
+    'us-west4',
+    'europe-west1',
+    'asia-northeast1'
+]
+
+MODELS = [
+    'gemini-1.5-flash',
+    'gemini-1.5-pro',
+    'gemini-pro',
+    'gemini-pro-vision'
+]
+
+PROBE_REQUEST = {
+    "contents": [
+        {
+            "role": "user",
+            "parts": [{"text": "Say 'Hello from Vertex AI'"}]
+        }
+    ],
+    "generation_config": {
+        "temperature": 0.1,
+        "maxOutputTokens": 50
+    }
+}
+
+
 def get_tokens():
     """Get fresh tokens for testing"""
     # Get custom token
@@ -28,7 +68,7 @@ def get_tokens():
         timeout=30
     )
     custom_token = response.json()["firebase_custom_token"]
-    
+
     # Exchange for ID token
     response = requests.post(
         f"https://identitytoolkit.googleapis.com/v1/accounts:signInWithCustomToken?key={CONFIG['FIREBASE_API_KEY']}",
@@ -36,7 +76,7 @@ def get_tokens():
         timeout=30
     )
     id_token = response.json()["idToken"]
-    
+
     # Get GCP token
     response = requests.post(
         f"{CONFIG['API_GATEWAY_URL']}/gcp-token/vend",
@@ -48,109 +88,169 @@ def get_tokens():
         timeout=30
     )
     gcp_token = response.json()["gcp_access_token"]
-    
+
     return gcp_token
 
-print("🧪 Enhanced Vertex AI Region Testing")
-print("=" * 50)
 
-gcp_token = get_tokens()
-print(f"✅ Got fresh GCP token: {gcp_token[:50]}...")
+def probe(session, gcp_token, region, model, timeout):
+    """Send one streaming request and time it"""
+    url = f"https://{region}-aiplatform.googleapis.com/v1/projects/{CONFIG['PROJECT_ID']}/locations/{region}/publishers/google/models/{model}:streamGenerateContent"
+    headers = {
+        "Authorization": f"Bearer {gcp_token}",
+        "Content-Type": "application/json"
+    }
+    sample = {'region': region, 'model': model, 'ok': False, 'status': None,
+              'ttft': None, 'total': None, 'output_tokens': 0, 'error': None}
 
-# Test different regions
-regions_to_test = [
-    'us-east1',
-    'us-central1', 
-    'us-west1',
-    'us-west4',
-    'europe-west1',
-    'asia-northeast1'
-]
+    started = time.perf_counter()
+    try:
+        with session.post(url, headers=headers, json=PROBE_REQUEST, timeout=timeout, stream=True) as response:
+            sample['status'] = response.status_code
+            if response.status_code != 200:
+                sample['total'] = time.perf_counter() - started
+                try:
+                    error = response.json()
+                    if isinstance(error, list):
+                        error = error[0] if error else {}
+                    sample['error'] = error.get('error', {}).get('message', f"HTTP {response.status_code}")
+                except (ValueError, AttributeError):
+                    sample['error'] = f"HTTP {response.status_code}"
+                return sample
 
-models_to_test = [
-    'gemini-1.5-flash',
-    'gemini-1.5-pro',
-    'gemini-pro',
-    'gemini-pro-vision'
-]
+            result = read_stream(response, started)
+            sample['ttft'] = result.timings.first_token
+            sample['total'] = result.timings.total
+            sample['ok'] = any('candidates' in c for c in result.chunks)
+            sample['output_tokens'] = result.usage.get('candidatesTokenCount', 0)
+    except (requests.exceptions.RequestException, StreamParseError) as e:
+        sample['total'] = time.perf_counter() - started
+        sample['error'] = str(e)[:120]
+    return sample
 
-print(f"\n🌍 Testing {len(regions_to_test)} regions with {len(models_to_test)} models...")
 
-for region in regions_to_test:
-    print(f"\n📍 Testing region: {region}")
-    
-    for model in models_to_test:
-        url = f"https://{region}-aiplatform.googleapis.com/v1/projects/{CONFIG['PROJECT_ID']}/locations/{region}/publishers/google/models/{model}:streamGenerateContent"
-        
-        headers = {
-            "Authorization": f"Bearer {gcp_token}",
-            "Content-Type": "application/json"
-        }
-        
-        data = {
-            "contents": [
-                {
-                    "role": "user",
-                    "parts": [{"text": "Say 'Hello from Vertex AI'"}]
-                }
-            ],
-            "generation_config": {
-                "temperature": 0.1,
-                "maxOutputTokens": 50
-            }
+def percentile(values, pct):
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = max(0, math.ceil(len(ordered) * pct / 100) - 1)
+    return ordered[index]
+
+
+def summarize(samples):
+    """Aggregate samples of one region x model cell"""
+    ok = [s for s in samples if s['ok']]
+    totals = [s['total'] for s in ok]
+    ttfts = [s['ttft'] for s in ok if s['ttft'] is not None]
+    rates = [s['output_tokens'] / (s['total'] - s['ttft'])
+             for s in ok if s['ttft'] is not None and s['output_tokens'] and s['total'] > s['ttft']]
+    errors = sorted({s['error'] or f"HTTP {s['status']}" for s in samples if not s['ok']})
+    return {
+        'samples': len(samples),
+        'availability': len(ok) / len(samples) if samples else 0.0,
+        'ttft_p50': percentile(ttfts, 50),
+        'total_p50': percentile(totals, 50),
+        'total_p95': percentile(totals, 95),
+        'tokens_per_sec': sum(rates) / len(rates) if rates else None,
+        'errors': errors
+    }
+
+
+def fmt(seconds):
+    return f"{seconds * 1000:7.0f}" if seconds is not None else "      -"
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Probe Vertex AI regions x models concurrently')
+    parser.add_argument('--samples', type=int, default=3, help='requests per region/model cell')
+    parser.add_argument('--workers', type=int, default=12, help='concurrent requests')
+    parser.add_argument('--timeout', type=float, default=15.0, help='per-request timeout (s)')
+    parser.add_argument('--regions', nargs='*', default=REGIONS)
+    parser.add_argument('--models', nargs='*', default=MODELS)
+    parser.add_argument('--json', dest='json_path', help='write the matrix as JSON to this file')
+    args = parser.parse_args()
+
+    print("🧪 Enhanced Vertex AI Region Testing")
+    print("=" * 78)
+
+    gcp_token = get_tokens()
+    print(f"✅ Got fresh GCP token: {gcp_token[:50]}...")
+
+    cells = [(region, model) for region in args.regions for model in args.models]
+    print(f"\n🌍 Probing {len(args.regions)} regions x {len(args.models)} models, "
+          f"{args.samples} samples each, {args.workers} at a time...")
+
+    started = time.perf_counter()
+    samples = {cell: [] for cell in cells}
+    session = requests.Session()
+    session.mount('https://', requests.adapters.HTTPAdapter(pool_connections=len(args.regions),
+                                                            pool_maxsize=args.workers))
+    with ThreadPoolExecutor(max_workers=args.workers) as pool:
+        futures = [pool.submit(probe, session, gcp_token, region, model, args.timeout)
+                   for region, model in cells for _ in range(args.samples)]
+        for future in as_completed(futures):
+            sample = future.result()
+            samples[(sample['region'], sample['model'])].append(sample)
+    elapsed = time.perf_counter() - started
+
+    matrix = {f"{region}/{model}": dict(summarize(samples[(region, model)]), region=region, model=model)
+              for region, model in cells}
+
+    print(f"\n{'region':<16} {'model':<18} {'avail':>6} {'ttft50':>7} {'p50':>7} {'p95':>7} {'tok/s':>6}  (ms)")
+    print("-" * 78)
+    for region, model in cells:
+        cell = matrix[f"{region}/{model}"]
+        rate = f"{cell['tokens_per_sec']:6.1f}" if cell['tokens_per_sec'] else "     -"
+        mark = "✅" if cell['availability'] == 1 else ("⚠️ " if cell['availability'] > 0 else "❌")
+        print(f"{region:<16} {model:<18} {cell['availability']:6.0%} {fmt(cell['ttft_p50'])} "
+              f"{fmt(cell['total_p50'])} {fmt(cell['total_p95'])} {rate} {mark}")
+        if cell['availability'] < 1 and cell['errors']:
+            print(f"{'':<35}{'; '.join(e[:60] for e in cell['errors'])}")
+
+    # Lowest-latency fully available region per model
+    best = {}
+    for model in args.models:
+        serving = [matrix[f"{region}/{model}"] for region in args.regions
+                   if matrix[f"{region}/{model}"]['availability'] == 1]
+        if serving:
+            best[model] = min(serving, key=lambda cell: cell['total_p50'])['region']
+
+    print(f"\n🏁 Fastest serving region per model:")
+    for model in args.models:
+        print(f"   • {model}: {best.get(model, 'not available in any tested region')}")
+
+    print(f"\n⏱️  Matrix completed in {elapsed:.1f}s")
+
+    if args.json_path:
+        report = {
+            'timestamp': datetime.utcnow().isoformat() + 'Z',
+            'project_id': CONFIG['PROJECT_ID'],
+            'samples_per_cell': args.samples,
+            'elapsed_seconds': elapsed,
+            'cells': list(matrix.values()),
+            'best_region': best
         }
-        
+        with open(args.json_path, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"💾 Matrix saved to: {args.json_path}")
+
+    if not best:
+        print(f"\n🔍 Checking Vertex AI API status...")
         try:
-            response = requests.post(url, headers=headers, json=data, timeout=15)
-            
+            api_check_url = f"https://serviceusage.googleapis.com/v1/projects/{CONFIG['PROJECT_ID']}/services/aiplatform.googleapis.com"
+            response = requests.get(api_check_url, headers={"Authorization": f"Bearer {gcp_token}"}, timeout=15)
             if response.status_code == 200:
-                print(f"   ✅ {model}: Working")
-                # Try to extract response
-                lines = response.text.strip().split('\n')
-                for line in lines[:2]:  # Check first 2 lines
-                    if line.strip():
-                        try:
-                            chunk = json.loads(line)
-                            if 'candidates' in chunk:
-                                print(f"      Response received")
-                                break
-                        except:
-                            pass
-            elif response.status_code == 404:
-                print(f"   ❌ {model}: Not found")
-            elif response.status_code == 403:
-                print(f"   ❌ {model}: Permission denied")
-            elif response.status_code == 400:
-                error_info = response.json() if response.headers.get('content-type', '').startswith('application/json') else {}
-                print(f"   ❌ {model}: Bad request - {error_info.get('error', {}).get('message', 'Unknown error')}")
+                print(f"   Vertex AI API state: {response.json().get('state', 'UNKNOWN')}")
             else:
-                print(f"   ❌ {model}: HTTP {response.status_code}")
-                
+                print(f"   Could not check API status: {response.status_code}")
         except Exception as e:
-            print(f"   ❌ {model}: {str(e)[:50]}...")
-
-print(f"\n🔍 Checking Vertex AI API status...")
-try:
-    # Check if Vertex AI API is enabled
-    api_check_url = f"https://serviceusage.googleapis.com/v1/projects/{CONFIG['PROJECT_ID']}/services/aiplatform.googleapis.com"
-    response = requests.get(api_check_url, headers={"Authorization": f"Bearer {gcp_token}"}, timeout=15)
-    
-    if response.status_code == 200:
-        service_info = response.json()
-        state = service_info.get('state', 'UNKNOWN')
-        print(f"   Vertex AI API state: {state}")
-    else:
-        print(f"   Could not check API status: {response.status_code}")
-        
-except Exception as e:
-    print(f"   Error checking API: {e}")
-
-print(f"\n📋 Summary:")
-print(f"   • Project: {CONFIG['PROJECT_ID']}")
-print(f"   • Tested {len(regions_to_test)} regions")
-print(f"   • Tested {len(models_to_test)} models per region")
-print(f"   • If all failed, likely issues:")
-print(f"     - Vertex AI API not enabled")
-print(f"     - Service account lacks aiplatform.endpoints.predict permission")
-print(f"     - Region restrictions on the project")
-print("=" * 50)
\ No newline at end of file
+            print(f"   Error checking API: {e}")
+
+        print(f"\n📋 No model was served anywhere. Likely issues:")
+        print(f"     - Vertex AI API not enabled")
+        print(f"     - Service account lacks aiplatform.endpoints.predict permission")
+        print(f"     - Region restrictions on the project")
+    print("=" * 78)
+
+
+if __name__ == '__main__':
+    main()
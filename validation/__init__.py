@@ -0,0 +1,22 @@
+"""
+Deployment validation for Anava Vision
+Replaces the per-deployment test-*.py scripts with one package: tokens are
+acquired once, independent checks run concurrently as a dependency graph and
+every run produces a machine-readable report with per-step timings.
+
+Usage: python -m validation run --config deployment.json
+       python -m validation fleet --deployments deployments.json
+       python -m validation load --standins --cameras 500 --pattern ramp
+       python -m validation uploads --standins --size-mb 256 --parallel 1,8
+"""
+
+from .config import load_config
+from .runner import Step, ValidationContext, run_steps
+from .checks import DEFAULT_STEPS
+from .fleet import load_deployments, validate_fleet
+from .load import run_load
+from .uploads import ResumableUpload, parallel_composite_upload
+
+__all__ = ['load_config', 'Step', 'ValidationContext', 'run_steps', 'DEFAULT_STEPS',
+           'load_deployments', 'validate_fleet', 'run_load', 'ResumableUpload',
+           'parallel_composite_upload']
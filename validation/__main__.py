@@ -0,0 +1,218 @@
+"""
+Command line entry point
+
+    python -m validation run --config deployment.json [--report report.json]
+    python -m validation fleet --deployments deployments.json [--rerun-failed fleet-report.json]
+    python -m validation load (--config deployment.json | --standins) --cameras 500 --pattern ramp
+        [--standin-latency gemini=lognormal:0.8,0.4 --standin-quota gemini=60/60]
+    python -m validation uploads (--config deployment.json | --standins) --size-mb 256
+        --chunk-mb 8,32 --parallel 1,8
+"""
+
+import argparse
+import json
+import sys
+from datetime import datetime
+
+from .checks import DEFAULT_STEPS
+from .config import load_config, normalize_config
+from .fleet import HEALTHY, load_deployments, print_matrix, validate_fleet
+from .load import PATTERNS, print_load_report, run_load
+from .runner import PASS, SKIP, ValidationContext, run_steps
+from .standins import StandinServer, add_behaviour_arguments, parse_behaviours
+from .tokens import acquire_tokens
+from .uploads import MIB, run_benchmark
+
+
+def print_report(report: dict):
+    print("\n" + "=" * 80)
+    print("📊 DEPLOYMENT VALIDATION REPORT")
+    print("=" * 80)
+    print(f"   Project: {report['project_id']}")
+    print(f"   Tests Passed: {report['tests_passed']}/{report['total_tests']} "
+          f"({report['success_rate']:.1f}%), skipped: {report['tests_skipped']}")
+    print(f"   Wall time: {report['elapsed_seconds']:.2f}s "
+          f"(steps sum to {report['sequential_seconds']:.2f}s)")
+    print(f"\n   {'step':<28} {'status':<6} {'start':>7} {'duration':>9}")
+    for detail in report['details']:
+        emoji = "✅" if detail['status'] == PASS else ("⏭️ " if detail['status'] == SKIP else "❌")
+        print(f"   {detail['step']:<28} {detail['status']:<6} "
+              f"{detail.get('started_at', 0):7.2f} {detail['duration']:8.2f}s {emoji}")
+        if detail['status'] != PASS and detail.get('error'):
+            print(f"      {detail['error'][:120]}")
+    print("=" * 80)
+
+
+def cmd_run(args) -> int:
+    config = load_config(args.config)
+    print(f"🔍 Validating {config['PROJECT_ID']} via {config['API_GATEWAY_URL']}")
+    ctx = ValidationContext(config, log=print if args.verbose else (lambda _: None))
+    report = run_steps(DEFAULT_STEPS, ctx, max_workers=args.workers)
+    report['configuration'] = {
+        'api_gateway_url': config['API_GATEWAY_URL'],
+        'region': config['REGION'],
+        'storage_bucket': config['GCS_BUCKET'],
+    }
+
+    print_report(report)
+    report_path = args.report or (
+        f"validation-{config['PROJECT_ID']}-{datetime.now().strftime('%Y%m%d-%H%M%S')}.json")
+    with open(report_path, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"💾 Report saved to: {report_path}")
+    return 0 if report['tests_failed'] == 0 and report['tests_skipped'] == 0 else 1
+
+
+def cmd_fleet(args) -> int:
+    deployments = load_deployments(args.deployments)
+    if args.projects:
+        wanted = set(args.projects.split(','))
+        deployments = [d for d in deployments if d['NAME'] in wanted or d.get('PROJECT_ID') in wanted]
+    previous = None
+    if args.rerun_failed:
+        with open(args.rerun_failed) as f:
+            previous = json.load(f)
+
+    print(f"🔍 Validating {len(deployments)} deployments "
+          f"({args.projects_at_once} at once, {args.concurrency} concurrent checks)")
+    report = validate_fleet(deployments, max_concurrent_checks=args.concurrency,
+                            max_projects=args.projects_at_once,
+                            workers_per_project=args.workers, previous=previous)
+
+    print()
+    print_matrix(report)
+    print(f"\n   Health: {report['health_counts']}, wall time {report['elapsed_seconds']:.2f}s, "
+          f"{report['projects_carried_over']} carried over")
+    report_path = args.report or f"fleet-validation-{datetime.now().strftime('%Y%m%d-%H%M%S')}.json"
+    with open(report_path, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"💾 Report saved to: {report_path}")
+    return 0 if all(p['health'] == HEALTHY for p in report['projects']) else 1
+
+
+def start_standins(args):
+    """(stand-in server, config) for --standins, else (None, config from --config)"""
+    if not args.standins:
+        return None, load_config(args.config)
+    behaviours = parse_behaviours(args.standin_latency, args.standin_errors, args.standin_quota)
+    standins = StandinServer(behaviours=behaviours, seed=args.standin_seed).start()
+    print(f"🧪 Stand-ins listening on {standins.url}")
+    return standins, normalize_config(standins.config())
+
+
+def cmd_load(args) -> int:
+    try:
+        standins, config = start_standins(args)
+    except ValueError as e:
+        print(f"❌ {e}")
+        return 2
+    try:
+        report = run_load(config, cameras=args.cameras, pattern=args.pattern, duration=args.duration,
+                          ramp_seconds=args.ramp, interval=args.interval, cleanup=not args.no_cleanup)
+    finally:
+        if standins:
+            standins.stop()
+
+    print_load_report(report)
+    report_path = args.report or (
+        f"load-{config['PROJECT_ID']}-{datetime.now().strftime('%Y%m%d-%H%M%S')}.json")
+    with open(report_path, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"💾 Report saved to: {report_path}")
+    return 0 if report['cycles_failed'] == 0 and report['cycles_completed'] else 1
+
+
+def cmd_uploads(args) -> int:
+    try:
+        standins, config = start_standins(args)
+        chunk_sizes = [int(float(mb) * MIB) for mb in args.chunk_mb.split(',')]
+        parallelism = [int(n) for n in args.parallel.split(',')]
+    except ValueError as e:
+        print(f"❌ {e}")
+        return 2
+    try:
+        ctx = ValidationContext(config)
+        token = acquire_tokens(ctx)
+        bucket = args.bucket or config['GCS_BUCKET']
+        print(f"📤 Uploading {args.size_mb} MB to gs://{bucket} "
+              f"(chunks {args.chunk_mb} MB, parallelism {args.parallel})")
+        report = run_benchmark(config['STORAGE_URL'], bucket, token, int(args.size_mb * MIB),
+                               chunk_sizes, parallelism)
+    finally:
+        if standins:
+            standins.stop()
+
+    if report['best']:
+        best = report['best']
+        print(f"\n   Best: {best['mode']} with {best['chunk_size_kib']} KiB chunks "
+              f"x{best['parallel']} at {best['mb_per_second']:.2f} MB/s")
+    report_path = args.report or (
+        f"uploads-{config['PROJECT_ID']}-{datetime.now().strftime('%Y%m%d-%H%M%S')}.json")
+    with open(report_path, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"💾 Report saved to: {report_path}")
+    return 0 if all('error' not in row for row in report['results']) else 1
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog='python -m validation',
+                                     description='Anava deployment validation')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    run = subparsers.add_parser('run', help='validate one deployment')
+    run.add_argument('--config', required=True, help='deployment config JSON')
+    run.add_argument('--report', help='where to write the JSON report')
+    run.add_argument('--workers', type=int, default=8)
+    run.add_argument('--verbose', action='store_true', help='log steps as they start and finish')
+    run.set_defaults(func=cmd_run)
+
+    fleet = subparsers.add_parser('fleet', help='validate many deployments in parallel')
+    fleet.add_argument('--deployments', required=True, help='JSON list of deployment configs')
+    fleet.add_argument('--report', help='where to write the fleet JSON report')
+    fleet.add_argument('--projects', help='comma separated names or project IDs to validate')
+    fleet.add_argument('--concurrency', type=int, default=32,
+                       help='max checks in flight across all projects')
+    fleet.add_argument('--projects-at-once', type=int, default=16)
+    fleet.add_argument('--workers', type=int, default=8, help='max concurrent checks per project')
+    fleet.add_argument('--rerun-failed', metavar='REPORT',
+                       help='previous fleet report; healthy projects are carried over')
+    fleet.set_defaults(func=cmd_fleet)
+
+    load = subparsers.add_parser('load', help='simulate many cameras against one deployment')
+    target = load.add_mutually_exclusive_group(required=True)
+    target.add_argument('--config', help='deployment config JSON')
+    target.add_argument('--standins', action='store_true', help='run against local stand-in services')
+    load.add_argument('--cameras', type=int, default=10)
+    load.add_argument('--pattern', choices=PATTERNS, default='steady', help='camera arrival pattern')
+    load.add_argument('--duration', type=float, default=60.0, help='seconds the run lasts')
+    load.add_argument('--ramp', type=float, help='seconds over which cameras arrive (default duration/2)')
+    load.add_argument('--interval', type=float, default=5.0, help='seconds between a camera\'s cycles')
+    load.add_argument('--no-cleanup', action='store_true', help='keep the documents cameras wrote')
+    load.add_argument('--report', help='where to write the JSON report')
+    add_behaviour_arguments(load, prefix='standin-')
+    load.add_argument('--standin-seed', type=int)
+    load.set_defaults(func=cmd_load)
+
+    uploads = subparsers.add_parser('uploads', help='benchmark resumable and parallel composite uploads')
+    target = uploads.add_mutually_exclusive_group(required=True)
+    target.add_argument('--config', help='deployment config JSON')
+    target.add_argument('--standins', action='store_true', help='run against local stand-in services')
+    uploads.add_argument('--bucket', help='bucket to upload to (default GCS_BUCKET)')
+    uploads.add_argument('--size-mb', type=float, default=64.0, help='size of the test file')
+    uploads.add_argument('--chunk-mb', default='8', help='comma separated resumable chunk sizes')
+    uploads.add_argument('--parallel', default='1,8',
+                         help='comma separated part counts; 1 is a plain resumable upload')
+    uploads.add_argument('--report', help='where to write the JSON report')
+    add_behaviour_arguments(uploads, prefix='standin-')
+    uploads.add_argument('--standin-seed', type=int)
+    uploads.set_defaults(func=cmd_uploads)
+    return parser
+
+
+def main(argv=None) -> int:
+    args = build_parser().parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
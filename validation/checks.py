@@ -0,0 +1,174 @@
+"""
+Deployment checks
+Firestore, Cloud Storage, Vertex AI/Gemini and Firebase config checks ported
+from test-vertex-cloud-setup.py and test-full-camera-flow.py. DEFAULT_STEPS
+wires them into a graph: the token chain runs first, then every independent
+check runs concurrently, and cleanup waits only for the steps that create data.
+"""
+
+import time
+from datetime import datetime
+
+import requests
+
+from .firestore_rest import firestore_for
+from .runner import Step, ValidationContext
+from .streaming import read_stream
+from .tokens import get_custom_token, get_gcp_token, get_id_token
+
+TEST_IMAGE_BASE64 = "iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR42mP8/5+hHgAHggJ/PchI7wAAAABJRU5ErkJggg=="
+
+
+def _firestore_doc_url(config: dict, path: str) -> str:
+    return (f"{config['FIRESTORE_URL']}/v1/projects/{config['PROJECT_ID']}"
+            f"/databases/(default)/documents/{path}")
+
+
+def _auth_headers(ctx: ValidationContext) -> dict:
+    return {
+        "Authorization": f"Bearer {ctx.gcp_token}",
+        "Content-Type": "application/json"
+    }
+
+
+def check_gateway_health(ctx: ValidationContext) -> bool:
+    """Any response from device-auth means the gateway is routing"""
+    config = ctx.config
+    response = ctx.session.post(
+        f"{config['API_GATEWAY_URL']}/device-auth/initiate",
+        headers={
+            "x-api-key": config['API_GATEWAY_KEY'],
+            "Content-Type": "application/json"
+        },
+        json={"device_id": "health-check"},
+        timeout=15
+    )
+    if response.status_code not in (200, 400, 401):
+        raise Exception(f"Gateway returned HTTP {response.status_code}")
+    return True
+
+
+def check_firestore(ctx: ValidationContext) -> str:
+    """Write the test device, session and event in one commit and read the device back"""
+    config = ctx.config
+    device_path = f"devices/{config['DEVICE_ID']}"
+    session_path = f"{device_path}/sessions/validation-session"
+    now = datetime.utcnow()
+    firestore = firestore_for(ctx)
+    firestore.write_tree({
+        device_path: {
+            "deviceId": config['DEVICE_ID'],
+            "testTimestamp": now,
+            "status": "validation_test",
+            "model": "VALIDATION-DEVICE",
+            "project": config['PROJECT_ID'],
+            "testType": "deployment_validation"
+        },
+        session_path: {"deviceId": config['DEVICE_ID'], "startTime": now, "status": "active"},
+        f"{session_path}/events/validation-event": {
+            "deviceId": config['DEVICE_ID'], "eventType": "validation_test",
+            "timestamp": now, "confidence": 0.95
+        }
+    })
+
+    response = ctx.session.get(_firestore_doc_url(config, device_path), headers=_auth_headers(ctx), timeout=30)
+    response.raise_for_status()
+    if not response.json().get('fields'):
+        raise Exception("Read back document has no fields")
+    return firestore.name(device_path)
+
+
+def check_cloud_storage(ctx: ValidationContext) -> bool:
+    """List the bucket, upload a small object and delete it"""
+    config = ctx.config
+    bucket = config['GCS_BUCKET']
+    headers = {"Authorization": f"Bearer {ctx.gcp_token}"}
+
+    response = ctx.session.get(f"{config['STORAGE_URL']}/storage/v1/b/{bucket}/o",
+                               headers=headers, params={'maxResults': 1}, timeout=30)
+    response.raise_for_status()
+
+    test_filename = f"validation-test-{config['DEVICE_ID']}.txt"
+    response = ctx.session.post(
+        f"{config['STORAGE_URL']}/upload/storage/v1/b/{bucket}/o",
+        params={'uploadType': 'media', 'name': test_filename},
+        headers={**headers, "Content-Type": "text/plain"},
+        data=f"Deployment validation test\nProject: {config['PROJECT_ID']}",
+        timeout=30
+    )
+    response.raise_for_status()
+
+    ctx.session.delete(f"{config['STORAGE_URL']}/storage/v1/b/{bucket}/o/{test_filename}",
+                       headers=headers, timeout=10)
+    return True
+
+
+def check_gemini(ctx: ValidationContext) -> str:
+    """Stream a short image analysis from Vertex AI Gemini, parsing chunks as they arrive"""
+    config = ctx.config
+    region = config['REGION']
+    url = (f"{config['VERTEX_URL'].format(region=region)}/v1/projects/{config['PROJECT_ID']}"
+           f"/locations/{region}/publishers/google/models/{config['MODEL']}:streamGenerateContent")
+    request_data = {
+        "contents": [{
+            "role": "user",
+            "parts": [
+                {"text": "What do you see in this image? Keep your response very brief."},
+                {"inline_data": {"mime_type": "image/png", "data": TEST_IMAGE_BASE64}}
+            ]
+        }],
+        "generation_config": {"temperature": 0.1, "maxOutputTokens": 100}
+    }
+    started = time.perf_counter()
+    with ctx.session.post(url, headers=_auth_headers(ctx), json=request_data, timeout=30,
+                          stream=True) as response:
+        if response.status_code == 403:
+            raise requests.HTTPError(f"Permission denied - check Vertex AI permissions: {response.text[:200]}",
+                                     response=response)
+        response.raise_for_status()
+        result = read_stream(response, started)
+
+    timings = result.timings.as_dict()
+    ctx.set_result('gemini_stream', timings)
+    ctx.log(f"   Gemini TTFT {timings['time_to_first_token_ms']}ms over {timings['chunks']} chunks")
+    if not result.text:
+        raise Exception("Gemini responded without text content")
+    return result.text
+
+
+def check_firebase_config(ctx: ValidationContext) -> bool:
+    """Validate Firebase configuration structure"""
+    config = ctx.config
+    firebase_config = config.get('FIREBASE_CONFIG')
+    if not firebase_config:
+        raise Exception("FIREBASE_CONFIG not provided")
+
+    required_fields = ['apiKey', 'authDomain', 'projectId', 'storageBucket', 'messagingSenderId', 'appId']
+    missing_fields = [field for field in required_fields if not firebase_config.get(field)]
+    if missing_fields:
+        raise Exception(f"Missing required Firebase config fields: {missing_fields}")
+    if firebase_config['projectId'] != config['PROJECT_ID']:
+        raise Exception(f"Project ID mismatch: {firebase_config['projectId']} vs {config['PROJECT_ID']}")
+    if not firebase_config['storageBucket'].endswith(('.app', '.appspot.com')):
+        raise Exception(f"Invalid storage bucket format: {firebase_config['storageBucket']}")
+    return True
+
+
+def cleanup_test_data(ctx: ValidationContext) -> int:
+    """Delete the test device document and everything beneath it"""
+    return firestore_for(ctx).delete_tree(f"devices/{ctx.config['DEVICE_ID']}")
+
+
+DEFAULT_STEPS = [
+    Step('gateway_health', check_gateway_health, description='API Gateway Health'),
+    Step('custom_token', get_custom_token, critical=True, description='Custom Token Generation'),
+    Step('id_token', get_id_token, deps=['custom_token'], critical=True,
+         description='ID Token Exchange'),
+    Step('gcp_token', get_gcp_token, deps=['id_token'], critical=True,
+         description='GCP Token Vending'),
+    Step('firestore', check_firestore, deps=['gcp_token'], description='Firestore Access'),
+    Step('cloud_storage', check_cloud_storage, deps=['gcp_token'], description='Cloud Storage'),
+    Step('gemini', check_gemini, deps=['gcp_token'], description='Vertex AI/Gemini'),
+    Step('firebase_config', check_firebase_config, description='Firebase Config'),
+    Step('cleanup', cleanup_test_data, deps=['firestore'], description='Cleanup Test Data'),
+]
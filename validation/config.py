@@ -0,0 +1,50 @@
+"""
+Deployment configuration for validation runs
+Configs use the same keys as the CONFIG dicts in the old test scripts, so a
+deployment's values can be moved into a JSON file unchanged.
+"""
+
+import json
+from datetime import datetime
+
+REQUIRED_KEYS = ['API_GATEWAY_URL', 'API_GATEWAY_KEY', 'FIREBASE_API_KEY', 'PROJECT_ID']
+
+# Service base URLs; overridable to point validation at local stand-ins
+DEFAULT_ENDPOINTS = {
+    'IDENTITY_TOOLKIT_URL': 'https://identitytoolkit.googleapis.com',
+    'FIRESTORE_URL': 'https://firestore.googleapis.com',
+    'STORAGE_URL': 'https://storage.googleapis.com',
+    'VERTEX_URL': 'https://{region}-aiplatform.googleapis.com',
+}
+
+
+class ConfigError(ValueError):
+    """Deployment config is missing required values"""
+
+
+def normalize_config(config: dict) -> dict:
+    """Fill defaults and accept the key spellings used by the older scripts"""
+    config = dict(config)
+    if 'API_GATEWAY_KEY' not in config and 'API_KEY' in config:
+        config['API_GATEWAY_KEY'] = config['API_KEY']
+
+    missing = [key for key in REQUIRED_KEYS if not config.get(key)]
+    if missing:
+        raise ConfigError(f"Missing required config keys: {missing}")
+
+    config['API_GATEWAY_URL'] = config['API_GATEWAY_URL'].rstrip('/')
+    config.setdefault('REGION', 'us-central1')
+    config.setdefault('MODEL', 'gemini-1.5-flash')
+    firebase_config = config.get('FIREBASE_CONFIG') or {}
+    config.setdefault('GCS_BUCKET', firebase_config.get('storageBucket')
+                      or f"{config['PROJECT_ID']}.firebasestorage.app")
+    config.setdefault('DEVICE_ID', f"validation-{datetime.now().strftime('%Y%m%d-%H%M%S')}")
+    for key, value in DEFAULT_ENDPOINTS.items():
+        config.setdefault(key, value)
+    return config
+
+
+def load_config(path: str) -> dict:
+    """Load a deployment config from a JSON file"""
+    with open(path) as f:
+        return normalize_config(json.load(f))
@@ -0,0 +1,137 @@
+"""
+Fleet validation
+Validates many customer deployments at once. Each project gets its own
+context and HTTP session, so one broken deployment can't affect another; a
+semaphore shared by all runs bounds how many checks hit the network at once.
+Results are consolidated into a health and latency matrix, and a previous
+fleet report can be used to re-run only the projects that failed.
+"""
+
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+from typing import List, Optional
+
+import requests
+
+from .checks import DEFAULT_STEPS
+from .config import ConfigError, normalize_config
+from .runner import PASS, SKIP, ValidationContext, run_steps
+
+HEALTHY = 'healthy'
+DEGRADED = 'degraded'
+DOWN = 'down'
+INVALID = 'invalid_config'
+
+
+def load_deployments(path: str) -> List[dict]:
+    """Read a deployments file: a list of configs or {"deployments": [...]}"""
+    with open(path) as f:
+        data = json.load(f)
+    deployments = data.get('deployments', []) if isinstance(data, dict) else data
+    for deployment in deployments:
+        deployment.setdefault('NAME', deployment.get('PROJECT_ID', 'unnamed'))
+    return deployments
+
+
+def project_health(report: dict) -> str:
+    details = report.get('details', [])
+    if any(d['status'] != PASS and d.get('critical') for d in details):
+        return DOWN
+    if any(d['status'] != PASS for d in details):
+        return DEGRADED
+    return HEALTHY
+
+
+def validate_project(deployment: dict, gate: threading.Semaphore, workers: int) -> dict:
+    """Validate one deployment in isolation; never raises"""
+    name = deployment['NAME']
+    started = time.perf_counter()
+    try:
+        config = normalize_config(deployment)
+    except ConfigError as e:
+        return {'name': name, 'project_id': deployment.get('PROJECT_ID'),
+                'health': INVALID, 'error': str(e), 'elapsed_seconds': 0.0, 'details': []}
+
+    with requests.Session() as session:
+        ctx = ValidationContext(config, session=session, log=lambda _: None)
+        try:
+            report = run_steps(DEFAULT_STEPS, ctx, max_workers=workers, gate=gate)
+        except Exception as e:
+            return {'name': name, 'project_id': config['PROJECT_ID'], 'health': DOWN,
+                    'error': str(e)[:500], 'details': [],
+                    'elapsed_seconds': round(time.perf_counter() - started, 3)}
+
+    report['name'] = name
+    report['health'] = project_health(report)
+    return report
+
+
+def validate_fleet(deployments: List[dict], max_concurrent_checks: int = 32,
+                   max_projects: int = 16, workers_per_project: int = 8,
+                   previous: Optional[dict] = None, log=print) -> dict:
+    """Validate deployments concurrently, optionally only those that failed last time"""
+    carried = {}
+    if previous:
+        carried = {p['name']: dict(p, carried_over=True)
+                   for p in previous.get('projects', []) if p.get('health') == HEALTHY}
+    to_run = [d for d in deployments if d['NAME'] not in carried]
+
+    gate = threading.Semaphore(max_concurrent_checks)
+    results = {}
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max_projects) as pool:
+        futures = {pool.submit(validate_project, d, gate, workers_per_project): d['NAME']
+                   for d in to_run}
+        for future in as_completed(futures):
+            result = future.result()
+            results[result['name']] = result
+            log(f"   {'✅' if result['health'] == HEALTHY else '❌'} {result['name']}: "
+                f"{result['health']} ({result.get('elapsed_seconds', 0):.1f}s)")
+
+    projects = []
+    for deployment in deployments:
+        name = deployment['NAME']
+        if name in results:
+            projects.append(results[name])
+        elif name in carried:
+            projects.append(carried[name])
+
+    counts = {}
+    for project in projects:
+        counts[project['health']] = counts.get(project['health'], 0) + 1
+    return {
+        'timestamp': datetime.utcnow().isoformat() + 'Z',
+        'elapsed_seconds': round(time.perf_counter() - started, 3),
+        'projects_validated': len(results),
+        'projects_carried_over': len(projects) - len(results),
+        'health_counts': counts,
+        'step_names': [step.name for step in DEFAULT_STEPS],
+        'projects': projects
+    }
+
+
+def print_matrix(report: dict):
+    """Health and latency matrix: one row per project, one column per step"""
+    steps = report['step_names']
+    width = max([len(p['name']) for p in report['projects']] + [7])
+    header = f"{'project':<{width}} {'health':<14}" + ''.join(f" {s[:11]:>11}" for s in steps)
+    print(header)
+    print('-' * len(header))
+    for project in report['projects']:
+        by_name = {d['name']: d for d in project.get('details', [])}
+        cells = []
+        for step in steps:
+            detail = by_name.get(step)
+            if not detail:
+                cells.append(f" {'-':>11}")
+            elif detail['status'] == PASS:
+                cells.append(f" {detail['duration'] * 1000:>9.0f}ms")
+            else:
+                cells.append(f" {('SKIP' if detail['status'] == SKIP else 'FAIL'):>11}")
+        marker = ' (carried)' if project.get('carried_over') else ''
+        print(f"{project['name']:<{width}} {project['health']:<14}{''.join(cells)}{marker}")
+        if project.get('error'):
+            print(f"{'':<{width}}   {project['error'][:100]}")
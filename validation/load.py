@@ -0,0 +1,280 @@
+"""
+Load and soak testing
+Simulates N cameras running the flow from test-full-camera-flow.py: the token
+chain once per camera, then repeated cycles of device, session and event
+writes plus a Gemini call until the run ends. Cameras arrive in a steady,
+ramping or burst pattern. Every hop is timed separately so the report shows
+which service saturates first, along with error and 429 breakdowns.
+"""
+
+import math
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Dict, List
+
+import requests
+
+from .checks import _auth_headers, _firestore_doc_url, check_gemini
+from .firestore_rest import firestore_for
+from .runner import ValidationContext
+from .tokens import get_custom_token, get_gcp_token, get_id_token
+
+PATTERNS = ('steady', 'ramp', 'burst')
+AUTH_HOPS = ['custom_token', 'id_token', 'gcp_token']
+CYCLE_HOPS = ['firestore_device', 'firestore_session', 'firestore_event', 'gemini']
+# Not requests of their own: milestones within the Gemini stream
+STREAM_METRICS = ['gemini_ttfb', 'gemini_ttft']
+PERCENTILES = (50, 90, 95, 99)
+
+
+def arrival_offsets(cameras: int, pattern: str, window: float) -> List[float]:
+    """Start offsets in seconds for each camera"""
+    if pattern == 'burst' or cameras <= 1 or window <= 0:
+        return [0.0] * cameras
+    if pattern == 'steady':
+        return [window * i / cameras for i in range(cameras)]
+    if pattern == 'ramp':
+        # Arrival rate grows linearly, so cumulative arrivals grow with t^2
+        return [window * math.sqrt(i / cameras) for i in range(cameras)]
+    raise ValueError(f"Unknown arrival pattern {pattern!r}, expected one of {PATTERNS}")
+
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, math.ceil(pct / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def error_kind(error: Exception) -> str:
+    response = getattr(error, 'response', None)
+    if response is not None:
+        return f"HTTP {response.status_code}"
+    if isinstance(error, requests.Timeout):
+        return 'timeout'
+    if isinstance(error, requests.ConnectionError):
+        return 'connection'
+    return type(error).__name__
+
+
+class LoadStats:
+    """Thread-safe per-hop latency and error collector"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies: Dict[str, List[float]] = {}
+        self.errors: Dict[str, Dict[str, int]] = {}
+        self.cycles_completed = 0
+        self.cycles_failed = 0
+
+    def record(self, hop: str, seconds: float, error: Exception = None):
+        with self._lock:
+            if error is None:
+                self.latencies.setdefault(hop, []).append(seconds)
+            else:
+                kinds = self.errors.setdefault(hop, {})
+                kind = error_kind(error)
+                kinds[kind] = kinds.get(kind, 0) + 1
+
+    def cycle_done(self, ok: bool):
+        with self._lock:
+            if ok:
+                self.cycles_completed += 1
+            else:
+                self.cycles_failed += 1
+
+    def summary(self, elapsed: float) -> dict:
+        with self._lock:
+            hops = {}
+            total_requests = total_429 = 0
+            for hop in AUTH_HOPS + CYCLE_HOPS + STREAM_METRICS + ['cleanup']:
+                values = sorted(self.latencies.get(hop, []))
+                errors = dict(self.errors.get(hop, {}))
+                count = len(values) + sum(errors.values())
+                if not count:
+                    continue
+                throttled = errors.get('HTTP 429', 0)
+                if hop not in STREAM_METRICS:
+                    total_requests += count
+                    total_429 += throttled
+                hops[hop] = {
+                    'requests': count,
+                    'ok': len(values),
+                    'errors': errors,
+                    'error_rate': round(sum(errors.values()) / count, 4),
+                    'rate_429': round(throttled / count, 4),
+                    'latency_ms': {f"p{p}": round(percentile(values, p) * 1000, 1) for p in PERCENTILES},
+                }
+                if values:
+                    hops[hop]['latency_ms']['max'] = round(values[-1] * 1000, 1)
+            return {
+                'cycles_completed': self.cycles_completed,
+                'cycles_failed': self.cycles_failed,
+                'cycles_per_second': round(self.cycles_completed / elapsed, 2) if elapsed else 0,
+                'requests': total_requests,
+                'requests_per_second': round(total_requests / elapsed, 2) if elapsed else 0,
+                'rate_429': round(total_429 / total_requests, 4) if total_requests else 0,
+                'hops': hops
+            }
+
+
+class Camera:
+    """One simulated device with its own connection pool and token chain"""
+
+    def __init__(self, config: dict, device_id: str, stats: LoadStats):
+        self.stats = stats
+        self.session = requests.Session()
+        self.ctx = ValidationContext(dict(config, DEVICE_ID=device_id),
+                                     session=self.session, log=lambda _: None)
+        self.session_id = f"session-{uuid.uuid4().hex[:12]}"
+        self.wrote = False
+
+    def _hop(self, hop: str, func):
+        started = time.perf_counter()
+        try:
+            result = func()
+        except Exception as e:
+            self.stats.record(hop, time.perf_counter() - started, e)
+            raise
+        self.stats.record(hop, time.perf_counter() - started)
+        return result
+
+    def _write(self, path: str, fields: dict):
+        response = self.session.patch(_firestore_doc_url(self.ctx.config, path),
+                                      headers=_auth_headers(self.ctx),
+                                      json={'fields': fields}, timeout=30)
+        response.raise_for_status()
+        self.wrote = True
+
+    def authenticate(self):
+        for hop, func in zip(AUTH_HOPS, (get_custom_token, get_id_token, get_gcp_token)):
+            self.ctx.set_result(hop, self._hop(hop, lambda: func(self.ctx)))
+
+    def cycle(self):
+        device_id = self.ctx.config['DEVICE_ID']
+        now = {'timestampValue': datetime.utcnow().isoformat() + 'Z'}
+        device_path = f"devices/{device_id}"
+        session_path = f"{device_path}/sessions/{self.session_id}"
+        event_id = f"event-{uuid.uuid4().hex[:12]}"
+        self._hop('firestore_device', lambda: self._write(device_path, {
+            'deviceId': {'stringValue': device_id}, 'status': {'stringValue': 'active'},
+            'model': {'stringValue': 'LOAD-TEST'}, 'testRun': {'booleanValue': True}, 'updatedAt': now}))
+        self._hop('firestore_session', lambda: self._write(session_path, {
+            'deviceId': {'stringValue': device_id}, 'sessionId': {'stringValue': self.session_id},
+            'status': {'stringValue': 'active'}, 'updatedAt': now}))
+        self._hop('firestore_event', lambda: self._write(f"{session_path}/events/{event_id}", {
+            'deviceId': {'stringValue': device_id}, 'eventType': {'stringValue': 'load_test'},
+            'timestamp': now, 'confidence': {'doubleValue': 0.95}}))
+        self._hop('gemini', lambda: check_gemini(self.ctx))
+        timings = self.ctx.results['gemini_stream']
+        for metric, key in zip(STREAM_METRICS, ('time_to_first_byte_ms', 'time_to_first_token_ms')):
+            if timings[key] is not None:
+                self.stats.record(metric, timings[key] / 1000)
+
+    def cleanup(self):
+        # One batched recursive delete instead of a DELETE per document
+        if self.wrote:
+            try:
+                self._hop('cleanup', lambda: firestore_for(self.ctx).delete_tree(
+                    f"devices/{self.ctx.config['DEVICE_ID']}"))
+            except Exception:
+                pass
+        self.session.close()
+
+
+def run_load(config: dict, cameras: int = 10, pattern: str = 'steady', duration: float = 60.0,
+             ramp_seconds: float = None, interval: float = 5.0, cleanup: bool = True,
+             log=print) -> dict:
+    """Run N cameras for duration seconds and return the load report
+
+    Cameras arrive over ramp_seconds (default: half the duration) and each
+    repeats its write-and-infer cycle every interval seconds until the run
+    ends, so long durations double as a soak test.
+    """
+    window = duration / 2 if ramp_seconds is None else ramp_seconds
+    offsets = arrival_offsets(cameras, pattern, window)
+    stats = LoadStats()
+    run_id = datetime.now().strftime('%Y%m%d-%H%M%S')
+    started = time.perf_counter()
+    deadline = started + duration
+    active = [0]
+    active_lock = threading.Lock()
+    peak = [0]
+
+    def camera_main(index: int):
+        delay = started + offsets[index] - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        camera = Camera(config, f"load-{run_id}-{index:04d}", stats)
+        with active_lock:
+            active[0] += 1
+            peak[0] = max(peak[0], active[0])
+        try:
+            camera.authenticate()
+            while True:
+                cycle_started = time.perf_counter()
+                try:
+                    camera.cycle()
+                    stats.cycle_done(True)
+                except Exception:
+                    stats.cycle_done(False)
+                next_cycle = cycle_started + interval
+                if next_cycle >= deadline:
+                    break
+                time.sleep(max(0.0, next_cycle - time.perf_counter()))
+        except Exception:
+            # Token chain failed; already recorded against its hop
+            pass
+        finally:
+            with active_lock:
+                active[0] -= 1
+            if cleanup:
+                camera.cleanup()
+            else:
+                camera.session.close()
+
+    log(f"🚦 {cameras} cameras, {pattern} arrival over {window:.0f}s, "
+        f"{duration:.0f}s run, cycle every {interval:.1f}s")
+    with ThreadPoolExecutor(max_workers=cameras) as pool:
+        for future in [pool.submit(camera_main, i) for i in range(cameras)]:
+            future.result()
+    elapsed = time.perf_counter() - started
+
+    report = {
+        'timestamp': datetime.utcnow().isoformat() + 'Z',
+        'project_id': config.get('PROJECT_ID'),
+        'cameras': cameras,
+        'pattern': pattern,
+        'duration_seconds': duration,
+        'arrival_window_seconds': window,
+        'cycle_interval_seconds': interval,
+        'elapsed_seconds': round(elapsed, 3),
+        'peak_active_cameras': peak[0],
+    }
+    report.update(stats.summary(elapsed))
+    return report
+
+
+def print_load_report(report: dict):
+    print("\n" + "=" * 80)
+    print(f"📈 LOAD REPORT: {report['cameras']} cameras, {report['pattern']} arrival, "
+          f"{report['elapsed_seconds']:.1f}s")
+    print("=" * 80)
+    print(f"   Cycles: {report['cycles_completed']} ok, {report['cycles_failed']} failed "
+          f"({report['cycles_per_second']}/s)")
+    print(f"   Requests: {report['requests']} ({report['requests_per_second']}/s), "
+          f"429 rate {report['rate_429'] * 100:.2f}%")
+    print(f"\n   {'hop':<18} {'reqs':>6} {'err%':>6} {'429%':>6}"
+          + ''.join(f" {'p' + str(p):>8}" for p in PERCENTILES) + f" {'max':>8}")
+    for hop, data in report['hops'].items():
+        latency = data['latency_ms']
+        print(f"   {hop:<18} {data['requests']:>6} {data['error_rate'] * 100:>6.1f} "
+              f"{data['rate_429'] * 100:>6.1f}"
+              + ''.join(f" {latency[f'p{p}']:>8.1f}" for p in PERCENTILES)
+              + f" {latency.get('max', 0):>8.1f}")
+        if data['errors']:
+            print(f"      errors: {data['errors']}")
+    print("=" * 80)
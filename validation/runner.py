@@ -0,0 +1,154 @@
+"""
+Dependency-graph step runner
+Each step declares the steps it depends on. Steps whose dependencies have
+passed run concurrently on a thread pool; dependents of a failed step are
+skipped. Total time approaches the slowest chain rather than the sum of steps.
+"""
+
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Sequence
+
+import requests
+
+PASS = 'PASS'
+FAIL = 'FAIL'
+SKIP = 'SKIP'
+
+
+class ValidationContext:
+    """Shared state for one validation run"""
+
+    def __init__(self, config: dict, session: Optional[requests.Session] = None,
+                 log: Callable[[str], None] = print):
+        self.config = config
+        self.session = session or requests.Session()
+        self.results: Dict[str, object] = {}
+        self.log = log
+        self._lock = threading.Lock()
+
+    @property
+    def gcp_token(self) -> str:
+        return self.results['gcp_token']
+
+    def set_result(self, name: str, value):
+        with self._lock:
+            self.results[name] = value
+
+
+class Step:
+    """A unit of validation work"""
+
+    def __init__(self, name: str, func: Callable[[ValidationContext], object],
+                 deps: Sequence[str] = (), critical: bool = False, description: str = ''):
+        self.name = name
+        self.func = func
+        self.deps = tuple(deps)
+        self.critical = critical
+        self.description = description or name
+
+
+def _run_one(step: Step, ctx: ValidationContext, run_started: float, gate=None) -> dict:
+    if gate is not None:
+        # Shared across runs to bound total concurrent requests
+        gate.acquire()
+    started = time.perf_counter()
+    record = {
+        'step': step.description,
+        'name': step.name,
+        'started_at': round(started - run_started, 3),
+        'critical': step.critical
+    }
+    try:
+        result = step.func(ctx)
+        ctx.set_result(step.name, result)
+        record['status'] = PASS if result is not False else FAIL
+        if record['status'] == FAIL:
+            record['error'] = 'Check reported failure'
+    except Exception as e:
+        record['status'] = FAIL
+        record['error'] = str(e)[:500]
+    finally:
+        if gate is not None:
+            gate.release()
+    record['duration'] = round(time.perf_counter() - started, 3)
+    return record
+
+
+def run_steps(steps: List[Step], ctx: ValidationContext, max_workers: int = 8,
+              gate: Optional[threading.Semaphore] = None) -> dict:
+    """Run steps as a dependency graph and return a report
+
+    gate, when given, is a semaphore shared with other concurrent runs that
+    caps how many steps execute at once across all of them.
+    """
+    by_name = {step.name: step for step in steps}
+    for step in steps:
+        unknown = [dep for dep in step.deps if dep not in by_name]
+        if unknown:
+            raise ValueError(f"Step {step.name} depends on unknown steps {unknown}")
+
+    records: Dict[str, dict] = {}
+    pending = dict(by_name)
+    running = {}
+    run_started = time.perf_counter()
+    aborted = False
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        while pending or running:
+            for name, step in list(pending.items()):
+                dep_status = [records[dep]['status'] for dep in step.deps if dep in records]
+                if aborted or any(status != PASS for status in dep_status):
+                    records[name] = {
+                        'step': step.description, 'name': name, 'status': SKIP,
+                        'critical': step.critical, 'duration': 0.0,
+                        'error': 'Aborted after critical failure' if aborted
+                        else 'Dependency did not pass'
+                    }
+                    del pending[name]
+                elif len(dep_status) == len(step.deps):
+                    ctx.log(f"▶️  {step.description}")
+                    running[pool.submit(_run_one, step, ctx, run_started, gate)] = name
+                    del pending[name]
+
+            if not running:
+                # Nothing runnable left: whatever is pending waits on a cycle
+                for name, step in pending.items():
+                    records[name] = {
+                        'step': step.description, 'name': name, 'status': SKIP,
+                        'critical': step.critical, 'duration': 0.0,
+                        'error': 'Dependency cycle'
+                    }
+                break
+
+            done, _ = wait(list(running), return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                record = future.result()
+                records[name] = record
+                if record['status'] == PASS:
+                    ctx.log(f"✅ {record['step']} ({record['duration']:.2f}s)")
+                else:
+                    ctx.log(f"❌ {record['step']} - {record.get('error', '')}")
+                    if record['critical']:
+                        aborted = True
+
+    elapsed = time.perf_counter() - run_started
+    ordered = [records[step.name] for step in steps]
+    passed = sum(1 for r in ordered if r['status'] == PASS)
+    failed = sum(1 for r in ordered if r['status'] == FAIL)
+    total = passed + failed
+    return {
+        'timestamp': datetime.utcnow().isoformat() + 'Z',
+        'project_id': ctx.config.get('PROJECT_ID'),
+        'success_rate': (passed / total * 100) if total else 0,
+        'tests_passed': passed,
+        'tests_failed': failed,
+        'tests_skipped': sum(1 for r in ordered if r['status'] == SKIP),
+        'total_tests': total,
+        'elapsed_seconds': round(elapsed, 3),
+        'sequential_seconds': round(sum(r['duration'] for r in ordered), 3),
+        'details': ordered
+    }
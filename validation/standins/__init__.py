@@ -0,0 +1,19 @@
+"""
+Offline stand-ins for the services Anava functions and cameras call
+One process serves the gateway, identitytoolkit, STS, IAM Credentials,
+Secret Manager, Firestore REST, Cloud Storage and Gemini (Vertex AI, including
+batch prediction over a local spool, and the Generative Language API), each
+with configurable latency, faults and quota.
+
+The functions' Firestore clients speak gRPC, so run the Firestore emulator
+alongside and set FIRESTORE_EMULATOR_HOST; everything else comes from
+StandinServer.function_env().
+
+Usage: python -m validation.standins --port 8099 --latency gemini=lognormal:0.8,0.4
+"""
+
+from .behaviour import Behaviour, Faults, Latency, Quota, add_behaviour_arguments, parse_behaviours
+from .server import StandinServer
+
+__all__ = ['Behaviour', 'Faults', 'Latency', 'Quota', 'add_behaviour_arguments', 'parse_behaviours',
+           'StandinServer']
@@ -0,0 +1,48 @@
+"""
+Run the stand-ins until interrupted and print the environment that points
+the functions and validation tooling at them.
+"""
+
+import argparse
+import json
+import sys
+
+from .behaviour import add_behaviour_arguments, parse_behaviours
+from .server import StandinServer
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog='python -m validation.standins',
+                                     description='Offline stand-ins for Anava backend services')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8099)
+    parser.add_argument('--project', default='standin-project')
+    parser.add_argument('--secret', action='append', default=[], metavar='NAME=VALUE',
+                        help="Secret Manager value; '*=VALUE' answers any secret")
+    parser.add_argument('--seed', type=int, help='seed latency and fault sampling for repeatable runs')
+    add_behaviour_arguments(parser)
+    args = parser.parse_args(argv)
+
+    try:
+        behaviours = parse_behaviours(args.latency, args.errors, args.quota)
+    except ValueError as e:
+        parser.error(str(e))
+    secrets = dict(spec.split('=', 1) for spec in args.secret)
+    server = StandinServer(args.host, args.port, behaviours=behaviours, secrets=secrets,
+                           project_id=args.project, seed=args.seed)
+
+    print(f"🧪 Stand-ins listening on {server.url}")
+    print("\n# Functions (plus FIRESTORE_EMULATOR_HOST for the Firestore emulator)")
+    for name, value in server.function_env().items():
+        print(f"export {name}={value}")
+    print("\n# Validation config")
+    print(json.dumps(server.config(), indent=2))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
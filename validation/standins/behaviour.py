@@ -0,0 +1,160 @@
+"""
+Stand-in behaviour: latency distributions, error injection and quotas
+Each service gets a Behaviour. Specs are short strings so the same syntax
+works on every command line that starts stand-ins:
+
+    --latency gemini=lognormal:0.8,0.4   median 0.8s, sigma 0.4
+    --latency '*=uniform:0.01,0.03'      every service
+    --errors firestore=0.02:503,500      2% of requests fail with 503 or 500
+    --errors gemini=0.01:drop            1% of connections are dropped
+    --quota gemini=60/60                 60 requests per caller per 60s
+"""
+
+import argparse
+import math
+import random
+import threading
+import time
+from typing import Dict, List, Optional, Sequence
+
+DROP = 0
+
+SERVICES = ('gateway', 'identitytoolkit', 'sts', 'iam', 'secretmanager', 'firestore',
+            'storage', 'gemini', 'gemini_chunk')
+
+
+class Latency:
+    """A delay distribution in seconds"""
+
+    def __init__(self, kind: str = 'constant', a: float = 0.0, b: float = 0.0):
+        if kind not in ('constant', 'uniform', 'normal', 'lognormal', 'exponential'):
+            raise ValueError(f"Unknown latency distribution {kind!r}")
+        self.kind = kind
+        self.a = a
+        self.b = b
+
+    @classmethod
+    def parse(cls, spec: str) -> 'Latency':
+        """'0.05', 'uniform:lo,hi', 'normal:mean,sd', 'lognormal:median,sigma', 'exponential:mean'"""
+        if ':' not in spec:
+            return cls('constant', float(spec))
+        kind, args = spec.split(':', 1)
+        values = [float(v) for v in args.split(',')]
+        return cls(kind, values[0], values[1] if len(values) > 1 else 0.0)
+
+    def sample(self, rng: random.Random) -> float:
+        if self.kind == 'constant':
+            return self.a
+        if self.kind == 'uniform':
+            return rng.uniform(self.a, self.b)
+        if self.kind == 'normal':
+            return max(0.0, rng.gauss(self.a, self.b))
+        if self.kind == 'lognormal':
+            return self.a * math.exp(self.b * rng.gauss(0.0, 1.0))
+        return rng.expovariate(1.0 / self.a) if self.a > 0 else 0.0
+
+    def __repr__(self):
+        return f"Latency({self.kind!r}, {self.a}, {self.b})"
+
+
+class Faults:
+    """Fail a fraction of requests with one of the given statuses (0 drops the connection)"""
+
+    def __init__(self, rate: float = 0.0, statuses: Sequence[int] = (503,)):
+        self.rate = rate
+        self.statuses = list(statuses) or [503]
+
+    @classmethod
+    def parse(cls, spec: str) -> 'Faults':
+        """'0.02' or '0.02:503,500' or '0.01:drop'"""
+        rate, _, codes = spec.partition(':')
+        statuses = [DROP if code == 'drop' else int(code) for code in codes.split(',') if code]
+        return cls(float(rate), statuses or (503,))
+
+    def pick(self, rng: random.Random) -> Optional[int]:
+        if self.rate and rng.random() < self.rate:
+            return rng.choice(self.statuses)
+        return None
+
+
+class Quota:
+    """Fixed-window request quota per caller key"""
+
+    def __init__(self, limit: int, window: float = 60.0):
+        self.limit = limit
+        self.window = window
+        self._windows: Dict[str, tuple] = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def parse(cls, spec: str) -> 'Quota':
+        """'60/60' is 60 requests per 60 seconds; '10' is 10 per second"""
+        limit, _, window = spec.partition('/')
+        return cls(int(limit), float(window or 1))
+
+    def admit(self, key: str, now: Optional[float] = None) -> Optional[float]:
+        """None if admitted, else seconds until the window resets"""
+        now = time.time() if now is None else now
+        bucket = int(now // self.window)
+        with self._lock:
+            current, count = self._windows.get(key, (bucket, 0))
+            if current != bucket:
+                count = 0
+            count += 1
+            self._windows[key] = (bucket, count)
+        if count > self.limit:
+            return (bucket + 1) * self.window - now
+        return None
+
+
+class Behaviour:
+    """How one stand-in service responds"""
+
+    def __init__(self, latency: Optional[Latency] = None, faults: Optional[Faults] = None,
+                 quota: Optional[Quota] = None):
+        self.latency = latency or Latency()
+        self.faults = faults or Faults()
+        self.quota = quota
+
+
+def _split(spec: str) -> tuple:
+    service, sep, value = spec.partition('=')
+    if not sep or not service:
+        raise ValueError(f"Expected SERVICE=VALUE, got {spec!r}")
+    return service, value
+
+
+def parse_behaviours(latency: List[str] = (), errors: List[str] = (),
+                     quota: List[str] = ()) -> Dict[str, Behaviour]:
+    """Build per-service behaviours from command line specs
+
+    '*' sets the default; a service's own specs override it field by field.
+    Each service gets its own Quota, so '*' limits every service separately.
+    """
+    fields: Dict[str, dict] = {}
+    for name, specs, parse in (('latency', latency, Latency.parse), ('faults', errors, Faults.parse),
+                               ('quota', quota, Quota.parse)):
+        for spec in specs or ():
+            service, value = _split(spec)
+            fields.setdefault(service, {})[name] = (parse, value)
+
+    unknown = set(fields) - set(SERVICES) - {'*'}
+    if unknown:
+        raise ValueError(f"Unknown stand-in services {sorted(unknown)}, expected {SERVICES}")
+    defaults = fields.pop('*', {})
+    if defaults:
+        for service in SERVICES:
+            fields.setdefault(service, {})
+    return {service: Behaviour(**{name: parse(value)
+                                  for name, (parse, value) in {**defaults, **values}.items()})
+            for service, values in fields.items()}
+
+
+def add_behaviour_arguments(parser: argparse.ArgumentParser, prefix: str = ''):
+    """--latency/--errors/--quota SERVICE=SPEC, shared with commands that start stand-ins"""
+    parser.add_argument(f'--{prefix}latency', action='append', default=[], metavar='SERVICE=DIST',
+                        help="e.g. gemini=lognormal:0.8,0.4 or '*=0.01'")
+    parser.add_argument(f'--{prefix}errors', action='append', default=[], metavar='SERVICE=RATE[:CODES]',
+                        help='e.g. firestore=0.02:503,500 or gemini=0.01:drop')
+    parser.add_argument(f'--{prefix}quota', action='append', default=[], metavar='SERVICE=LIMIT/SECONDS',
+                        help='per-caller fixed window, e.g. gemini=60/60')
@@ -0,0 +1,239 @@
+"""
+Stand-in HTTP server
+Every service shares one threaded server and port; requests are routed by
+path. Before a handler runs, the service's behaviour is applied in the order a
+real frontend would: quota (fast 429 with Retry-After), then latency, then
+injected faults. Per-service status counts are served at /_standins/stats.
+"""
+
+import json
+import random
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional
+from urllib.parse import parse_qs, urlparse
+
+from .behaviour import DROP, Behaviour
+from .services import ROUTES, StandinRequest, Stream, error
+
+_DEFAULT = Behaviour()
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    # Burst arrivals open hundreds of connections at once
+    request_queue_size = 1024
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _read(self) -> tuple:
+        """(raw bytes, parsed JSON or form body)"""
+        length = int(self.headers.get('Content-Length') or 0)
+        raw = self.rfile.read(length) if length else b''
+        content_type = self.headers.get('Content-Type', '')
+        try:
+            if 'application/x-www-form-urlencoded' in content_type:
+                return raw, {k: v[0] for k, v in parse_qs(raw.decode()).items()}
+            if 'json' in content_type or not content_type:
+                return raw, json.loads(raw) if raw else {}
+        except ValueError:
+            pass
+        return raw, {}
+
+    def _send(self, status: int, payload, headers: dict):
+        if payload is None:
+            body, content_type = b'', 'application/json'
+        elif isinstance(payload, str):
+            body, content_type = payload.encode(), 'text/plain; charset=utf-8'
+        else:
+            body, content_type = json.dumps(payload).encode(), 'application/json'
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_stream(self, stream: Stream):
+        standin = self.server.standin
+        self.send_response(200)
+        self.send_header('Content-Type', stream.content_type)
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        for index, piece in enumerate(stream.pieces):
+            if index:
+                standin.sleep('gemini_chunk')
+            self.wfile.write(f"{len(piece):x}\r\n".encode() + piece + b"\r\n")
+            self.wfile.flush()
+        self.wfile.write(b"0\r\n\r\n")
+
+    def _dispatch(self, method: str):
+        url = urlparse(self.path)
+        raw, body = self._read() if method in ('POST', 'PATCH', 'PUT') else (b'', {})
+        request = StandinRequest(method, url.path, parse_qs(url.query), body, self.headers,
+                                 self.client_address[0], raw)
+        status, payload, headers = self.server.standin.dispatch(request)
+        if status == DROP:
+            self.close_connection = True
+            return
+        if isinstance(payload, Stream):
+            self._send_stream(payload)
+        else:
+            self._send(status, payload, headers)
+
+    def do_GET(self):
+        self._dispatch('GET')
+
+    def do_POST(self):
+        self._dispatch('POST')
+
+    def do_PATCH(self):
+        self._dispatch('PATCH')
+
+    def do_PUT(self):
+        self._dispatch('PUT')
+
+    def do_DELETE(self):
+        self._dispatch('DELETE')
+
+
+class StandinServer:
+    """In-process fakes of the gateway and the Google APIs the functions call"""
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0,
+                 behaviours: Optional[Dict[str, Behaviour]] = None,
+                 secrets: Optional[Dict[str, str]] = None, project_id: str = 'standin-project',
+                 seed: Optional[int] = None):
+        self.behaviours = behaviours or {}
+        self.secrets = dict(secrets or {})
+        self.project_id = project_id
+        self.documents = {}
+        self.objects = {}
+        self.uploads = {}
+        self.batch_jobs = {}
+        # Local job spool (file:// URIs) that the batch prediction stand-in reads and writes
+        self.spool_dir = tempfile.mkdtemp(prefix='standin-spool-')
+        self.stats: Dict[str, Dict[str, int]] = {}
+        self.lock = threading.Lock()
+        self._rng = random.Random(seed)
+        self._rng_lock = threading.Lock()
+        self._sleeper = threading.Event()
+        self._httpd = _Server((host, port), _Handler)
+        self._httpd.standin = self
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> 'StandinServer':
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def serve_forever(self):
+        self._httpd.serve_forever()
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def behaviour(self, service: str) -> Behaviour:
+        return self.behaviours.get(service, _DEFAULT)
+
+    def sleep(self, service: str):
+        with self._rng_lock:
+            delay = self.behaviour(service).latency.sample(self._rng)
+        if delay > 0:
+            self._sleeper.wait(delay)
+
+    def _count(self, service: str, status: int):
+        key = 'dropped' if status == DROP else str(status)
+        with self.lock:
+            counts = self.stats.setdefault(service, {})
+            counts[key] = counts.get(key, 0) + 1
+
+    def dispatch(self, request: StandinRequest) -> tuple:
+        """(status, payload, headers) for one request; status DROP closes the connection"""
+        if request.method == 'GET' and request.path == '/_standins/stats':
+            with self.lock:
+                return 200, {service: dict(counts) for service, counts in self.stats.items()}, {}
+
+        for service, method, pattern, handler in ROUTES:
+            match = pattern.match(request.path) if method == request.method else None
+            if match:
+                break
+        else:
+            status, payload = error(404, f"No stand-in for {request.method} {request.path}")
+            return status, payload, {}
+
+        behaviour = self.behaviour(service)
+        if behaviour.quota:
+            retry_after = behaviour.quota.admit(f"{service}:{request.caller()}")
+            if retry_after is not None:
+                self._count(service, 429)
+                status, payload = error(429, 'Resource has been exhausted (e.g. check quota).',
+                                        'RESOURCE_EXHAUSTED')
+                return status, payload, {'Retry-After': str(max(1, int(retry_after + 0.999)))}
+
+        self.sleep(service)
+        with self._rng_lock:
+            fault = behaviour.faults.pick(self._rng)
+        if fault is not None:
+            self._count(service, fault)
+            if fault == DROP:
+                return DROP, None, {}
+            status, payload = error(fault, 'Injected failure', 'UNAVAILABLE' if fault == 503 else '')
+            return status, payload, {}
+
+        status, payload, *headers = handler(self, request, match)
+        self._count(service, status)
+        return status, payload, headers[0] if headers else {}
+
+    def config(self, project_id: Optional[str] = None, **overrides) -> dict:
+        """A validation config with every endpoint pointed at this server"""
+        config = {
+            'API_GATEWAY_URL': self.url,
+            'API_GATEWAY_KEY': 'standin-key',
+            'FIREBASE_API_KEY': 'standin-firebase-key',
+            'PROJECT_ID': project_id or self.project_id,
+            'IDENTITY_TOOLKIT_URL': self.url,
+            'FIRESTORE_URL': self.url,
+            'STORAGE_URL': self.url,
+            'VERTEX_URL': self.url,
+        }
+        config.update(overrides)
+        return config
+
+    def function_env(self) -> Dict[str, str]:
+        """Environment that points the Python functions at this server"""
+        host_port = self.url.split('://', 1)[1]
+        return {
+            # ai_proxy
+            'GEMINI_API_BASE': f"{self.url}/v1beta",
+            'VERTEX_API_TEMPLATE': f"{self.url}/v1",
+            'SECRET_MANAGER_ENDPOINT': self.url,
+            'JOB_SPOOL_DIR': self.spool_dir,
+            'JOB_CALLBACK_SCHEMES': 'https,http',
+            'JOB_CALLBACK_HOSTS': '127.0.0.1,localhost',
+            # token_vendor_machine
+            'STS_ENDPOINT': f"{self.url}/v1/token",
+            'IAM_CREDENTIALS_ENDPOINT': self.url,
+            # device_authenticator: firebase_admin mints unsigned custom tokens
+            'FIREBASE_AUTH_EMULATOR_HOST': host_port,
+            'GOOGLE_CLOUD_PROJECT': self.project_id,
+        }
@@ -0,0 +1,456 @@
+"""
+Stand-in service handlers
+Each handler takes the server, the request and the route's regex match and
+returns (status, payload) or (status, payload, headers). Tokens are unsigned JWTs in the same shape the
+Firebase Admin SDK produces against the auth emulator, so the real
+device_authenticator can sit in front of these stand-ins.
+"""
+
+import base64
+import hashlib
+import json
+import os
+import re
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import List, Optional
+from urllib.parse import unquote, urlparse
+
+GEMINI_TEXT = "A single white pixel on a plain background, no people or vehicles visible."
+EMBEDDING_DIMENSIONS = 16
+
+
+class StandinRequest:
+    def __init__(self, method: str, path: str, query: dict, body: dict, headers, client: str,
+                 raw: bytes = b''):
+        self.method = method
+        self.path = path
+        self.query = query
+        self.body = body
+        self.headers = headers
+        self.client = client
+        self.raw = raw
+
+    def arg(self, name: str, default: str = '') -> str:
+        return self.query.get(name, [default])[0]
+
+    def bearer(self) -> str:
+        value = self.headers.get('Authorization', '')
+        return value[7:] if value.startswith('Bearer ') else ''
+
+    def caller(self) -> str:
+        """Key that quotas are counted against"""
+        return (self.headers.get('x-api-key') or self.arg('key') or self.bearer()
+                or self.client)
+
+
+class Stream:
+    """A response body sent in pieces, with gemini_chunk latency between them"""
+
+    def __init__(self, pieces: List[bytes], content_type: str = 'application/json'):
+        self.pieces = pieces
+        self.content_type = content_type
+
+
+def error(status: int, message: str, reason: str = '') -> tuple:
+    payload = {'error': {'code': status, 'message': message}}
+    if reason:
+        payload['error']['status'] = reason
+    return status, payload
+
+
+def _b64url(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode()
+
+
+def unsigned_jwt(claims: dict) -> str:
+    header = _b64url(json.dumps({'alg': 'none', 'typ': 'JWT'}).encode())
+    return f"{header}.{_b64url(json.dumps(claims).encode())}."
+
+
+def jwt_claims(token: str) -> Optional[dict]:
+    """Payload of a JWT without verifying it; None if it isn't one"""
+    parts = token.split('.')
+    if len(parts) != 3:
+        return None
+    try:
+        payload = parts[1] + '=' * (-len(parts[1]) % 4)
+        return json.loads(base64.urlsafe_b64decode(payload))
+    except ValueError:
+        return None
+
+
+def _expire_time(seconds: int = 3600) -> str:
+    return (datetime.utcnow() + timedelta(seconds=seconds)).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+# Gateway: device-auth and the token vending machine
+
+def device_auth_initiate(server, request: StandinRequest, match) -> tuple:
+    if not request.headers.get('x-api-key'):
+        return error(401, 'UNAUTHENTICATED: missing API key')
+    device_id = request.body.get('device_id')
+    if not device_id:
+        return 400, "Bad Request: 'device_id' missing"
+    now = int(time.time())
+    token = unsigned_jwt({'uid': str(device_id), 'iat': now, 'exp': now + 3600,
+                          'aud': 'https://identitytoolkit.googleapis.com/google.identity.identitytoolkit.v1.IdentityToolkit',
+                          'iss': 'firebase-auth-emulator@example.com',
+                          'sub': 'firebase-auth-emulator@example.com'})
+    return 200, {'firebase_custom_token': token}
+
+
+def gcp_token_vend(server, request: StandinRequest, match) -> tuple:
+    claims = jwt_claims(request.body.get('firebase_id_token', ''))
+    if not claims or not claims.get('sub'):
+        return 500, 'TVM HTTP Err 400'
+    return 200, {'gcp_access_token': f"standin-gcp.{uuid.uuid4().hex}", 'expires_in': 3599}
+
+
+# identitytoolkit
+
+def sign_in_with_custom_token(server, request: StandinRequest, match) -> tuple:
+    if not request.arg('key'):
+        return error(400, 'API key not valid. Please pass a valid API key.', 'INVALID_ARGUMENT')
+    claims = jwt_claims(request.body.get('token', ''))
+    if not claims or not claims.get('uid'):
+        return error(400, 'INVALID_CUSTOM_TOKEN')
+    now = int(time.time())
+    id_token = unsigned_jwt({
+        'iss': f"https://securetoken.google.com/{server.project_id}",
+        'aud': server.project_id,
+        'sub': claims['uid'],
+        'user_id': claims['uid'],
+        'iat': now,
+        'exp': now + 3600,
+        'firebase': {'sign_in_provider': 'custom'}
+    })
+    return 200, {'kind': 'identitytoolkit#VerifyCustomTokenResponse', 'idToken': id_token,
+                 'refreshToken': uuid.uuid4().hex, 'expiresIn': '3600', 'isNewUser': False}
+
+
+# STS and IAM Credentials, as called by token_vendor_machine
+
+def sts_token(server, request: StandinRequest, match) -> tuple:
+    body = request.body
+    if body.get('grant_type') != 'urn:ietf:params:oauth:grant-type:token-exchange':
+        return 400, {'error': 'invalid_grant', 'error_description': 'Unsupported grant_type'}
+    claims = jwt_claims(body.get('subject_token', ''))
+    if not claims or not claims.get('sub'):
+        return 400, {'error': 'invalid_grant', 'error_description': 'Invalid subject token'}
+    return 200, {'access_token': f"standin-federated.{uuid.uuid4().hex}",
+                 'issued_token_type': 'urn:ietf:params:oauth:token-type:access_token',
+                 'token_type': 'Bearer', 'expires_in': 3600}
+
+
+def iam_generate_access_token(server, request: StandinRequest, match) -> tuple:
+    if not request.bearer().startswith('standin-federated.'):
+        return error(401, 'Request had invalid authentication credentials.', 'UNAUTHENTICATED')
+    return 200, {'accessToken': f"standin-gcp.{uuid.uuid4().hex}", 'expireTime': _expire_time()}
+
+
+# Secret Manager (REST transport)
+
+def access_secret_version(server, request: StandinRequest, match) -> tuple:
+    project, secret, version = match.group(1), match.group(2), match.group(3)
+    value = server.secrets.get(secret, server.secrets.get('*'))
+    if value is None:
+        return error(404, f"Secret [projects/{project}/secrets/{secret}] not found or has no versions.",
+                     'NOT_FOUND')
+    return 200, {'name': f"projects/{project}/secrets/{secret}/versions/{version}",
+                 'payload': {'data': base64.b64encode(value.encode()).decode()}}
+
+
+# Firestore REST
+
+def firestore_document(server, request: StandinRequest, match) -> tuple:
+    name = f"projects/{match.group(1)}/databases/{match.group(2)}/documents/{match.group(3)}"
+    now = datetime.utcnow().isoformat() + 'Z'
+    with server.lock:
+        if request.method == 'PATCH':
+            _apply_write(server, {'update': {'name': name, 'fields': request.body.get('fields', {})}}, now)
+            return 200, server.documents[name]
+        if request.method == 'GET':
+            if name not in server.documents:
+                return error(404, f"Document \"{name}\" not found.", 'NOT_FOUND')
+            return 200, server.documents[name]
+        server.documents.pop(name, None)
+        return 200, {}
+
+
+def _apply_write(server, write: dict, now: str):
+    if 'delete' in write:
+        server.documents.pop(write['delete'], None)
+        return
+    document = write['update']
+    existing = server.documents.get(document['name'])
+    server.documents[document['name']] = {
+        'name': document['name'],
+        'fields': document.get('fields', {}),
+        'createTime': existing['createTime'] if existing else now,
+        'updateTime': now
+    }
+
+
+def firestore_commit(server, request: StandinRequest, match) -> tuple:
+    writes = request.body.get('writes', [])
+    if len(writes) > 500:
+        return error(400, 'A maximum of 500 writes allowed per request', 'INVALID_ARGUMENT')
+    now = datetime.utcnow().isoformat() + 'Z'
+    with server.lock:
+        for write in writes:
+            _apply_write(server, write, now)
+    return 200, {'writeResults': [{'updateTime': now} for _ in writes], 'commitTime': now}
+
+
+def firestore_batch_write(server, request: StandinRequest, match) -> tuple:
+    writes = request.body.get('writes', [])
+    if len(writes) > 500:
+        return error(400, 'A maximum of 500 writes allowed per request', 'INVALID_ARGUMENT')
+    now = datetime.utcnow().isoformat() + 'Z'
+    with server.lock:
+        for write in writes:
+            _apply_write(server, write, now)
+    return 200, {'writeResults': [{'updateTime': now} for _ in writes],
+                 'status': [{} for _ in writes]}
+
+
+def firestore_run_query(server, request: StandinRequest, match) -> tuple:
+    """Only the kindless allDescendants name query used for recursive deletes"""
+    query = request.body.get('structuredQuery', {})
+    parent = f"projects/{match.group(1)}/databases/{match.group(2)}/documents{match.group(3) or ''}"
+    if not any(selector.get('allDescendants') and not selector.get('collectionId')
+               for selector in query.get('from', [])):
+        return error(501, 'Stand-in only supports kindless allDescendants queries', 'UNIMPLEMENTED')
+    cursor = (query.get('startAt', {}).get('values') or [{}])[0].get('referenceValue', '')
+    with server.lock:
+        names = sorted(name for name in server.documents
+                       if name.startswith(parent + '/') and name > cursor)
+    now = datetime.utcnow().isoformat() + 'Z'
+    names = names[:query.get('limit', len(names))]
+    if not names:
+        return 200, [{'readTime': now}]
+    return 200, [{'document': {'name': name}, 'readTime': now} for name in names]
+
+
+# Cloud Storage JSON API, including resumable sessions and compose
+
+def _object(bucket: str, name: str, size: int) -> dict:
+    return {'kind': 'storage#object', 'bucket': bucket, 'name': name, 'size': str(size)}
+
+
+def storage_upload(server, request: StandinRequest, match) -> tuple:
+    bucket, name = match.group(1), request.arg('name')
+    if not name:
+        return error(400, 'Required parameter: name')
+    if request.arg('uploadType') == 'resumable':
+        upload_id = uuid.uuid4().hex
+        total = request.headers.get('X-Upload-Content-Length')
+        with server.lock:
+            server.uploads[upload_id] = {'bucket': bucket, 'name': name, 'data': bytearray(),
+                                         'total': int(total) if total else None}
+        host = request.headers.get('Host', '127.0.0.1')
+        location = f"http://{host}/upload/storage/v1/b/{bucket}/o?uploadType=resumable&upload_id={upload_id}"
+        return 200, None, {'Location': location}
+    with server.lock:
+        server.objects[(bucket, name)] = request.raw
+    return 200, _object(bucket, name, len(request.raw))
+
+
+_CONTENT_RANGE = re.compile(r'^bytes (?:(\d+)-(\d+)|\*)/(\d+|\*)$')
+
+
+def storage_resumable_chunk(server, request: StandinRequest, match) -> tuple:
+    """PUT a chunk (Content-Range: bytes a-b/total) or query progress (bytes */total)"""
+    upload_id = request.arg('upload_id')
+    with server.lock:
+        upload = server.uploads.get(upload_id)
+        if upload is None:
+            return error(404, 'No such upload session', 'NOT_FOUND')
+        content_range = _CONTENT_RANGE.match(request.headers.get('Content-Range', 'bytes */*'))
+        if not content_range:
+            return error(400, 'Invalid Content-Range')
+        start, end, total = content_range.groups()
+        if total != '*':
+            upload['total'] = int(total)
+        if start is not None:
+            start = int(start)
+            if start > len(upload['data']):
+                return error(400, 'Chunk starts past the committed offset')
+            data = request.raw[:int(end) - start + 1]
+            del upload['data'][start:]
+            upload['data'] += data
+        committed = len(upload['data'])
+        if upload['total'] is not None and committed >= upload['total']:
+            server.objects[(upload['bucket'], upload['name'])] = bytes(upload['data'])
+            del server.uploads[upload_id]
+            return 200, _object(upload['bucket'], upload['name'], committed)
+    headers = {'Range': f"bytes=0-{committed - 1}"} if committed else {}
+    return 308, None, headers
+
+
+def storage_compose(server, request: StandinRequest, match) -> tuple:
+    bucket, name = match.group(1), unquote(match.group(2))
+    sources = request.body.get('sourceObjects', [])
+    if not 1 <= len(sources) <= 32:
+        return error(400, 'The number of source components provided must be between 1 and 32.')
+    with server.lock:
+        missing = [s['name'] for s in sources if (bucket, s['name']) not in server.objects]
+        if missing:
+            return error(404, f"Source object {missing[0]} not found", 'NOT_FOUND')
+        data = b''.join(server.objects[(bucket, s['name'])] for s in sources)
+        server.objects[(bucket, name)] = data
+    return 200, dict(_object(bucket, name, len(data)), componentCount=len(sources))
+
+
+def storage_list(server, request: StandinRequest, match) -> tuple:
+    bucket = match.group(1)
+    with server.lock:
+        items = [_object(b, n, len(data)) for (b, n), data in server.objects.items() if b == bucket]
+    return 200, {'kind': 'storage#objects', 'items': items[:int(request.arg('maxResults', '1000'))]}
+
+
+def storage_delete(server, request: StandinRequest, match) -> tuple:
+    with server.lock:
+        removed = server.objects.pop((match.group(1), unquote(match.group(2))), None)
+    if removed is None:
+        return error(404, 'No such object', 'NOT_FOUND')
+    return 204, None
+
+
+# Gemini: Vertex AI and the Generative Language API
+
+def _gemini_chunks() -> List[dict]:
+    words = GEMINI_TEXT.split(' ')
+    step = 4
+    chunks = [{'candidates': [{'content': {'role': 'model',
+                                           'parts': [{'text': ' '.join(words[i:i + step]) + ' '}]},
+                               'index': 0}]}
+              for i in range(0, len(words), step)]
+    chunks[-1]['candidates'][0]['finishReason'] = 'STOP'
+    chunks[-1]['usageMetadata'] = {'promptTokenCount': 270, 'candidatesTokenCount': len(words),
+                                   'totalTokenCount': 270 + len(words)}
+    return chunks
+
+
+def _embedding(content: dict) -> dict:
+    """Deterministic stand-in vector for a content's text"""
+    text = ' '.join(part.get('text', '') for part in content.get('parts', []))
+    digest = hashlib.sha256(text.encode()).digest()
+    return {'values': [round(byte / 255 - 0.5, 4) for byte in digest[:EMBEDDING_DIMENSIONS]]}
+
+
+def _gemini_reply(request: StandinRequest, method: str) -> tuple:
+    if method == 'embedContent':
+        return 200, {'embedding': _embedding(request.body.get('content', {}))}
+    if method == 'batchEmbedContents':
+        return 200, {'embeddings': [_embedding(item.get('content', {}))
+                                    for item in request.body.get('requests', [])]}
+    if method == 'countTokens':
+        text = ' '.join(part.get('text', '') for content in request.body.get('contents', [])
+                        for part in content.get('parts', []))
+        return 200, {'totalTokens': max(1, len(text) // 4)}
+    chunks = _gemini_chunks()
+    if method == 'generateContent':
+        return 200, {'candidates': [{'content': {'role': 'model', 'parts': [{'text': GEMINI_TEXT}]},
+                                     'finishReason': 'STOP', 'index': 0}],
+                     'usageMetadata': chunks[-1]['usageMetadata']}
+    if request.arg('alt') == 'sse':
+        return 200, Stream([f"data: {json.dumps(chunk)}\r\n\r\n".encode() for chunk in chunks],
+                           'text/event-stream')
+    pieces = [('[' if i == 0 else ',\r\n') + json.dumps(chunk) for i, chunk in enumerate(chunks)]
+    pieces[-1] += ']'
+    return 200, Stream([piece.encode() for piece in pieces])
+
+
+def vertex_generate(server, request: StandinRequest, match) -> tuple:
+    if not request.bearer():
+        return error(401, 'Request is missing required authentication credential.', 'UNAUTHENTICATED')
+    return _gemini_reply(request, match.group(2))
+
+
+def generative_language_generate(server, request: StandinRequest, match) -> tuple:
+    if not request.arg('key') and not request.headers.get('x-goog-api-key'):
+        return error(403, 'Method doesn\'t allow unregistered callers.', 'PERMISSION_DENIED')
+    return _gemini_reply(request, match.group(2))
+
+
+def vertex_batch_prediction_create(server, request: StandinRequest, match) -> tuple:
+    """Runs the whole batch at once; inputs and outputs must be file:// URIs (the local job spool)"""
+    if not request.bearer():
+        return error(401, 'Request is missing required authentication credential.', 'UNAUTHENTICATED')
+    uris = request.body.get('inputConfig', {}).get('gcsSource', {}).get('uris', [])
+    output_prefix = request.body.get('outputConfig', {}).get('gcsDestination', {}).get('outputUriPrefix', '')
+    if not uris or not all(uri.startswith('file://') for uri in uris + [output_prefix]):
+        return error(400, 'The stand-in only reads and writes file:// URIs', 'INVALID_ARGUMENT')
+
+    predictions = []
+    for uri in uris:
+        with open(urlparse(uri).path) as f:
+            for line in filter(str.strip, f):
+                body = json.loads(line).get('request', {})
+                _, response = _gemini_reply(StandinRequest('POST', '', {}, body, {}, request.client),
+                                            'generateContent')
+                predictions.append({'request': body, 'response': response, 'status': ''})
+    output_dir = os.path.join(urlparse(output_prefix).path, f"prediction-model-{uuid.uuid4().hex[:8]}")
+    os.makedirs(output_dir, exist_ok=True)
+    with open(os.path.join(output_dir, 'predictions.jsonl'), 'w') as f:
+        f.writelines(json.dumps(prediction) + '\n' for prediction in predictions)
+
+    job_id = str(uuid.uuid4().int)[:19]
+    name = f"projects/{match.group(1)}/locations/{match.group(2)}/batchPredictionJobs/{job_id}"
+    job = {'name': name, 'displayName': request.body.get('displayName', ''), 'state': 'JOB_STATE_SUCCEEDED',
+           'outputInfo': {'gcsOutputDirectory': f"file://{output_dir}"},
+           'completionStats': {'successfulCount': str(len(predictions))}}
+    with server.lock:
+        server.batch_jobs[name] = job
+    # A real job is still pending when created; it is only seen to finish on a later get
+    return 200, dict(job, state='JOB_STATE_PENDING')
+
+
+def vertex_batch_prediction_get(server, request: StandinRequest, match) -> tuple:
+    if not request.bearer():
+        return error(401, 'Request is missing required authentication credential.', 'UNAUTHENTICATED')
+    with server.lock:
+        job = server.batch_jobs.get(request.path.lstrip('/')[len('v1/'):])
+    if job is None:
+        return error(404, 'Batch prediction job not found', 'NOT_FOUND')
+    return 200, job
+
+
+ROUTES = [
+    ('gateway', 'POST', r'^/device-auth/initiate$', device_auth_initiate),
+    ('gateway', 'POST', r'^/gcp-token/vend$', gcp_token_vend),
+    ('identitytoolkit', 'POST', r'^(?:/identitytoolkit\.googleapis\.com)?/v1/accounts:signInWithCustomToken$',
+     sign_in_with_custom_token),
+    ('sts', 'POST', r'^/v1/token$', sts_token),
+    ('iam', 'POST', r'^/v1/projects/-/serviceAccounts/([^/:]+):generateAccessToken$',
+     iam_generate_access_token),
+    ('secretmanager', 'GET', r'^/v1/projects/([^/]+)/secrets/([^/]+)/versions/([^/:]+):access$',
+     access_secret_version),
+    ('firestore', 'GET', r'^/v1/projects/([^/]+)/databases/([^/]+)/documents/(.+)$', firestore_document),
+    ('firestore', 'PATCH', r'^/v1/projects/([^/]+)/databases/([^/]+)/documents/(.+)$', firestore_document),
+    ('firestore', 'DELETE', r'^/v1/projects/([^/]+)/databases/([^/]+)/documents/(.+)$', firestore_document),
+    ('firestore', 'POST', r'^/v1/projects/([^/]+)/databases/([^/]+)/documents:commit$', firestore_commit),
+    ('firestore', 'POST', r'^/v1/projects/([^/]+)/databases/([^/]+)/documents:batchWrite$',
+     firestore_batch_write),
+    ('firestore', 'POST', r'^/v1/projects/([^/]+)/databases/([^/]+)/documents(/.+)?:runQuery$',
+     firestore_run_query),
+    ('storage', 'POST', r'^/upload/storage/v1/b/([^/]+)/o$', storage_upload),
+    ('storage', 'PUT', r'^/upload/storage/v1/b/([^/]+)/o$', storage_resumable_chunk),
+    ('storage', 'POST', r'^/storage/v1/b/([^/]+)/o/(.+)/compose$', storage_compose),
+    ('storage', 'GET', r'^/storage/v1/b/([^/]+)/o$', storage_list),
+    ('storage', 'DELETE', r'^/storage/v1/b/([^/]+)/o/(.+)$', storage_delete),
+    ('gemini', 'POST', r'^/v1/projects/[^/]+/locations/[^/]+/publishers/google/models/([^/:]+)'
+                       r':(generateContent|streamGenerateContent|countTokens)$', vertex_generate),
+    ('gemini', 'POST', r'^/v1/projects/([^/]+)/locations/([^/]+)/batchPredictionJobs$',
+     vertex_batch_prediction_create),
+    ('gemini', 'GET', r'^/v1/projects/[^/]+/locations/[^/]+/batchPredictionJobs/[^/]+$',
+     vertex_batch_prediction_get),
+    ('gemini', 'POST',
+     r'^/v1beta/models/([^/:]+):(generateContent|streamGenerateContent|countTokens|embedContent'
+     r'|batchEmbedContents)$',
+     generative_language_generate),
+]
+ROUTES = [(service, method, re.compile(pattern), handler) for service, method, pattern, handler in ROUTES]
@@ -0,0 +1,177 @@
+"""
+Incremental streamGenerateContent parsing
+Reads a streaming response with iter_content and yields each chunk as soon as
+it is complete, instead of waiting for response.text. Vertex frames the
+stream as one JSON array written element by element; ?alt=sse frames it as
+server-sent events. Both are detected from the first bytes. Timings for
+time-to-first-byte, time-to-first-token and chunk inter-arrival are
+recorded as the stream is read.
+"""
+
+import codecs
+import json
+import time
+from typing import Iterator, List, Optional
+
+SSE = 'sse'
+JSON_ARRAY = 'json_array'
+JSON_SEQUENCE = 'json_sequence'
+
+
+class StreamParseError(ValueError):
+    """The stream is not valid SSE or JSON-array framing"""
+
+
+class StreamParser:
+    """Push bytes in with feed(); complete JSON chunks come out"""
+
+    def __init__(self):
+        self.framing: Optional[str] = None
+        self._decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        self._json = json.JSONDecoder()
+        self._buffer = ''
+
+    def feed(self, data: bytes) -> List[dict]:
+        self._buffer += self._decoder.decode(data)
+        if self.framing is None:
+            stripped = self._buffer.lstrip()
+            if not stripped:
+                return []
+            first = stripped[0]
+            self.framing = JSON_ARRAY if first == '[' else JSON_SEQUENCE if first == '{' else SSE
+        return self._parse_sse() if self.framing == SSE else self._parse_json()
+
+    def close(self) -> List[dict]:
+        """Flush the tail of the stream; raises if a chunk was left incomplete"""
+        self._buffer += self._decoder.decode(b'', final=True)
+        chunks = self.feed(b'\n\n') if self.framing == SSE else self._parse_json()
+        rest = self._buffer.strip().lstrip(',').strip()
+        if rest and rest != ']':
+            raise StreamParseError(f"Stream ended inside a chunk: {rest[:80]!r}")
+        return chunks
+
+    def _parse_json(self) -> List[dict]:
+        chunks = []
+        buffer = self._buffer
+        position = 0
+        while True:
+            # Skip whitespace and array punctuation between elements
+            while position < len(buffer) and buffer[position] in ' \t\r\n,[':
+                position += 1
+            if position >= len(buffer) or buffer[position] == ']':
+                break
+            try:
+                chunk, end = self._json.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                # Element not complete yet
+                break
+            chunks.append(chunk)
+            position = end
+        self._buffer = buffer[position:]
+        return chunks
+
+    def _parse_sse(self) -> List[dict]:
+        chunks = []
+        buffer = self._buffer.replace('\r\n', '\n')
+        while '\n\n' in buffer:
+            event, buffer = buffer.split('\n\n', 1)
+            data = '\n'.join(line[5:].lstrip() for line in event.split('\n') if line.startswith('data:'))
+            if not data or data == '[DONE]':
+                continue
+            try:
+                chunks.append(json.loads(data))
+            except json.JSONDecodeError as e:
+                raise StreamParseError(f"Invalid SSE data: {data[:80]!r}") from e
+        self._buffer = buffer
+        return chunks
+
+
+def chunk_text(chunk: dict) -> str:
+    """Text of the first candidate in one stream chunk"""
+    candidates = chunk.get('candidates') or [{}]
+    return ''.join(part.get('text', '') for part in candidates[0].get('content', {}).get('parts', []))
+
+
+class StreamTimings:
+    """Milestones of one streaming response, in seconds from the request start"""
+
+    def __init__(self, started: Optional[float] = None):
+        self.started = time.perf_counter() if started is None else started
+        self.headers: Optional[float] = None
+        self.first_byte: Optional[float] = None
+        self.first_token: Optional[float] = None
+        self.total: Optional[float] = None
+        self.chunk_times: List[float] = []
+
+    def mark(self, attr: str) -> float:
+        elapsed = time.perf_counter() - self.started
+        if getattr(self, attr) is None:
+            setattr(self, attr, elapsed)
+        return elapsed
+
+    @property
+    def inter_arrival(self) -> List[float]:
+        return [b - a for a, b in zip(self.chunk_times, self.chunk_times[1:])]
+
+    def as_dict(self) -> dict:
+        def ms(value):
+            return None if value is None else round(value * 1000, 1)
+        gaps = self.inter_arrival
+        return {
+            'time_to_headers_ms': ms(self.headers),
+            'time_to_first_byte_ms': ms(self.first_byte),
+            'time_to_first_token_ms': ms(self.first_token),
+            'total_ms': ms(self.total),
+            'chunks': len(self.chunk_times),
+            'inter_arrival_ms': [ms(gap) for gap in gaps],
+            'max_inter_arrival_ms': ms(max(gaps)) if gaps else None
+        }
+
+
+def iter_stream(response, timings: Optional[StreamTimings] = None) -> Iterator[dict]:
+    """Yield parsed chunks from a stream=True response as they complete"""
+    timings = timings or StreamTimings()
+    timings.mark('headers')
+    parser = StreamParser()
+    for data in response.iter_content(chunk_size=None):
+        if not data:
+            continue
+        timings.mark('first_byte')
+        for chunk in parser.feed(data):
+            yield _timed(chunk, timings)
+    for chunk in parser.close():
+        yield _timed(chunk, timings)
+    timings.mark('total')
+
+
+def _timed(chunk: dict, timings: StreamTimings) -> dict:
+    elapsed = time.perf_counter() - timings.started
+    timings.chunk_times.append(elapsed)
+    if timings.first_token is None and chunk_text(chunk):
+        timings.first_token = elapsed
+    return chunk
+
+
+class StreamResult:
+    def __init__(self, text: str, chunks: List[dict], timings: StreamTimings):
+        self.text = text
+        self.chunks = chunks
+        self.timings = timings
+
+    @property
+    def usage(self) -> dict:
+        for chunk in reversed(self.chunks):
+            if chunk.get('usageMetadata'):
+                return chunk['usageMetadata']
+        return {}
+
+
+def read_stream(response, started: Optional[float] = None) -> StreamResult:
+    """Consume a streaming response, keeping its text, chunks and timings
+
+    started is the perf_counter() taken before the request was sent, so the
+    timings include connection setup and time spent waiting for headers.
+    """
+    timings = StreamTimings(started)
+    chunks = list(iter_stream(response, timings))
+    return StreamResult(''.join(chunk_text(chunk) for chunk in chunks), chunks, timings)
@@ -0,0 +1,71 @@
+"""
+Camera token chain
+device-auth custom token -> Firebase ID token -> GCP access token via the
+token vending machine. Each hop is its own step so its latency is reported,
+and the resulting tokens are shared by every check in the run.
+"""
+
+from .runner import ValidationContext
+
+TOKEN_TIMEOUT = 30
+
+
+def get_custom_token(ctx: ValidationContext) -> str:
+    """Get Firebase custom token from device auth endpoint"""
+    config = ctx.config
+    response = ctx.session.post(
+        f"{config['API_GATEWAY_URL']}/device-auth/initiate",
+        headers={
+            "x-api-key": config['API_GATEWAY_KEY'],
+            "Content-Type": "application/json"
+        },
+        json={"device_id": config['DEVICE_ID']},
+        timeout=TOKEN_TIMEOUT
+    )
+    response.raise_for_status()
+    data = response.json()
+    if "firebase_custom_token" not in data:
+        raise Exception(f"No custom token in response: {data}")
+    return data["firebase_custom_token"]
+
+
+def get_id_token(ctx: ValidationContext) -> str:
+    """Exchange custom token for Firebase ID token"""
+    config = ctx.config
+    response = ctx.session.post(
+        f"{config['IDENTITY_TOOLKIT_URL']}/v1/accounts:signInWithCustomToken?key={config['FIREBASE_API_KEY']}",
+        json={"token": ctx.results['custom_token'], "returnSecureToken": True},
+        timeout=TOKEN_TIMEOUT
+    )
+    response.raise_for_status()
+    data = response.json()
+    if "idToken" not in data:
+        raise Exception(f"No ID token in response: {data}")
+    return data["idToken"]
+
+
+def get_gcp_token(ctx: ValidationContext) -> str:
+    """Get GCP access token via token vending machine"""
+    config = ctx.config
+    response = ctx.session.post(
+        f"{config['API_GATEWAY_URL']}/gcp-token/vend",
+        headers={
+            "x-api-key": config['API_GATEWAY_KEY'],
+            "Content-Type": "application/json"
+        },
+        json={"firebase_id_token": ctx.results['id_token']},
+        timeout=TOKEN_TIMEOUT
+    )
+    response.raise_for_status()
+    data = response.json()
+    if "gcp_access_token" not in data:
+        raise Exception(f"No GCP access token in response: {data}")
+    return data["gcp_access_token"]
+
+
+def acquire_tokens(ctx: ValidationContext) -> str:
+    """Run the whole chain outside the step graph; returns the GCP token"""
+    ctx.set_result('custom_token', get_custom_token(ctx))
+    ctx.set_result('id_token', get_id_token(ctx))
+    ctx.set_result('gcp_token', get_gcp_token(ctx))
+    return ctx.gcp_token
@@ -0,0 +1,298 @@
+"""
+Large object uploads to Cloud Storage
+Resumable uploads stream a file from disk in fixed-size chunks; a failed chunk
+is retried with backoff after asking the session how many bytes it already
+committed, so a weak uplink only resends what was lost. Parallel composite
+uploads send ranges of the file as separate objects concurrently and then
+compose them into the destination. Composite objects carry a CRC32C but no
+MD5 hash.
+"""
+
+import math
+import os
+import random
+import tempfile
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
+from urllib.parse import quote
+
+import requests
+
+KIB = 1024
+MIB = 1024 * KIB
+# Every resumable chunk except the last must be a multiple of 256 KiB
+CHUNK_ALIGNMENT = 256 * KIB
+DEFAULT_CHUNK_SIZE = 8 * MIB
+MAX_COMPOSE_SOURCES = 32
+RETRYABLE_STATUS = {408, 429, 500, 502, 503, 504}
+
+
+class UploadError(Exception):
+    """An upload could not be completed"""
+
+
+def align_chunk_size(chunk_size: int) -> int:
+    return max(CHUNK_ALIGNMENT, chunk_size // CHUNK_ALIGNMENT * CHUNK_ALIGNMENT)
+
+
+def backoff(attempt: int, response: Optional[requests.Response] = None):
+    """Sleep for Retry-After if the server sent one, else exponential backoff with jitter"""
+    retry_after = response.headers.get('Retry-After') if response is not None else None
+    delay = float(retry_after) if retry_after and retry_after.isdigit() else \
+        min(32.0, 0.5 * 2 ** attempt) * random.uniform(0.5, 1.0)
+    time.sleep(delay)
+
+
+def send_with_retries(send, max_retries: int = 6) -> requests.Response:
+    """Call send() until it returns a non-retryable response; raises for HTTP errors"""
+    for attempt in range(1, max_retries + 2):
+        response = None
+        try:
+            response = send()
+            if response.status_code not in RETRYABLE_STATUS:
+                break
+        except (requests.ConnectionError, requests.Timeout):
+            if attempt > max_retries:
+                raise
+        if attempt <= max_retries:
+            backoff(attempt, response)
+    response.raise_for_status()
+    return response
+
+
+class ResumableUpload:
+    """Upload length bytes of a file starting at offset, one chunk in memory at a time"""
+
+    def __init__(self, session: requests.Session, storage_url: str, bucket: str, name: str,
+                 token: str, chunk_size: int = DEFAULT_CHUNK_SIZE,
+                 content_type: str = 'application/octet-stream', max_retries: int = 6,
+                 timeout: float = 120):
+        self.session = session
+        self.storage_url = storage_url.rstrip('/')
+        self.bucket = bucket
+        self.name = name
+        self.token = token
+        self.chunk_size = align_chunk_size(chunk_size)
+        self.content_type = content_type
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.retries = 0
+        self.chunks = 0
+
+    def _start(self, length: int) -> str:
+        response = send_with_retries(lambda: self.session.post(
+            f"{self.storage_url}/upload/storage/v1/b/{self.bucket}/o",
+            params={'uploadType': 'resumable', 'name': self.name},
+            headers={"Authorization": f"Bearer {self.token}",
+                     "Content-Type": "application/json",
+                     "X-Upload-Content-Type": self.content_type,
+                     "X-Upload-Content-Length": str(length)},
+            json={}, timeout=self.timeout), self.max_retries)
+        return response.headers['Location']
+
+    def _put(self, session_url: str, data: bytes, content_range: str) -> requests.Response:
+        return self.session.put(session_url, data=data, allow_redirects=False, timeout=self.timeout,
+                                headers={"Authorization": f"Bearer {self.token}",
+                                         "Content-Range": content_range})
+
+    @staticmethod
+    def _persisted(response: requests.Response) -> int:
+        """Bytes persisted according to a 308's Range header (absent means none)"""
+        committed = response.headers.get('Range')
+        return int(committed.rsplit('-', 1)[1]) + 1 if committed else 0
+
+    def upload(self, path: str, offset: int = 0, length: Optional[int] = None) -> dict:
+        if length is None:
+            length = os.path.getsize(path) - offset
+        started = time.perf_counter()
+        session_url = self._start(length)
+
+        position = 0
+        attempt = 0
+        # After a failure the next request only asks how far the session got
+        query = False
+        result = None
+        with open(path, 'rb') as f:
+            while result is None:
+                if query:
+                    data, content_range = b'', f"bytes */{length}"
+                else:
+                    f.seek(offset + position)
+                    data = f.read(min(self.chunk_size, length - position))
+                    content_range = f"bytes {position}-{position + len(data) - 1}/{length}" \
+                        if data else f"bytes */{length}"
+                response = None
+                try:
+                    response = self._put(session_url, data, content_range)
+                except (requests.ConnectionError, requests.Timeout) as e:
+                    failure = str(e)
+                else:
+                    if data:
+                        self.chunks += 1
+                    if response.status_code in (200, 201):
+                        result = response.json()
+                        continue
+                    if response.status_code == 308:
+                        position = self._persisted(response)
+                        attempt = 0
+                        query = False
+                        continue
+                    if response.status_code not in RETRYABLE_STATUS:
+                        response.raise_for_status()
+                        raise UploadError(f"Unexpected status {response.status_code}")
+                    failure = f"HTTP {response.status_code}"
+
+                attempt += 1
+                self.retries += 1
+                if attempt > self.max_retries:
+                    raise UploadError(f"Upload of {self.name} stalled at byte {position} "
+                                      f"after {attempt} attempts: {failure}")
+                backoff(attempt, response)
+                query = True
+
+        seconds = time.perf_counter() - started
+        return {
+            'name': result.get('name', self.name),
+            'bytes': length,
+            'seconds': round(seconds, 3),
+            'mb_per_second': round(length / MIB / seconds, 2) if seconds else None,
+            'chunks': self.chunks,
+            'retries': self.retries
+        }
+
+
+def _delete(session: requests.Session, storage_url: str, bucket: str, name: str, token: str):
+    try:
+        session.delete(f"{storage_url}/storage/v1/b/{bucket}/o/{quote(name, safe='')}",
+                       headers={"Authorization": f"Bearer {token}"}, timeout=30)
+    except requests.RequestException:
+        pass
+
+
+def compose(session: requests.Session, storage_url: str, bucket: str, name: str, sources: List[str],
+            token: str, content_type: str = 'application/octet-stream') -> List[str]:
+    """Compose sources into name, in rounds of 32; returns intermediates to delete"""
+    storage_url = storage_url.rstrip('/')
+    intermediates = []
+    round_number = 0
+    while len(sources) > MAX_COMPOSE_SOURCES:
+        grouped = []
+        for start in range(0, len(sources), MAX_COMPOSE_SOURCES):
+            target = f"{name}.compose-{round_number}-{start // MAX_COMPOSE_SOURCES:04d}"
+            compose(session, storage_url, bucket, target, sources[start:start + MAX_COMPOSE_SOURCES],
+                    token, content_type)
+            grouped.append(target)
+        intermediates.extend(grouped)
+        sources = grouped
+        round_number += 1
+
+    send_with_retries(lambda: session.post(
+        f"{storage_url}/storage/v1/b/{bucket}/o/{quote(name, safe='')}/compose",
+        headers={"Authorization": f"Bearer {token}", "Content-Type": "application/json"},
+        json={'sourceObjects': [{'name': source} for source in sources],
+              'destination': {'contentType': content_type}},
+        timeout=120))
+    return intermediates
+
+
+def parallel_composite_upload(storage_url: str, bucket: str, name: str, path: str, token: str,
+                              parts: int = 8, chunk_size: int = DEFAULT_CHUNK_SIZE,
+                              content_type: str = 'application/octet-stream') -> dict:
+    """Upload ranges of path concurrently as temporary objects, then compose them"""
+    size = os.path.getsize(path)
+    part_size = max(CHUNK_ALIGNMENT, math.ceil(size / parts / CHUNK_ALIGNMENT) * CHUNK_ALIGNMENT)
+    ranges = [(offset, min(part_size, size - offset)) for offset in range(0, size, part_size)] or [(0, 0)]
+    prefix = f"{name}.part-{uuid.uuid4().hex[:8]}"
+    part_names = [f"{prefix}-{index:04d}" for index in range(len(ranges))]
+    started = time.perf_counter()
+
+    def upload_part(index: int) -> dict:
+        offset, length = ranges[index]
+        with requests.Session() as session:
+            return ResumableUpload(session, storage_url, bucket, part_names[index], token,
+                                   chunk_size=chunk_size).upload(path, offset, length)
+
+    intermediates = []
+    with requests.Session() as session:
+        try:
+            with ThreadPoolExecutor(max_workers=len(ranges)) as pool:
+                results = list(pool.map(upload_part, range(len(ranges))))
+            uploaded = time.perf_counter() - started
+            intermediates = compose(session, storage_url, bucket, name, part_names, token, content_type)
+        finally:
+            with ThreadPoolExecutor(max_workers=16) as pool:
+                for part in part_names + intermediates:
+                    pool.submit(_delete, session, storage_url.rstrip('/'), bucket, part, token)
+
+    seconds = time.perf_counter() - started
+    return {
+        'name': name,
+        'bytes': size,
+        'parts': len(ranges),
+        'seconds': round(seconds, 3),
+        'upload_seconds': round(uploaded, 3),
+        'compose_seconds': round(seconds - uploaded, 3),
+        'mb_per_second': round(size / MIB / seconds, 2) if seconds else None,
+        'chunks': sum(r['chunks'] for r in results),
+        'retries': sum(r['retries'] for r in results)
+    }
+
+
+def make_test_file(size: int, directory: Optional[str] = None) -> str:
+    """Random bytes written 1 MiB at a time so the file never sits in memory"""
+    fd, path = tempfile.mkstemp(prefix='upload-bench-', suffix='.bin', dir=directory)
+    with os.fdopen(fd, 'wb') as f:
+        remaining = size
+        while remaining:
+            block = os.urandom(min(MIB, remaining))
+            f.write(block)
+            remaining -= len(block)
+    return path
+
+
+def run_benchmark(storage_url: str, bucket: str, token: str, size: int, chunk_sizes: List[int],
+                  parallelism: List[int], log=print) -> dict:
+    """Upload one test file at every chunk size x parallelism and report throughput
+
+    Parallelism 1 is a plain resumable upload; higher values are parallel
+    composite uploads with that many parts.
+    """
+    path = make_test_file(size)
+    rows = []
+    try:
+        for chunk_size in chunk_sizes:
+            for parts in parallelism:
+                name = f"upload-bench/{uuid.uuid4().hex[:8]}-{chunk_size // KIB}k-x{parts}.bin"
+                row = {'chunk_size_kib': align_chunk_size(chunk_size) // KIB, 'parallel': parts,
+                       'mode': 'resumable' if parts == 1 else 'composite'}
+                try:
+                    if parts == 1:
+                        with requests.Session() as session:
+                            result = ResumableUpload(session, storage_url, bucket, name, token,
+                                                     chunk_size=chunk_size).upload(path)
+                    else:
+                        result = parallel_composite_upload(storage_url, bucket, name, path, token,
+                                                           parts=parts, chunk_size=chunk_size)
+                    row.update(result)
+                except (requests.RequestException, UploadError) as e:
+                    row['error'] = str(e)[:200]
+                finally:
+                    with requests.Session() as session:
+                        _delete(session, storage_url.rstrip('/'), bucket, name, token)
+                rows.append(row)
+                log(f"   {row['mode']:<10} chunk {row['chunk_size_kib']:>6} KiB x{parts:<3} "
+                    + (f"{row['mb_per_second']:>8.2f} MB/s, {row['retries']} retries"
+                       if 'error' not in row else f"failed: {row['error']}"))
+    finally:
+        os.remove(path)
+
+    best = max((row for row in rows if 'error' not in row), key=lambda r: r['mb_per_second'], default=None)
+    return {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'bucket': bucket,
+        'size_bytes': size,
+        'results': rows,
+        'best': best and {k: best[k] for k in ('mode', 'chunk_size_kib', 'parallel', 'mb_per_second')}
+    }